@@ -1,64 +1,183 @@
-import io
+import asyncio
+from typing import Optional
 
 import chainlit as cl
-from PIL import Image
-
-from components.chainlit.create_retriever import create_retriever
+from chainlit.server import app as server_app
+from fastapi.responses import PlainTextResponse
+
+from components.chainlit.create_retriever import (
+    create_corpus_retriever,
+    create_retriever,
+    release_index,
+)
+from components.chainlit.live_answer import LiveAnswer
 from components.chainlit.run_rag_workflow import run_rag_workflow
+from components.corpus_index import CorpusIndex
+from components.graph_image import render_workflow_graph
+from components.profiler import profile_request, should_profile, should_profile_session
 from components.rag_workflow import RAGWorkflow
+from components.telemetry import RequestTracer, metrics, traced_names
+from config import settings
+
+# The graph is the same for every session, the retriever is passed in the run config
+rag_app = RAGWorkflow().create_workflow().compile()
+workflow_graph_path = render_workflow_graph(rag_app)
+
+
+@server_app.get("/metrics")
+async def prometheus_metrics():
+    """Metrics of the RAG workflow in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+if settings.AUTH_USER_HEADER:
+
+    @cl.header_auth_callback
+    def header_auth_callback(headers) -> Optional[cl.User]:
+        """Authenticate the user named by the proxy in front of the app."""
+        identifier = headers.get(settings.AUTH_USER_HEADER)
+
+        return cl.User(identifier=identifier) if identifier else None
 
 
 @cl.on_chat_start
 async def on_chat_start():
     files = None
 
-    # Wait for the user to upload a file
+    # Wait for the user to upload files, several are searched as one corpus
     while files is None:
         files = await cl.AskFileMessage(
-            content="Please upload a PDF file to begin!",
+            content="Please upload one or more PDF files to begin!",
             accept=["application/pdf"],
             max_size_mb=20,
+            max_files=settings.MAX_UPLOAD_FILES,
             timeout=180,
         ).send()
 
-    file = files[0]
+    label = f"`{files[0].name}`" if len(files) == 1 else f"{len(files)} documents"
 
-    msg = cl.Message(content=f"Processing `{file.name}`...")
+    msg = cl.Message(content=f"Processing {label}...")
     await msg.send()
 
-    retriever = await create_retriever(file)
-
-    rag_workflow = RAGWorkflow(retriever=retriever)
-    workflow = rag_workflow.create_workflow()
-    app = workflow.compile()
-
-    # Generate and save the workflow graph
-    img_data = app.get_graph().draw_mermaid_png()
-    img = Image.open(io.BytesIO(img_data))
-    img.save("resources/rag_workflow.png")
-    image = cl.Image(
-        path="resources/rag_workflow.png", name="rag_workflow", display="side"
-    )
-    # Attach the image to the message
-    await cl.Message(
-        content="Here is the workflow graph: rag_workflow",
-        elements=[image],
-    ).send()
+    session_profiled = should_profile_session()
+    cl.user_session.set("profiled", session_profiled)
+    with profile_request(msg.id, should_profile(session_profiled)):
+        if len(files) == 1:
+            retriever = await create_retriever(files[0])
+        else:
+            retriever = await create_corpus_retriever(files)
+    index = retriever.index
+    # Stored first, so that the index is released however the session ends
+    cl.user_session.set("index", index)
+
+    if workflow_graph_path is not None:
+        image = cl.Image(path=workflow_graph_path, name="rag_workflow", display="side")
+        # Attach the image to the message
+        await cl.Message(
+            content="Here is the workflow graph: rag_workflow",
+            elements=[image],
+        ).send()
 
     # Let the user know that the system is ready
-    msg.content = f"Processing `{file.name}` done. You can now ask questions!"
+    if index.done:
+        msg.content = f"Processing {label} done. You can now ask questions!"
+    elif isinstance(index, CorpusIndex):
+        msg.content = (
+            f"Processing {label}: {len(index.indexed_documents())} of"
+            f" {len(index.indexes)} indexed. You can now ask questions, answers cover"
+            " the pages indexed so far until processing is done."
+        )
+        asyncio.create_task(notify_indexing_done(msg, label, index))
+    elif index.previous is not None:
+        msg.content = (
+            f"Processing {label}: updating the index of its previous revision."
+            " You can now ask questions, answers use the previous revision until"
+            " processing is done."
+        )
+        asyncio.create_task(notify_indexing_done(msg, label, index))
+    else:
+        msg.content = (
+            f"Processing {label}: pages {index.covered_pages()} of"
+            f" {index.num_pages} indexed. You can now ask questions, answers cover"
+            " the indexed pages until processing is done."
+        )
+        asyncio.create_task(notify_indexing_done(msg, label, index))
+    if isinstance(index, CorpusIndex) and index.unopened:
+        msg.content += f" Could not open {format_names(index.unopened)}."
     await msg.update()
 
-    cl.user_session.set("app", app)
-    cl.user_session.set("file_path", file.path)
+    if isinstance(index, CorpusIndex):
+        files = index.files
+    else:
+        files = {index.key: files[0]}
+    cl.user_session.set("retriever", retriever)
+    cl.user_session.set("files", files)
+
+
+@cl.on_chat_end
+async def on_chat_end():
+    index = cl.user_session.get("index")
+    if index is not None:
+        release_index(index)
+
+
+def format_names(names) -> str:
+    return ", ".join(f"`{name}`" for name in names)
+
+
+async def notify_indexing_done(msg: cl.Message, label: str, index):
+    """Update the processing message once the background indexing finishes."""
+    try:
+        await index.wait_done()
+        msg.content = f"Processing {label} done. All pages are indexed."
+    except Exception:
+        if isinstance(index, CorpusIndex):
+            msg.content = (
+                f"Processing {label} done, except"
+                f" {format_names(index.failed_documents())}, which could not be"
+                " indexed."
+            )
+        elif index.previous is not None:
+            msg.content = (
+                f"Processing {label} failed. Answers keep using the previous revision"
+                " of the document."
+            )
+        elif index.indexed_pages:
+            msg.content = (
+                f"Processing {label} failed. Only pages {index.covered_pages()}"
+                " are indexed."
+            )
+        else:
+            msg.content = f"Processing {label} failed, no page could be indexed."
+    await msg.update()
 
 
 @cl.on_message
 async def main(message: cl.Message):
-    app = cl.user_session.get("app")  # type: RAGWorkflow
-    file_path = cl.user_session.get("file_path")
+    retriever = cl.user_session.get("retriever")
+    files = cl.user_session.get("files")
     inputs = {"question": message.content, "iterations": 0}
-
-    answer, pdf_elements = await run_rag_workflow(app, inputs, file_path)
-
-    await cl.Message(content=answer, elements=pdf_elements).send()
+    config = {"configurable": {"retriever": retriever}}
+
+    index = cl.user_session.get("index")
+    # Answers over a partial index are not cached
+    document_key = index.key if index.done else None
+
+    live_answer = LiveAnswer()
+    tracer = RequestTracer(traced_names(rag_app), request_id=message.id)
+    profiled = should_profile(cl.user_session.get("profiled", False))
+    with profile_request(message.id, profiled):
+        answer, pdf_elements = await run_rag_workflow(
+            rag_app, inputs, files, config, document_key, live_answer, tracer
+        )
+
+    # Only a single document is answered from a previous revision
+    if isinstance(index, CorpusIndex):
+        if not index.done:
+            answer += "\nAnswered from the pages of the documents indexed so far."
+    elif index.previous is not None and not index.done:
+        answer += "\nAnswered from the previous revision of the document."
+    elif not index.done:
+        answer += f"\nAnswered from pages {index.covered_pages()} indexed so far."
+
+    await live_answer.send(answer, pdf_elements)
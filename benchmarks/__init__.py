@@ -0,0 +1,27 @@
+"""Offline benchmarks for the RAG pipeline.
+
+The benchmarks never call a remote provider, so the provider settings required by
+`config.settings` are filled with placeholders when they are not set.
+"""
+
+import os
+
+for key, value in {
+    "EMBEDDING_MODEL": "voyage-large-2",
+    "CHUNK_SIZE": "1000",
+    "CHUNK_OVERLAP": "200",
+    "VOYAGE_API_KEY": "offline",
+    "OPENAI_API_KEY": "offline",
+    "GOOGLE_API_KEY": "offline",
+    "GOOGLE_API_KEY_B": "offline",
+    "YI_API_KEY": "offline",
+    "YI_BASE_URL": "http://localhost",
+    # The fake providers have no quota to protect
+    "LLM_RATE_LIMITS": "{}",
+    # Verdicts of the fake graders must not end up in the calibration log, and the
+    # synthetic chunks quote the question, so the pre-grader would accept them all
+    "GRADER_VERDICT_LOG": "",
+    "TRACE_LOG": "",
+    "PRE_GRADER_ENABLED": "false",
+}.items():
+    os.environ.setdefault(key, value)
@@ -0,0 +1,62 @@
+"""Calibrate the pre-grader thresholds from logged LLM grader verdicts.
+
+Prints the thresholds to set in the environment, and replays the log to show how many
+LLM grader calls they avoid and how often they agree with the LLM grader.
+
+Usage:
+    python -m benchmarks.calibrate_pre_grader --log resources/grader_verdicts.jsonl
+"""
+
+import argparse
+import json
+
+from components.pre_grader import PreGrader, calibrate
+from config import settings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--log",
+        default=settings.GRADER_VERDICT_LOG,
+        required=not settings.GRADER_VERDICT_LOG,
+    )
+    parser.add_argument("--precision", type=float, default=0.95)
+    parser.add_argument("--min-samples", type=int, default=20)
+    args = parser.parse_args()
+
+    thresholds = calibrate(args.log, args.precision, args.min_samples)
+    # Thresholds that cannot be calibrated never decide a chunk
+    defaults = {
+        "accept_score": float("inf"),
+        "reject_score": float("-inf"),
+        "accept_overlap": float("inf"),
+        "reject_overlap": float("-inf"),
+    }
+    thresholds = {
+        name: value if value is not None else defaults[name]
+        for name, value in thresholds.items()
+    }
+    for name, value in thresholds.items():
+        print(f"PRE_GRADER_{name.upper()}={value}")
+
+    pre_grader = PreGrader(**thresholds)
+    agreed = decided = total = 0
+    with open(args.log) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            total += 1
+            verdict = pre_grader.decide(record["vector_score"], record["overlap"])
+            if verdict is not None:
+                decided += 1
+                agreed += verdict == record["verdict"]
+
+    print(f"\n{total} logged verdicts")
+    print(f"LLM grader calls avoided: {decided} ({decided / max(total, 1):.1%})")
+    print(f"Agreement with the LLM grader: {agreed / max(decided, 1):.1%}")
+
+
+if __name__ == "__main__":
+    main()
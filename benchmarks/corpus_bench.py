@@ -0,0 +1,188 @@
+"""Benchmark of the parallel ingestion and the search of a corpus of documents.
+
+Sample PDFs are generated and indexed as one corpus, as in a multi-file upload: every
+document is started with `ProgressiveIndex.start` without waiting for its first batch,
+for each combination of parser processes (`INGEST_WORKERS`) and documents indexed at
+once (`INGEST_MAX_DOCUMENTS`). Embedding uses a hashing embedder with a simulated API
+latency behind `ConcurrencyLimitedEmbeddings`.
+
+Reports ingestion pages/s and chunks/s, the peak number of embedding requests in
+flight, which never exceeds `EMBEDDING_MAX_CONCURRENCY`, and the share of questions
+whose source document and page are among the top k chunks found by `CorpusIndex`.
+The sample documents differ by the counterparty they name, which the questions name
+too.
+
+Usage:
+    python -m benchmarks.corpus_bench --documents 24 --pages 20 --workers 1 4 \
+        --max-documents 1 4 --latency 0.05
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+import components.progressive_index as progressive_index
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.sample_pdfs import sample_document, write_pdf
+from components.corpus_index import CorpusIndex
+from components.document_loader import load_documents, shutdown_executor
+from components.index_cache import index_cache
+from components.progressive_index import ProgressiveIndex
+from components.rate_limiter import ConcurrencyLimitedEmbeddings, EmbeddingSlots
+from config import settings
+
+
+class InFlightEmbeddings(Embeddings):
+    """Embeddings that record the peak number of concurrent requests."""
+
+    def __init__(self, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _call(self, embed, argument):
+        with self._lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            return embed(argument)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._call(self.embeddings.embed_documents, texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._call(self.embeddings.embed_query, text)
+
+
+async def ingest(
+    files: Dict[str, SimpleNamespace], embeddings: Embeddings
+) -> Dict[str, ProgressiveIndex]:
+    indexes = {
+        key: await ProgressiveIndex.start(
+            file.path, key, wait=False, embeddings=embeddings
+        )
+        for key, file in files.items()
+    }
+    await asyncio.gather(*(index.wait_done() for index in indexes.values()))
+
+    return indexes
+
+
+def source_hit_rate(
+    corpus: CorpusIndex, questions: List[Tuple[str, str, int]], k: int
+) -> float:
+    hits = 0
+    for key, question, page in questions:
+        found = {
+            (doc.metadata["document_id"], doc.metadata["page"])
+            for doc in corpus.search(question, k)
+        }
+        hits += (key, page) in found
+
+    return hits / max(len(questions), 1)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=24)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count()])
+    parser.add_argument("--max-documents", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--embedding-concurrency", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    slots = EmbeddingSlots(args.embedding_concurrency)
+    with tempfile.TemporaryDirectory() as directory:
+        files: Dict[str, SimpleNamespace] = {}
+        questions: List[Tuple[str, str, int]] = []
+        for seed in range(args.documents):
+            pages, document_questions = sample_document(args.pages, seed=seed)
+            # The sample documents only differ by their counterparty, which the
+            # questions name, as questions about a corpus name their document
+            party = f"Contractor{seed}"
+            pages = [f"Agreement with {party}. {page}" for page in pages]
+            document_questions = [
+                f"{question[:-1]} of the agreement with {party}?"
+                for question in document_questions
+            ]
+            path = os.path.join(directory, f"document-{seed}.pdf")
+            write_pdf(path, pages)
+            key = index_cache.key_for(path)
+            files[key] = SimpleNamespace(name=os.path.basename(path), path=path)
+            questions.extend(
+                (key, question, page)
+                for page, question in enumerate(document_questions[: args.questions])
+            )
+        num_pages = args.documents * args.pages
+        hit_rate = None
+
+        print(
+            f"{args.documents} documents of {args.pages} pages, embedding latency"
+            f" {args.latency * 1000:.0f} ms, at most {args.embedding_concurrency}"
+            f" embedding requests in flight, {os.cpu_count()} CPUs"
+        )
+        print(
+            f"  {'workers':>7} {'documents':>9} {'seconds':>8} {'pages/s':>8}"
+            f" {'chunks/s':>9} {'peak requests':>13}"
+        )
+        for workers in args.workers:
+            settings.INGEST_WORKERS = workers
+            shutdown_executor()
+            # Starts the parser processes outside of the measurements
+            load_documents(next(iter(files.values())).path)
+            for max_documents in args.max_documents:
+                settings.INGEST_MAX_DOCUMENTS = max_documents
+                progressive_index._build_slots = None
+                index_cache.root_directory = tempfile.mkdtemp(dir=directory)
+                counter = InFlightEmbeddings(
+                    HashingEmbeddings(latency=args.latency, dense=True)
+                )
+                embeddings = ConcurrencyLimitedEmbeddings(counter, slots=slots)
+
+                start = time.perf_counter()
+                indexes = asyncio.run(ingest(files, embeddings))
+                seconds = time.perf_counter() - start
+                num_chunks = sum(
+                    len(index.lexical_index) for index in indexes.values()
+                )
+                print(
+                    f"  {workers:>7} {max_documents:>9} {seconds:>8.2f}"
+                    f" {num_pages / seconds:>8.1f} {num_chunks / seconds:>9.1f}"
+                    f" {counter.peak:>13}"
+                )
+
+                if hit_rate is None:
+                    corpus = CorpusIndex(
+                        indexes=indexes, files=files, embeddings=embeddings
+                    )
+                    hit_rate = source_hit_rate(corpus, questions, args.k)
+                for index in indexes.values():
+                    index.close()
+        shutdown_executor()
+
+    print(f"source document and page in the top {args.k}: {hit_rate:.1%}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
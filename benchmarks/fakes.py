@@ -0,0 +1,206 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import numpy as np
+
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+from components.context_packer import estimate_tokens
+
+
+def grader_kind(prompt: str) -> str:
+    """Which grader a prompt is from, told apart by the wording of its prompt."""
+    if "Retrieved documents" in prompt:
+        return "batch_retrieval"
+    if "Retrieved document" in prompt:
+        return "retrieval"
+    if "Set of facts" in prompt:
+        return "hallucination"
+
+    return "answer"
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model stand-in with a fixed latency.
+
+    Prompts that ask for a `binary_score` (the graders) are answered with a JSON verdict,
+    every other prompt with `answer`, streamed word by word. Verdicts are "yes" with
+    `yes_probability`, or with the probability set for the grader in
+    `grader_yes_probabilities` ("retrieval", "hallucination" or "answer"). The batch
+    retrieval grader gets one "retrieval" verdict per numbered document, or with
+    `malformed_probability` a reply that cannot be parsed.
+    """
+
+    latency: float = 0.2
+    yes_probability: float = 1.0
+    grader_yes_probabilities: Dict[str, float] = {}
+    answer: str = "This is a generated answer."
+    malformed_probability: float = 0.0
+    seed: int = 0
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    _random: random.Random = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _reply(self, messages: List[BaseMessage]) -> ChatResult:
+        self.calls += 1
+        prompt = "\n".join(str(message.content) for message in messages)
+        kind = grader_kind(prompt)
+        if kind == "batch_retrieval":
+            content = self._batch_verdicts(prompt)
+        elif "binary_score" in prompt:
+            yes_probability = self.grader_yes_probabilities.get(
+                kind, self.yes_probability
+            )
+            verdict = "yes" if self._random.random() < yes_probability else "no"
+            content = f'{{"binary_score": "{verdict}"}}'
+        else:
+            content = self.answer
+        self.prompt_tokens += estimate_tokens(prompt)
+        self.completion_tokens += estimate_tokens(content)
+
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    def _batch_verdicts(self, prompt: str) -> str:
+        if self._random.random() < self.malformed_probability:
+            return "Documents 1 and 2 are relevant."
+
+        yes_probability = self.grader_yes_probabilities.get(
+            "retrieval", self.yes_probability
+        )
+        grades = []
+        for index in re.findall(r"^\s*\[(\d+)\] ", prompt, flags=re.MULTILINE):
+            verdict = "yes" if self._random.random() < yes_probability else "no"
+            grades.append({"index": int(index), "binary_score": verdict})
+
+        return json.dumps({"grades": grades})
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        time.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self._reply(messages)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        result = await self._agenerate(messages)
+        for token in re.split(r"(?<=\s)", result.generations[0].message.content):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+
+class FakeRetriever(BaseRetriever):
+    """Retriever stand-in returning `k` synthetic chunks after a fixed latency."""
+
+    latency: float = 0.05
+    k: int = 4
+
+    def _documents(self, query: str) -> List[Document]:
+        return [
+            Document(
+                page_content=f"Synthetic chunk {i} related to: {query}",
+                metadata={"source": "synthetic.pdf", "page": i},
+            )
+            for i in range(self.k)
+        ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        time.sleep(self.latency)
+        return self._documents(query)
+
+    async def _aget_relevant_documents(
+        self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        await asyncio.sleep(self.latency)
+        return self._documents(query)
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic embedding stand-in hashing the words of a text into `size` buckets.
+
+    Texts that share words get similar embeddings, so searches behave plausibly. With
+    `dense`, each word is hashed to a random Gaussian vector instead of a bucket, which
+    gives the dense, continuous vectors of real embedding models, e.g. to measure
+    quantization.
+    """
+
+    def __init__(self, size: int = 256, latency: float = 0.0, dense: bool = False):
+        self.size = size
+        self.latency = latency
+        self.dense = dense
+        self._word_vectors: Dict[str, np.ndarray] = {}
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            rng = np.random.default_rng(int.from_bytes(digest, "little"))
+            vector = rng.standard_normal(self.size).astype(np.float32)
+            self._word_vectors[word] = vector
+
+        return vector
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.size, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            if self.dense:
+                vector += self._word_vector(word)
+                continue
+            digest = hashlib.blake2b(word.encode(), digest_size=8).digest()
+            bucket = int.from_bytes(digest[:4], "little") % self.size
+            vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+        vector /= np.linalg.norm(vector) or 1.0
+
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
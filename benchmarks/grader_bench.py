@@ -0,0 +1,122 @@
+"""Benchmark of listwise batch grading against grading one document per call.
+
+Runs `grade_documents` over the same questions and retrieved chunks with
+`GRADER_MODE` "per_document" and "batch", using a fake chat model, and reports the LLM
+calls, the estimated prompt and completion tokens and the latency per question. With
+--malformed, a share of the batch replies cannot be parsed, to measure the cost of the
+fallback to per-document grading.
+
+Usage:
+    python -m benchmarks.grader_bench --questions 20 --k 5 8 --latency 0.2
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from benchmarks.fakes import FakeChatModel
+from benchmarks.sample_pdfs import sample_document
+from components.rag_workflow import RAGWorkflow
+from components.verdict_cache import verdict_caches
+from config import settings
+
+MODES = ["per_document", "batch"]
+
+
+def sample_chunks(num_pages: int, seed: int) -> List[Document]:
+    """Chunks of `settings.CHUNK_SIZE` characters of a sample document."""
+    pages, _ = sample_document(num_pages, seed=seed)
+    size = settings.CHUNK_SIZE
+    return [
+        Document(page_content=text[i : i + size], metadata={"page": page})
+        for page, text in enumerate(pages)
+        for i in range(0, len(text), size)
+    ]
+
+
+async def grade_all(workflow: RAGWorkflow, retrievals: List[Dict]) -> List[float]:
+    seconds = []
+    for state in retrievals:
+        start = time.perf_counter()
+        await workflow.grade_documents(dict(state), {})
+        seconds.append(time.perf_counter() - start)
+
+    return seconds
+
+
+def bench_mode(mode: str, retrievals: List[Dict], args) -> Dict:
+    settings.GRADER_MODE = mode
+    for cache in verdict_caches.values():
+        cache.clear()
+
+    llm = FakeChatModel(
+        latency=args.latency,
+        seed=args.seed,
+        yes_probability=args.retrieval_yes,
+        malformed_probability=args.malformed,
+    )
+    workflow = RAGWorkflow(llm=llm, llm1=llm)
+    seconds = asyncio.run(grade_all(workflow, retrievals))
+    questions = len(retrievals)
+
+    return {
+        "calls_per_question": llm.calls / questions,
+        "prompt_tokens_per_question": llm.prompt_tokens / questions,
+        "completion_tokens_per_question": llm.completion_tokens / questions,
+        "p50_ms": 1000 * statistics.median(seconds),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 8])
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--retrieval-yes", type=float, default=0.7)
+    parser.add_argument("--malformed", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="ERROR")
+
+    chunks = sample_chunks(args.pages, args.seed)
+    _, questions = sample_document(args.pages, seed=args.seed)
+    rng = random.Random(args.seed)
+    for k in args.k:
+        retrievals = [
+            {"question": question, "documents": rng.sample(chunks, k)}
+            for question in rng.sample(questions, min(args.questions, len(questions)))
+        ]
+        results = {mode: bench_mode(mode, retrievals, args) for mode in MODES}
+
+        print(f"\nk={k}, {len(retrievals)} questions")
+        print(
+            f"  {'mode':<14} {'calls':>7} {'prompt tok':>11} {'output tok':>11} "
+            f"{'p50 ms':>8}"
+        )
+        for mode, result in results.items():
+            print(
+                f"  {mode:<14} {result['calls_per_question']:>7.2f} "
+                f"{result['prompt_tokens_per_question']:>11.0f} "
+                f"{result['completion_tokens_per_question']:>11.0f} "
+                f"{result['p50_ms']:>8.0f}"
+            )
+        per_document, batch = results["per_document"], results["batch"]
+        for metric in ("calls_per_question", "prompt_tokens_per_question"):
+            change = batch[metric] / per_document[metric] - 1
+            print(f"  {metric.replace('_', ' ')}: {change:+.0%} in batch mode")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""Load test of the RAG graph with concurrent chat sessions.
+
+All sessions share one compiled graph, as in `app.py`, pass their own retriever in the
+run config and ask their questions one after the other on the same event loop. With
+async nodes the throughput grows with the number of sessions until the providers
+become the bottleneck.
+
+Each load is measured after a warm-up question, which pays the one-time costs of the
+first run, and the median of `--repeats` runs is reported.
+
+Usage:
+    python -m benchmarks.load_test --sessions 1 2 4 8 16 --questions 3 --repeats 5
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+from loguru import logger
+
+from benchmarks.fakes import FakeChatModel, FakeRetriever
+from components.rag_workflow import RAGWorkflow
+
+
+async def run_session(app, questions: int) -> None:
+    config = {"configurable": {"retriever": FakeRetriever()}}
+    for i in range(questions):
+        inputs = {"question": f"Question {i}?", "iterations": 0}
+        async for _ in app.astream_events(inputs, config, version="v2"):
+            pass
+
+
+async def run_load(
+    sessions: int, questions: int, latency: float, repeats: int
+) -> float:
+    app = (
+        RAGWorkflow(
+            llm=FakeChatModel(latency=latency), llm1=FakeChatModel(latency=latency)
+        )
+        .create_workflow()
+        .compile()
+    )
+    await run_session(app, questions=1)
+
+    throughputs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await asyncio.gather(*(run_session(app, questions) for _ in range(sessions)))
+        elapsed = time.perf_counter() - start
+        throughputs.append(sessions * questions / elapsed)
+
+    return statistics.median(throughputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--questions", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    print(f"{'sessions':>8} {'questions/s':>12} {'speedup':>8}")
+    baseline = None
+    for sessions in args.sessions:
+        throughput = asyncio.run(
+            run_load(sessions, args.questions, args.latency, args.repeats)
+        )
+        baseline = baseline or throughput
+        print(f"{sessions:>8} {throughput:>12.2f} {throughput / baseline:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""Offline benchmark of ingestion, indexing and the RAG graph.
+
+Sample PDFs are generated (or given with --pdf), parsed with `load_documents`, indexed
+with `build_index` using a hashing embedder, and questioned through the compiled
+`RAGWorkflow` graph with fake chat models. Nothing calls a remote provider.
+
+Reports ingestion pages/s, indexing chunks/s, per-node latency, LLM calls per
+question and peak RSS. With --baseline, exits with status 1 when a metric regressed
+by more than --tolerance against a previous --output, so it can gate CI.
+
+Usage:
+    python -m benchmarks.pipeline_bench --pages 20 120 --questions 10 --output bench.json
+    python -m benchmarks.pipeline_bench --pages 20 120 --baseline bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+from benchmarks.fakes import FakeChatModel, HashingEmbeddings
+from benchmarks.sample_pdfs import sample_document, write_pdf
+from components.document_loader import (
+    count_pages,
+    load_documents,
+    shutdown_executor,
+)
+from components.index_builder import build_index
+from components.lexical_index import LexicalIndex
+from components.progressive_index import ProgressiveIndex, ProgressiveRetriever
+from components.rag_workflow import RAGWorkflow
+from config import settings
+
+NODES = {
+    "retrieve",
+    "grade_documents",
+    "generate",
+    "transform_query",
+    "multi_query_retrieve",
+    "end_with_message",
+    "decide_to_generate",
+    "grade_generation_v_documents_and_question",
+}
+
+# Metrics compared against a baseline, and whether higher values are better
+HIGHER_IS_BETTER = {
+    "pages_per_second": True,
+    "chunks_per_second": True,
+    "question_p50_ms": False,
+    "llm_calls_per_question": False,
+}
+
+
+def peak_rss_mb() -> Dict[str, float]:
+    """Peak resident set size of this process and of its exited child processes."""
+    # ru_maxrss is in kilobytes on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+async def ask(app, question: str, config: Dict) -> Dict:
+    """Run one question and time each node run from the graph's events."""
+    started: Dict[str, float] = {}
+    node_ms: Dict[str, List[float]] = defaultdict(list)
+    llm_calls: Counter = Counter()
+    start = time.perf_counter()
+    async for event in app.astream_events(
+        {"question": question, "iterations": 0}, config, version="v2"
+    ):
+        kind, name = event["event"], event["name"]
+        if kind == "on_chat_model_start":
+            llm_calls[name] += 1
+        elif name in NODES:
+            if kind == "on_chain_start":
+                started[event["run_id"]] = time.perf_counter()
+            elif kind == "on_chain_end" and event["run_id"] in started:
+                node_ms[name].append(
+                    1000 * (time.perf_counter() - started.pop(event["run_id"]))
+                )
+
+    return {
+        "ms": 1000 * (time.perf_counter() - start),
+        "node_ms": node_ms,
+        "llm_calls": llm_calls,
+    }
+
+
+async def ask_all(app, questions: List[str], config: Dict) -> List[Dict]:
+    return [await ask(app, question, config) for question in questions]
+
+
+def bench_document(
+    path: str, questions: List[str], app, embeddings, use_grader_cache: bool
+) -> Dict:
+    num_pages = count_pages(path)
+
+    start = time.perf_counter()
+    documents = load_documents(path)
+    parse_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as persist_directory:
+        start = time.perf_counter()
+        vector_db = build_index(
+            documents, persist_directory=persist_directory, embeddings=embeddings
+        )
+        index_seconds = time.perf_counter() - start
+
+        index = ProgressiveIndex(key=os.path.basename(path), num_pages=num_pages)
+        index.vector_db = vector_db
+        index.lexical_index = LexicalIndex.load(persist_directory)
+        index.indexed_pages = set(range(num_pages))
+        index.done = True
+        retriever = ProgressiveRetriever(index=index, k=settings.RETRIEVAL_TOP_K)
+
+        config = {
+            "configurable": {
+                "retriever": retriever,
+                "use_grader_cache": use_grader_cache,
+            }
+        }
+        runs = asyncio.run(ask_all(app, questions, config))
+        vector_db.client.close()
+
+    node_ms: Dict[str, List[float]] = defaultdict(list)
+    llm_calls: Counter = Counter()
+    for run in runs:
+        for node, times in run["node_ms"].items():
+            node_ms[node].extend(times)
+        llm_calls.update(run["llm_calls"])
+
+    return {
+        "pages": num_pages,
+        "chunks": len(documents),
+        "pages_per_second": num_pages / parse_seconds,
+        "chunks_per_second": len(documents) / index_seconds,
+        "question_p50_ms": percentile([run["ms"] for run in runs], 0.5),
+        "question_p95_ms": percentile([run["ms"] for run in runs], 0.95),
+        "llm_calls_per_question": sum(llm_calls.values()) / max(len(runs), 1),
+        "llm_calls": dict(llm_calls),
+        "nodes": {
+            node: {
+                "runs": len(times),
+                "p50_ms": statistics.median(times),
+                "p95_ms": percentile(times, 0.95),
+            }
+            for node, times in sorted(node_ms.items())
+        },
+    }
+
+
+def regressions(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    found = []
+    for name, result in results["documents"].items():
+        previous = baseline["documents"].get(name)
+        if previous is None:
+            continue
+        for metric, higher_is_better in HIGHER_IS_BETTER.items():
+            old, new = previous[metric], result[metric]
+            change = (new - old) / old if old else 0.0
+            if (-change if higher_is_better else change) > tolerance:
+                found.append(f"{name} {metric}: {old:.2f} -> {new:.2f}")
+
+    return found
+
+
+def print_results(results: Dict) -> None:
+    for name, result in results["documents"].items():
+        print(
+            f"\n{name}: {result['pages']} pages, {result['chunks']} chunks\n"
+            f"  ingestion {result['pages_per_second']:.1f} pages/s, "
+            f"indexing {result['chunks_per_second']:.1f} chunks/s\n"
+            f"  question p50 {result['question_p50_ms']:.0f} ms, "
+            f"p95 {result['question_p95_ms']:.0f} ms, "
+            f"{result['llm_calls_per_question']:.1f} LLM calls/question "
+            f"{result['llm_calls']}"
+        )
+        print(f"  {'node':<42} {'runs':>5} {'p50 ms':>8} {'p95 ms':>8}")
+        for node, stats in result["nodes"].items():
+            print(
+                f"  {node:<42} {stats['runs']:>5} "
+                f"{stats['p50_ms']:>8.1f} {stats['p95_ms']:>8.1f}"
+            )
+    rss = results["peak_rss_mb"]
+    print(f"\npeak RSS {rss['self']:.0f} MB, parser processes {rss['children']:.0f} MB")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[20, 120])
+    parser.add_argument("--pdf", nargs="*", default=[], help="PDFs to add")
+    parser.add_argument("--questions", type=int, default=10)
+    parser.add_argument("--questions-file", help="JSON list of questions for --pdf")
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--retrieval-yes", type=float, default=0.7)
+    parser.add_argument("--hallucination-yes", type=float, default=0.9)
+    parser.add_argument("--answer-yes", type=float, default=0.9)
+    parser.add_argument("--grader-cache", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+    if args.pdf and not args.questions_file:
+        parser.error("--pdf requires --questions-file")
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    llm = FakeChatModel(
+        latency=args.latency,
+        seed=args.seed,
+        grader_yes_probabilities={
+            "retrieval": args.retrieval_yes,
+            "hallucination": args.hallucination_yes,
+            "answer": args.answer_yes,
+        },
+    )
+    app = RAGWorkflow(llm=llm, llm1=llm).create_workflow().compile()
+    embeddings = HashingEmbeddings()
+
+    results = {"documents": {}}
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = []
+        for num_pages in args.pages:
+            pages, questions = sample_document(num_pages, seed=args.seed)
+            path = os.path.join(directory, f"sample_{num_pages}p.pdf")
+            write_pdf(path, pages)
+            corpus.append((path, questions[: args.questions]))
+        if args.pdf:
+            with open(args.questions_file) as f:
+                questions = json.load(f)[: args.questions]
+            corpus.extend((path, questions) for path in args.pdf)
+
+        # Start the parser processes before anything is timed
+        load_documents(corpus[0][0])
+        for path, questions in corpus:
+            results["documents"][os.path.basename(path)] = bench_document(
+                path, questions, app, embeddings, args.grader_cache
+            )
+    shutdown_executor()
+    results["peak_rss_mb"] = peak_rss_mb()
+
+    print_results(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print(f"REGRESSION {regression}")
+        return 1 if found else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+"""Deterministic sample PDFs and questions for the offline benchmarks."""
+
+import random
+from typing import List, Tuple
+
+TOPICS = (
+    "termination payment liability warranty notice renewal confidentiality indemnity "
+    "arbitration insurance delivery audit"
+).split()
+FILLER = (
+    "the party agreement contract clause term shall may under with any all such "
+    "provided that each other written prior period date effective obligations"
+).split()
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[str]) -> None:
+    """
+    Write a minimal PDF with one page of Helvetica text per string.
+
+    Args:
+        path (str): Path of the PDF file.
+        pages (List[str]): Text of each page.
+    """
+    objects: List[bytes] = [b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    font_id = 1
+    pages_id = 2 + 2 * len(pages)
+    page_ids = []
+    for text in pages:
+        lines = [text[i : i + 90] for i in range(0, len(text), 90)]
+        content = (
+            "BT /F1 10 Tf 40 800 Td 12 TL "
+            + " ".join(f"({_escape(line)}) '" for line in lines)
+            + " ET"
+        ).encode("latin-1")
+        objects.append(
+            b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content)
+        )
+        objects.append(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>"
+            % (pages_id, font_id, len(objects))
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects.append(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids)))
+    objects.append(b"<< /Type /Catalog /Pages %d 0 R >>" % pages_id)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1,
+        len(objects),
+        xref,
+    )
+
+    with open(path, "wb") as f:
+        f.write(bytes(out))
+
+
+def sample_document(
+    num_pages: int, words_per_page: int = 400, seed: int = 0
+) -> Tuple[List[str], List[str]]:
+    """
+    Generate the pages of a contract-like document and questions about it.
+
+    Each page states a fact about one topic, which one question asks about.
+
+    Args:
+        num_pages (int): Number of pages.
+        words_per_page (int): Number of words per page.
+        seed (int): Random seed.
+
+    Returns:
+        Tuple[List[str], List[str]]: The pages and the questions.
+    """
+    rng = random.Random(seed)
+    pages, questions = [], []
+    for page in range(num_pages):
+        topic = rng.choice(TOPICS)
+        days = rng.randint(5, 90)
+        fact = f"Section {page + 1}. The {topic} period is {days} days."
+        filler = " ".join(rng.choice(FILLER + TOPICS) for _ in range(words_per_page))
+        pages.append(f"{fact} {filler}")
+        questions.append(f"How many days is the {topic} period in section {page + 1}?")
+
+    return pages, questions
@@ -0,0 +1,147 @@
+"""Benchmark of the per-event overhead of rendering workflow steps.
+
+Measures, without rendering anything:
+
+- the events streamed per question and the time to consume them, with and without the
+  `astream_events` filters of `run_rag_workflow`,
+- the cost of routing an event with `dispatch_event`, against checking it in each of
+  seven step functions as before,
+- `format_documents` against concatenating the document reprs, best of `--rounds`.
+
+Usage:
+    python -m benchmarks.stream_steps_bench --questions 20 --chunks 200
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+import timeit
+from typing import Dict, List
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from benchmarks.fakes import FakeChatModel, FakeRetriever
+from components.chainlit.stream_steps import (
+    STREAMED_NAMES,
+    STREAMED_TYPES,
+    dispatch_event,
+    format_documents,
+)
+from components.rag_workflow import RAGWorkflow
+
+# (event type, run name) checked by each of the former step functions
+LEGACY_CHECKS = [
+    ("on_retriever_end", None),
+    ("on_chat_model_start", "retrieval_grader"),
+    ("on_chain_end", "decide_to_generate"),
+    ("on_chat_model_end", "question_rewriter"),
+    ("on_chat_model_end", "hallucination_grader"),
+    ("on_chat_model_end", "answer_grader"),
+    ("on_chain_end", "end_with_message"),
+]
+
+
+async def legacy_dispatch(event: Dict) -> None:
+    for event_type, name in LEGACY_CHECKS:
+        if event["event"] == event_type and name in (None, event["name"]):
+            # Only events that are not rendered are benchmarked
+            raise AssertionError("rendered event")
+
+
+async def collect_events(app, questions: int, filtered: bool) -> List[Dict]:
+    kwargs = (
+        {"include_names": STREAMED_NAMES + [app.get_name()], "include_types": STREAMED_TYPES}
+        if filtered
+        else {}
+    )
+    config = {"configurable": {"retriever": FakeRetriever(latency=0.0)}}
+    events = []
+    for i in range(questions):
+        inputs = {"question": f"Question {i}?", "iterations": 0}
+        async for event in app.astream_events(inputs, config, version="v2", **kwargs):
+            events.append(event)
+
+    return events
+
+
+async def time_dispatch(dispatch, events: List[Dict], rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for event in events:
+            await dispatch(event)
+
+    return (time.perf_counter() - start) / (rounds * len(events))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--answer-words", type=int, default=300)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    answer = " ".join(f"word{i}" for i in range(args.answer_words))
+    app = (
+        RAGWorkflow(
+            llm=FakeChatModel(latency=0.0, answer=answer),
+            llm1=FakeChatModel(latency=0.0, answer=answer),
+        )
+        .create_workflow()
+        .compile()
+    )
+
+    print(f"{'events':<10} {'per question':>12} {'ms/question':>12}")
+    for filtered in (False, True):
+        start = time.perf_counter()
+        events = asyncio.run(collect_events(app, args.questions, filtered))
+        elapsed = time.perf_counter() - start
+        print(
+            f"{'filtered' if filtered else 'all':<10} "
+            f"{len(events) / args.questions:>12.0f} "
+            f"{1000 * elapsed / args.questions:>12.1f}"
+        )
+
+    # Token stream events are the bulk of the events and render no step
+    stream_events = [
+        event
+        for event in asyncio.run(collect_events(app, 1, filtered=True))
+        if event["event"] == "on_chat_model_stream"
+    ]
+    print(f"\n{'dispatch':<10} {'us/event':>12}")
+    for name, dispatch in (("legacy", legacy_dispatch), ("table", dispatch_event)):
+        per_event = asyncio.run(time_dispatch(dispatch, stream_events, args.rounds))
+        print(f"{name:<10} {1e6 * per_event:>12.2f}")
+
+    # Chunks of PDF text, with a line break every 90 characters
+    text = "lorem ipsum dolor sit amet " * 40
+    documents = [
+        Document(
+            page_content="\n".join(text[i : i + 90] for i in range(0, len(text), 90)),
+            metadata={"source": "a.pdf", "page": page},
+        )
+        for page in range(args.chunks)
+    ]
+
+    def concatenate() -> str:
+        output = ""
+        for doc in documents:
+            output += str(doc)
+        return output
+
+    print(f"\n{'output':<10} {'ms':>12} {'chars':>12}")
+    for name, render in (
+        ("repr +=", concatenate),
+        ("format", lambda: format_documents(documents)),
+    ):
+        elapsed = min(timeit.repeat(render, number=1, repeat=args.rounds))
+        print(f"{name:<10} {1000 * elapsed:>12.2f} {len(render()):>12}")
+
+
+if __name__ == "__main__":
+    main()
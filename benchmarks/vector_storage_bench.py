@@ -0,0 +1,129 @@
+"""Benchmark of recall@k, memory and query latency of the vector storage modes.
+
+A sample PDF is parsed and indexed with `build_index` using a dense hashing embedder,
+then the sample questions are searched in the Qdrant collection ("full") and in the
+int8 and binary `QuantizedVectors`, with and without rescoring. Recall@k is measured against an
+exact search of the original vectors. Memory is that of the vectors held in memory:
+float32 vectors in the Qdrant collection, codes for the quantized modes.
+
+Usage:
+    python -m benchmarks.vector_storage_bench --pages 300 --dim 1024 --k 5 20
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.sample_pdfs import sample_document, write_pdf
+from components.document_loader import load_documents, shutdown_executor
+from components.index_builder import build_index
+from components.lexical_index import LexicalIndex, chunk_key
+from components.quantized_vectors import VECTORS_FILE, QuantizedVectors
+
+
+def measure(
+    search: Callable[[List[float], int], List[int]],
+    query_vectors: List[List[float]],
+    exact: List[List[int]],
+    k: int,
+) -> Dict[str, float]:
+    recalls, seconds = [], []
+    for query_vector, expected in zip(query_vectors, exact):
+        start = time.perf_counter()
+        rows = search(query_vector, k)
+        seconds.append(time.perf_counter() - start)
+        recalls.append(len(set(rows) & set(expected[:k])) / k)
+
+    return {
+        "recall": statistics.mean(recalls),
+        "p50_ms": 1000 * statistics.median(seconds),
+    }
+
+
+def quantized_search(
+    quantized: QuantizedVectors, rescore: bool, oversampling: float
+) -> Callable[[List[float], int], List[int]]:
+    def search(query_vector: List[float], k: int) -> List[int]:
+        results = quantized.search(query_vector, k, rescore, oversampling)
+        return [row for row, _ in results]
+
+    return search
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=300)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--k", type=int, nargs="+", default=[5, 20])
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--oversampling", type=float, default=3.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    embeddings = HashingEmbeddings(size=args.dim, dense=True)
+    pages, questions = sample_document(args.pages, seed=args.seed)
+    query_vectors = embeddings.embed_documents(questions[: args.queries])
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "sample.pdf")
+        write_pdf(path, pages)
+        documents = load_documents(path)
+        shutdown_executor()
+        persist_directory = os.path.join(directory, "index")
+        vector_db = build_index(
+            documents, persist_directory=persist_directory, embeddings=embeddings
+        )
+        lexical_index = LexicalIndex.load(persist_directory)
+        rows = {chunk_key(doc): row for row, doc in enumerate(lexical_index.documents)}
+
+        vectors = np.load(os.path.join(persist_directory, VECTORS_FILE))
+        max_k = max(args.k)
+        exact = []
+        for query_vector in query_vectors:
+            query = np.asarray(query_vector, dtype=np.float32)
+            exact.append(list(np.argsort(-(vectors @ query), kind="stable")[:max_k]))
+
+        def search_full(query_vector: List[float], k: int) -> List[int]:
+            results = vector_db.similarity_search_with_score_by_vector(query_vector, k=k)
+            return [rows[chunk_key(doc)] for doc, _ in results]
+
+        modes = {"full": (search_full, vectors.nbytes)}
+        for mode in ("int8", "binary"):
+            quantized = QuantizedVectors.load(persist_directory, mode)
+            for rescore in (False, True):
+                name = f"{mode}{' + rescore' if rescore else ''}"
+                modes[name] = (
+                    quantized_search(quantized, rescore, args.oversampling),
+                    quantized.nbytes,
+                )
+
+        print(
+            f"{len(vectors)} chunks of {args.dim} dimensions, "
+            f"{len(query_vectors)} queries, oversampling {args.oversampling:g}"
+        )
+        header = "".join(f" {f'recall@{k}':>10} {'p50 ms':>7}" for k in args.k)
+        print(f"  {'mode':<18} {'vector RAM':>11}{header}")
+        for name, (search, nbytes) in modes.items():
+            line = f"  {name:<18} {nbytes / 1024**2:>9.2f}MB"
+            for k in args.k:
+                result = measure(search, query_vectors, exact, k)
+                line += f" {result['recall']:>10.3f} {result['p50_ms']:>7.2f}"
+            print(line)
+        vector_db.client.close()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+from components.index_builder import get_embeddings
+from config import settings
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+class CachedAnswer:
+    """Answer of the RAG workflow stored with the embedding of its question."""
+
+    def __init__(
+        self, question_embedding: np.ndarray, answer: str, source_documents: List
+    ):
+        self.question_embedding = question_embedding
+        self.answer = answer
+        self.source_documents = source_documents
+        self.created_at = time.monotonic()
+
+
+class SemanticAnswerCache:
+    """Cache of answers per document, looked up by question similarity.
+
+    An answer is reused for a question about the same document whose embedding has a
+    cosine similarity of at least `threshold` with the cached question. Entries expire
+    after `ttl_seconds`, and the least recently used ones are evicted past `max_entries`.
+    Documents are identified by their index cache key, so a changed document never
+    matches answers about its previous content.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        threshold: float,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self._embeddings = embeddings
+        self._entries: "OrderedDict[Tuple[str, int], CachedAnswer]" = OrderedDict()
+        self._by_document: Dict[str, Dict[int, CachedAnswer]] = {}
+        self._question_embeddings: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._next_id = 0
+
+    async def embed(self, question: str) -> np.ndarray:
+        """
+        Embed a question, normalized to unit length.
+
+        Embeddings of recently seen questions are memoized, so repeating a question
+        verbatim does not call the embedding provider.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            np.ndarray: The question embedding.
+        """
+        key = normalize_question(question)
+        embedding = self._question_embeddings.get(key)
+        if embedding is None:
+            if self._embeddings is None:
+                self._embeddings = get_embeddings()
+            embedding = np.asarray(
+                await self._embeddings.aembed_query(question), dtype=np.float32
+            )
+            embedding /= np.linalg.norm(embedding) or 1.0
+            self._question_embeddings[key] = embedding
+            if len(self._question_embeddings) > self.max_entries:
+                self._question_embeddings.popitem(last=False)
+        self._question_embeddings.move_to_end(key)
+
+        return embedding
+
+    def lookup(
+        self, document_key: str, question_embedding: np.ndarray
+    ) -> Optional[CachedAnswer]:
+        """
+        Find the cached answer of the most similar question about a document.
+
+        Args:
+            document_key (str): Identity of the document's content.
+            question_embedding (np.ndarray): Embedding returned by `embed`.
+
+        Returns:
+            Optional[CachedAnswer]: The answer, or None if no question is similar enough.
+        """
+        best, best_similarity = None, self.threshold
+        for entry_id, entry in list(self._by_document.get(document_key, {}).items()):
+            if time.monotonic() - entry.created_at > self.ttl_seconds:
+                self._remove((document_key, entry_id))
+                continue
+            similarity = float(np.dot(question_embedding, entry.question_embedding))
+            if similarity >= best_similarity:
+                best, best_similarity = (entry_id, entry), similarity
+
+        if best is None:
+            return None
+
+        self._entries.move_to_end((document_key, best[0]))
+        logger.info(f"Answer cache hit (similarity {best_similarity:.3f})")
+
+        return best[1]
+
+    def store(
+        self,
+        document_key: str,
+        question_embedding: np.ndarray,
+        answer: str,
+        source_documents: List,
+    ) -> None:
+        """
+        Cache the answer to a question about a document.
+
+        Args:
+            document_key (str): Identity of the document's content.
+            question_embedding (np.ndarray): Embedding returned by `embed`.
+            answer (str): The answer.
+            source_documents (List): Documents the answer is based on.
+        """
+        key = (document_key, self._next_id)
+        self._next_id += 1
+
+        entry = CachedAnswer(question_embedding, answer, source_documents)
+        self._entries[key] = entry
+        self._by_document.setdefault(document_key, {})[key[1]] = entry
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: Tuple[str, int]) -> None:
+        self._entries.pop(key, None)
+        answers = self._by_document.get(key[0], {})
+        answers.pop(key[1], None)
+        if not answers:
+            self._by_document.pop(key[0], None)
+
+
+answer_cache = SemanticAnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    threshold=settings.ANSWER_CACHE_SIMILARITY_THRESHOLD,
+)
@@ -1,18 +1,21 @@
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 
 import chainlit as cl
 
 
 def update_answer_with_source(
-    answer: str, source_documents: List, file_path: str
+    answer: str, source_documents: List, files: Dict
 ) -> Tuple[str, List]:
     """
     Update the answer with the source documents.
 
+    Sources found in a corpus are resolved to their file by the `document_id` in their
+    metadata, and named after it, e.g. "report.pdf P3".
+
     Args:
         answer (str): The answer string.
         source_documents (List): List of source documents.
-        file_path (str): Path to the PDF file.
+        files (Dict): Uploaded files by index cache key.
 
     Returns:
         answer (str): The updated answer string.
@@ -23,11 +26,18 @@ def update_answer_with_source(
     if source_documents:
         for source_doc in source_documents:
             source_name = f"P{source_doc.metadata['page']}"
+            file = files.get(source_doc.metadata.get("document_id"))
+            if file is None and len(files) == 1:
+                file = next(iter(files.values()))
+            if file is None:
+                continue
+            if len(files) > 1:
+                source_name = f"{file.name} {source_name}"
             pdf_elements.append(
                 cl.Pdf(
                     name=source_name,
                     display="side",
-                    path=file_path,
+                    path=file.path,
                     page=source_doc.metadata["page"],
                 )
             )
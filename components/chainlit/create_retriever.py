@@ -1,34 +1,211 @@
+import asyncio
+from typing import List, Optional
+
 import chainlit as cl
+from loguru import logger
 
-from components.document_loader import load_documents
-from components.index_builder import build_index
+from components.corpus_index import CorpusIndex
+from components.document_loader import count_pages
+from components.index_cache import index_cache
+from components.index_registry import index_registry
+from components.progressive_index import ProgressiveIndex, ProgressiveRetriever
+from config import settings
 
 
 async def create_retriever(file):
     """
     Create the retriever.
 
+    The index is looked up by the content of the file, so a file that was already
+    indexed, under any name, is not embedded again. Otherwise the file is indexed in
+    the background and the retriever is returned as soon as the first pages are
+    searchable; `retriever.index` tells which pages are covered.
+
+    A file uploaded by an authenticated user under the name of a file the user
+    indexed before, e.g. a revision of a document, is indexed from the index of the
+    previous revision if they share enough chunks, and that index serves the
+    questions until the new index is published, see `update_index`.
+
+    Sessions about the same file share its open index, see `IndexRegistry`. The index
+    is released with `release_index(retriever.index)` when the session ends.
+
     Args:
         file (File): The uploaded file.
 
     Returns:
         retriever (Retriever): The retriever.
     """
+    key = index_cache.key_for(file.path)
+    index = await open_document_index(file, key)
+
+    retriever = ProgressiveRetriever(index=index, k=settings.RETRIEVAL_TOP_K)
+
+    return retriever
+
+
+async def create_corpus_retriever(files: List):
+    """
+    Create the retriever of a corpus of files, searched as one, see `CorpusIndex`.
+
+    Each file is indexed like a file uploaded alone, see `create_retriever`, except
+    that the retriever is returned as soon as all the files are queued for indexing:
+    the files are parsed and embedded in parallel, at most
+    `settings.INGEST_MAX_DOCUMENTS` at once, and each file is searchable from its
+    first indexed batch. Files with the same content are indexed once, and files that
+    cannot be opened are left out of the corpus, see
+    `retriever.index.failed_documents()`.
+
+    The indexes are released with `release_index(retriever.index)` when the session
+    ends.
+
+    Args:
+        files (List[File]): The uploaded files.
+
+    Returns:
+        retriever (Retriever): The retriever.
+    """
+    files_by_key = {}
+    for file in files:
+        files_by_key.setdefault(index_cache.key_for(file.path), file)
+
     async with cl.Step(name="Document Processor") as step:
-        step.output = "Loading and processing the document."
+        step.output = (
+            f"Loading and processing {len(files_by_key)} documents,"
+            f" {settings.INGEST_MAX_DOCUMENTS} at a time."
+        )
         await step.update()
-    documents = load_documents(file.path)
 
-    async with cl.Step(name="Index Builder") as step:
-        step.output = "Building the index."
-        await step.update()
-    vector_db = build_index(
-        documents=documents,
-        persist_directory="resources/qdrant_db/" + file.name,
+    results = await asyncio.gather(
+        *(
+            open_document_index(file, key, in_corpus=True)
+            for key, file in files_by_key.items()
+        ),
+        return_exceptions=True,
     )
+    indexes, failed = {}, []
+    for (key, file), result in zip(files_by_key.items(), results):
+        if isinstance(result, BaseException):
+            logger.opt(exception=result).warning(f"Could not index {file.name}")
+            failed.append(file.name)
+            continue
+        indexes[key] = result
+    if not indexes:
+        raise results[0]
 
-    retriever = vector_db.as_retriever(
-        search_type="similarity_score_threshold", search_kwargs={"score_threshold": 0.4}
+    index = CorpusIndex(
+        indexes=indexes,
+        files={key: files_by_key[key] for key in indexes},
+        unopened=failed,
     )
+    retriever = ProgressiveRetriever(index=index, k=settings.RETRIEVAL_TOP_K)
 
     return retriever
+
+
+async def open_document_index(
+    file, key: str, in_corpus: bool = False
+) -> ProgressiveIndex:
+    """
+    Acquire the index of an uploaded file, opened or built unless a session holds it.
+
+    Args:
+        file (File): The uploaded file.
+        key (str): Index cache key of the file.
+        in_corpus (bool): Whether the file is part of a corpus, whose files are not
+            announced one by one and do not wait for their first indexed batch.
+
+    Returns:
+        ProgressiveIndex: The index, to release when the session ends.
+    """
+
+    owner = document_owner()
+
+    async def open_index() -> ProgressiveIndex:
+        if index_cache.lookup(key) is not None:
+            return ProgressiveIndex.from_directory(
+                key, num_pages=count_pages(file.path)
+            )
+
+        if not in_corpus:
+            async with cl.Step(name="Document Processor") as step:
+                step.output = "Loading and processing the document."
+                await step.update()
+
+        previous = None
+        if owner is not None:
+            previous = await open_previous_revision(owner, file.name)
+        if not in_corpus:
+            async with cl.Step(name="Index Builder") as step:
+                if previous is None:
+                    step.output = "Building the index while the document is parsed."
+                else:
+                    step.output = (
+                        "Updating the index of the previous revision of the document"
+                        " with the changed pages if most of its text is unchanged,"
+                        " which answers questions meanwhile."
+                    )
+                await step.update()
+        index = await ProgressiveIndex.start(
+            file.path, key, previous=previous, wait=not in_corpus
+        )
+        if previous is not None:
+            asyncio.create_task(release_when_indexed(index, previous))
+
+        return index
+
+    index = await index_registry.acquire(key, open_index)
+    if owner is not None:
+        index_cache.record_version(owner, file.name, key)
+
+    return index
+
+
+def release_index(index) -> None:
+    """Release the index of a session, or the indexes of all the files of a corpus."""
+    if isinstance(index, CorpusIndex):
+        for key, document_index in index.indexes.items():
+            index_registry.release(key, document_index)
+    else:
+        index_registry.release(index.key, index)
+
+
+def document_owner() -> Optional[str]:
+    """
+    Identifier of the authenticated user of the chat session, who owns its documents,
+    or None without authentication, see `settings.AUTH_USER_HEADER`.
+    """
+    user = cl.user_session.get("user")
+
+    return user.identifier if user is not None else None
+
+
+async def open_previous_revision(owner: str, name: str):
+    """Acquire the published index an owner last opened for a file name, if any."""
+    previous_key = index_cache.latest_version(owner, name)
+    if not settings.INCREMENTAL_REINDEX or previous_key is None:
+        return None
+    if index_cache.lookup(previous_key) is None:
+        return None
+
+    async def open_previous() -> ProgressiveIndex:
+        return ProgressiveIndex.from_directory(previous_key)
+
+    logger.info(f"Indexing {name} from its previous revision {previous_key}")
+    return await index_registry.acquire(previous_key, open_previous)
+
+
+async def release_when_indexed(
+    index: ProgressiveIndex, previous: ProgressiveIndex
+) -> None:
+    """
+    Release the index of the previous revision once the new one is published.
+
+    If indexing fails, the previous index keeps answering the sessions that hold the
+    new one, and is released once they all released it.
+    """
+    try:
+        await index.wait_done()
+    except Exception:
+        # The failure is logged by the index, and reported to the session
+        await index_registry.wait_released(index)
+    index_registry.release(previous.key, previous)
@@ -0,0 +1,113 @@
+import time
+from typing import List, Optional
+
+import chainlit as cl
+from loguru import logger
+
+from config import settings
+
+PENDING_NOTE = "\n\n_Checking this answer against the documents..._"
+WITHDRAWN_NOTE = (
+    "⚠️ _This draft answer did not pass the checks and was withdrawn._\n\n~~{draft}~~"
+)
+
+
+class LiveAnswer:
+    """Answer message shown to the user before the workflow has finished.
+
+    With `settings.STREAM_ANSWER`, the tokens of the `rag_chain` generation are streamed
+    into a message as they arrive. Otherwise, with `settings.SPECULATIVE_ANSWER`, a
+    generation is shown as a draft as soon as its grading starts. Either way the draft
+    is confirmed if the graders accept it, and withdrawn if they reject it.
+
+    The time to first token and the total latency are measured from the creation of the
+    live answer.
+    """
+
+    def __init__(self):
+        self.message: Optional[cl.Message] = None
+        self.draft = ""
+        self.started_at = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+
+    async def on_event(self, event) -> None:
+        """Update the draft answer based on the event received."""
+        if event["event"] == "on_chat_model_stream" and event["name"] == "rag_chain":
+            if settings.STREAM_ANSWER:
+                await self.stream(event["data"]["chunk"].content)
+            return
+
+        if event["name"] != "grade_generation_v_documents_and_question":
+            return
+
+        if event["event"] == "on_chain_start":
+            if self.message is not None:
+                # The generation was streamed, end the stream
+                await self.message.send()
+                self.message.content = self.draft + PENDING_NOTE
+                await self.message.update()
+            elif settings.SPECULATIVE_ANSWER:
+                await self.show(event["data"]["input"]["generation"])
+        elif event["event"] == "on_chain_end":
+            if event["data"]["output"] == "useful":
+                await self.confirm()
+            else:
+                await self.withdraw()
+
+    async def stream(self, token: str) -> None:
+        """Stream a token of the generation."""
+        if not token:
+            return
+
+        if self.message is None:
+            self.draft = ""
+            self.message = cl.Message(content="")
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+        self.draft += token
+        await self.message.stream_token(token)
+
+    async def show(self, draft: str) -> None:
+        """Show a new draft answer."""
+        self.draft = draft
+        self.message = cl.Message(content=draft + PENDING_NOTE)
+        await self.message.send()
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    async def confirm(self) -> None:
+        """Mark the current draft as accepted by the graders."""
+        if self.message is not None:
+            self.message.content = self.draft
+            await self.message.update()
+
+    async def withdraw(self) -> None:
+        """Annotate the current draft as rejected by the graders."""
+        if self.message is not None:
+            self.message.content = WITHDRAWN_NOTE.format(draft=self.draft)
+            await self.message.update()
+            self.message = None
+
+    async def send(self, answer: str, elements: List) -> None:
+        """
+        Send the final answer, in place of the accepted draft if there is one.
+
+        Args:
+            answer (str): The answer string, with its sources.
+            elements (List): Elements attached to the answer.
+        """
+        if self.message is None:
+            await cl.Message(content=answer, elements=elements).send()
+        else:
+            self.message.content = answer
+            self.message.elements = elements
+            await self.message.update()
+
+        total = time.perf_counter() - self.started_at
+        ttft = (
+            self.first_token_at - self.started_at
+            if self.first_token_at is not None
+            else total
+        )
+        logger.info(f"Answer latency: time to first token {ttft:.2f}s, total {total:.2f}s")
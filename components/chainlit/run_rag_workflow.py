@@ -1,52 +1,100 @@
-from typing import Dict, List, Literal, Tuple
+from typing import Dict, List, Literal, Optional, Tuple
 
+from components.answer_cache import answer_cache
 from components.chainlit.answer_utils import update_answer_with_source
+from components.chainlit.live_answer import LiveAnswer
 from components.chainlit.stream_steps import (
-    stream_answer_grader_step,
-    stream_decide_to_generate_step,
-    stream_end_with_message_after_grade_answer,
+    STREAMED_NAMES,
+    STREAMED_TYPES,
+    dispatch_event,
     stream_final_answer,
-    stream_hallucination_grader_step,
-    stream_question_rewriter_step,
-    stream_retrieval_grader_step,
-    stream_retriever_step,
 )
+from components.telemetry import TRACED_TYPES, RequestTracer, traced_names
+from config import settings
 
 
 async def run_rag_workflow(
-    app: Literal["CompiledGraph"], inputs: Dict, file_path: str
+    app: Literal["CompiledGraph"],
+    inputs: Dict,
+    files: Dict,
+    config: Dict,
+    document_key: Optional[str] = None,
+    live_answer: Optional[LiveAnswer] = None,
+    tracer: Optional[RequestTracer] = None,
 ) -> Tuple[str, List]:
     """
     Run the RAG workflow.
 
+    When `document_key` is given, the semantic answer cache is checked first, and
+    answers that are based on documents are stored in it.
+
     Args:
         app (CompiledGraph): The RAG workflow.
         inputs (Dict): The inputs for the workflow.
-        file_path (str): The path to the PDF file.
+        files (Dict): Uploaded files by index cache key, see
+            `update_answer_with_source`.
+        config (Dict): The run config, with the session's retriever.
+        document_key (Optional[str]): Identity of the content of the document, or of
+            the corpus.
+        live_answer (Optional[LiveAnswer]): Shows the answer while the workflow runs.
+        tracer (Optional[RequestTracer]): Traces the request, see `RequestTracer`.
 
     Returns:
         answer (str): The answer string.
         pdf_elements (List): List of PDF elements for the source documents.
     """
-    async for event in app.astream_events(
-        inputs,
-        version="v1",
-    ):
+    question_embedding = None
+    if document_key is not None and settings.ANSWER_CACHE_ENABLED:
+        question_embedding = await answer_cache.embed(inputs["question"])
+        cached = answer_cache.lookup(document_key, question_embedding)
+        if cached is not None:
+            if tracer is not None:
+                tracer.finish(outcome="cached")
+            return update_answer_with_source(
+                answer=cached.answer,
+                source_documents=cached.source_documents,
+                files=files,
+            )
+
+    # The workflow's own end event, which is the last one, carries the final state
+    include_names = STREAMED_NAMES + [app.get_name()]
+    include_types = STREAMED_TYPES
+    if tracer is not None:
+        include_names = include_names + traced_names(app)
+        include_types = include_types + TRACED_TYPES
 
-        await stream_retriever_step(event)
-        await stream_retrieval_grader_step(event)
+    try:
+        async for event in app.astream_events(
+            inputs,
+            config,
+            version="v2",
+            include_names=include_names,
+            include_types=include_types,
+        ):
+            await dispatch_event(event)
 
-        await stream_decide_to_generate_step(event)
-        await stream_question_rewriter_step(event)
-        await stream_hallucination_grader_step(event)
-        await stream_answer_grader_step(event)
+            if live_answer is not None:
+                await live_answer.on_event(event)
 
-        await stream_end_with_message_after_grade_answer(event)
+            if tracer is not None:
+                tracer.on_event(event)
+    except BaseException:
+        if tracer is not None:
+            tracer.finish(outcome="error")
+        raise
 
     answer, source_documents = await stream_final_answer(event)
+    if tracer is not None:
+        tracer.finish(
+            outcome="answered" if source_documents else "no_answer",
+            iterations=event["data"]["output"].get("iterations"),
+        )
+
+    if question_embedding is not None and source_documents:
+        answer_cache.store(document_key, question_embedding, answer, source_documents)
 
     answer, pdf_elements = update_answer_with_source(
-        answer=answer, source_documents=source_documents, file_path=file_path
+        answer=answer, source_documents=source_documents, files=files
     )
 
     return answer, pdf_elements
@@ -1,135 +1,174 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
 import chainlit as cl
 
+from config import settings
+
+
+def format_documents(documents: List, max_chars: Optional[int] = None) -> str:
+    """
+    Format documents for a step output, one truncated line per document.
+
+    Line breaks in the documents become spaces. They are replaced once for the whole
+    output, whose lines are joined with record separators until then.
+
+    Args:
+        documents (List): The documents.
+        max_chars (Optional[int]): Maximum characters shown per document, defaults to
+            `settings.STEP_DOCUMENT_MAX_CHARS`.
+
+    Returns:
+        str: The step output.
+    """
+    max_chars = max_chars or settings.STEP_DOCUMENT_MAX_CHARS
+    lines = []
+    for doc in documents:
+        text = doc.page_content
+        if len(text) > max_chars:
+            text = text[:max_chars] + "…"
+        lines.append(f"[P{doc.metadata.get('page', '?')}] {text}")
+
+    output = "\x1e".join(lines).replace("\r\n", " ").replace("\n", " ")
+    return output.replace("\r", " ").replace("\x1e", "\n")
+
 
 async def stream_retriever_step(event):
-    """Streams the retriever step based on the event received."""
-    if event["event"] == "on_retriever_end":
-        async with cl.Step(name="Retriever", language="python") as step:
-            step_output = ""
-            for doc in event["data"]["output"]["documents"]:
-                step_output += str(doc) + "\n"
-            step.output = step_output
-            await step.update()
+    """Streams the retrieved documents."""
+    async with cl.Step(name="Retriever") as step:
+        step.output = format_documents(event["data"]["output"])
+        await step.update()
 
 
 async def stream_retrieval_grader_step(event):
-    """Streams the retrieval grader step based on the event received."""
-    if event["event"] == "on_chat_model_start" and event["name"] == "retrieval_grader":
-        async with cl.Step(name="Retrieval Grader") as step:
-            await step.update()
+    """Streams the start of a retrieval grading."""
+    async with cl.Step(name="Retrieval Grader") as step:
+        await step.update()
 
-    # if event["event"] == "on_chat_model_end" and event["name"] == "retrieval_grader":
-    #     async with cl.Step(name="Retrieval Grader") as step:
-    #         if "yes" in event["data"]["output"]["generations"][0][0]["text"]:
-    #             step.output = "✅ Relevant"
-    #         else:
-    #             step.output = "❌ Not relevant"
-    #         await step.update()
+
+async def stream_hallucination_grader_start(event):
+    """Streams the start of the hallucination grading."""
+    async with cl.Step(name="Hallucination Grader") as step:
+        await step.update()
 
 
 async def stream_hallucination_grader_step(event):
-    """Streams the hallucination grader step based on the event received."""
-    if (
-        event["event"] == "on_chat_model_start"
-        and event["name"] == "hallucination_grader"
-    ):
-        async with cl.Step(name="Hallucination Grader") as step:
-            await step.update()
+    """Streams the hallucination grader decision."""
+    async with cl.Step(name="Hallucination Grader") as step:
+        if "yes" in event["data"]["output"].content:
+            step.output = "✅ Decision: Generation is grounded in documents."
+        else:
+            step.output = "❌ Decision: Generation is not grounded in documents.\n🔄 Transform query."
+        await step.update()
 
-    if (
-        event["event"] == "on_chat_model_end"
-        and event["name"] == "hallucination_grader"
-    ):
-        async with cl.Step(name="Hallucination Grader") as step:
-            if "yes" in event["data"]["output"]["generations"][0][0]["text"]:
-                step.output = "✅ Decision: Generation is grounded in documents."
-            else:
-                step.output = "❌ Decision: Generation is not grounded in documents.\n🔄 Transform query."
-            await step.update()
+
+async def stream_answer_grader_start(event):
+    """Streams the start of the answer grading."""
+    async with cl.Step(name="Answer Grader") as step:
+        await step.update()
 
 
 async def stream_answer_grader_step(event):
-    """Streams the answer grader step based on the event received."""
-    if event["event"] == "on_chat_model_start" and event["name"] == "answer_grader":
-        async with cl.Step(name="Answer Grader") as step:
-            await step.update()
+    """Streams the answer grader decision."""
+    async with cl.Step(name="Answer Grader") as step:
+        if "yes" in event["data"]["output"].content:
+            step.output = "✅ Decision: Answer addresses question."
+        else:
+            step.output = "❌ Decision: Answer does not address question.\n🔄 Transform query."
+        await step.update()
 
-    if event["event"] == "on_chat_model_end" and event["name"] == "answer_grader":
-        async with cl.Step(name="Answer Grader") as step:
-            if "yes" in event["data"]["output"]["generations"][0][0]["text"]:
-                step.output = "✅ Decision: Answer addresses question."
-            else:
-                step.output = "❌ Decision: Answer does not address question.\n🔄 Transform query."
-            await step.update()
 
+async def stream_question_rewriter_start(event):
+    """Streams the start of the question rewriting."""
+    async with cl.Step(name="Question Rewriter") as step:
+        await step.update()
 
-async def stream_question_rewriter_step(event):
-    """Streams the question rewriter step based on the event received."""
-    if event["event"] == "on_chat_model_start" and event["name"] == "question_rewriter":
-        async with cl.Step(name="Question Rewriter") as step:
-            await step.update()
 
-    if event["event"] == "on_chat_model_end" and event["name"] == "question_rewriter":
-        async with cl.Step(name="Question Rewriter") as step:
-            step.output = event["data"]["output"]["generations"][0][0]["text"]
-            await step.update()
+async def stream_question_rewriter_step(event):
+    """Streams the rewritten question, or questions."""
+    async with cl.Step(name="Question Rewriter") as step:
+        step.output = event["data"]["output"].content
+        await step.update()
 
 
 async def stream_decide_to_generate_step(event):
-    """Streams the decide to generate step based on the event received."""
-    if event["name"] == "decide_to_generate" and event["event"] == "on_chain_end":
-        async with cl.Step(name="Retrieval Grader") as step:
-            if event["data"]["output"] == "generate":
-                step.output = (
-                    "✅ Decision: Retrieved documents are relevant, generate answer."
-                )
-            elif event["data"]["output"] == "transform_query":
-                step.output = "🔄 Decision: All documents are not relevant to question, transform query."
-            elif event["data"]["output"] == "end_with_message":
-                step.output = "❌ Decision: Transform query limit reached, ending."
-            await step.update()
+    """Streams the decision to generate or to transform the query."""
+    async with cl.Step(name="Retrieval Grader") as step:
+        if event["data"]["output"] == "generate":
+            step.output = "✅ Decision: Retrieved documents are relevant, generate answer."
+        elif event["data"]["output"] == "transform_query":
+            step.output = "🔄 Decision: All documents are not relevant to question, transform query."
+        elif event["data"]["output"] == "end_with_message":
+            step.output = "❌ Decision: Transform query limit reached, ending."
+        await step.update()
 
 
 async def stream_end_with_message_after_grade_answer(event):
     """Streams the end with message after
-    `grade_generation_v_documents_and_question`
-    step based on the event received.
+    `grade_generation_v_documents_and_question`.
     """
     if (
-        event["event"] == "on_chain_end"
-        and event["name"] == "end_with_message"
-        and event["metadata"]["langgraph_triggers"][0]
+        event["metadata"]["langgraph_triggers"][0]
         == "branch:generate:grade_generation_v_documents_and_question:end_with_message"
     ):
         async with cl.Step(name="Hallucination/Answer Grader") as step:
             step.output = "❌ Decision: Transform query limit reached, ending."
 
 
+# Steps rendered per (event type, run name), a None run name matches any run
+STEP_HANDLERS: Dict[Tuple[str, Optional[str]], Callable[[Dict], Awaitable]] = {
+    ("on_retriever_end", None): stream_retriever_step,
+    ("on_chat_model_start", "retrieval_grader"): stream_retrieval_grader_step,
+    ("on_chat_model_start", "batch_retrieval_grader"): stream_retrieval_grader_step,
+    ("on_chat_model_start", "hallucination_grader"): stream_hallucination_grader_start,
+    ("on_chat_model_end", "hallucination_grader"): stream_hallucination_grader_step,
+    ("on_chat_model_start", "answer_grader"): stream_answer_grader_start,
+    ("on_chat_model_end", "answer_grader"): stream_answer_grader_step,
+    ("on_chat_model_start", "question_rewriter"): stream_question_rewriter_start,
+    ("on_chat_model_end", "question_rewriter"): stream_question_rewriter_step,
+    ("on_chat_model_start", "multi_query_rewriter"): stream_question_rewriter_start,
+    ("on_chat_model_end", "multi_query_rewriter"): stream_question_rewriter_step,
+    ("on_chain_end", "decide_to_generate"): stream_decide_to_generate_step,
+    ("on_chain_end", "end_with_message"): stream_end_with_message_after_grade_answer,
+}
+
+# Filters for `astream_events`, so that only the runs rendered in the UI are streamed
+STREAMED_NAMES = [
+    "retrieval_grader",
+    "batch_retrieval_grader",
+    "hallucination_grader",
+    "answer_grader",
+    "question_rewriter",
+    "multi_query_rewriter",
+    "decide_to_generate",
+    "end_with_message",
+    # Streamed into the live answer
+    "rag_chain",
+    "grade_generation_v_documents_and_question",
+]
+STREAMED_TYPES = ["retriever"]
+
+
+async def dispatch_event(event) -> None:
+    """Streams the step rendered for the event received, if any."""
+    handler = STEP_HANDLERS.get((event["event"], event["name"])) or STEP_HANDLERS.get(
+        (event["event"], None)
+    )
+    if handler is not None:
+        await handler(event)
+
+
 async def stream_final_answer(event):
-    """Streams the final answer based on the event received."""
-    if (
-        isinstance(event["data"]["output"], list)
-        and "end_with_message" in event["data"]["output"][-1]
-    ):
-        answer = event["data"]["output"][-1]["end_with_message"]["generation"]
-        source_documents = []
-    elif "end_with_message" in event["data"]["output"]:
-        answer = event["data"]["output"]["end_with_message"]["generation"]
-        source_documents = []
-    else:
-        answer = event["data"]["output"]["generate"]["generation"]
-        source_documents = event["data"]["output"]["generate"]["documents"]
+    """Streams the final answer based on the final event of the workflow."""
+    answer = event["data"]["output"]["generation"]
+    source_documents = event["data"]["output"]["documents"]
 
     if source_documents:
         async with cl.Step(name="Answer Grader") as step:
             step.output = "Answer is generated based on the documents below:"
             await step.update()
 
-        async with cl.Step(name="Answer Grader", language="python") as step:
-            step_output = ""
-            for doc in event["data"]["output"]["generate"]["documents"]:
-                step_output += str(doc) + "\n"
-            step.output = step_output
+        async with cl.Step(name="Answer Grader") as step:
+            step.output = format_documents(source_documents)
             await step.update()
 
     return answer, source_documents
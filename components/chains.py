@@ -1,8 +1,19 @@
+import re
+from typing import List
+
 from langchain_core.language_models.llms import LLM
 from langchain_core.output_parsers import PydanticOutputParser, StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
 
-from components.schemas import GradeAnswer, GradeDocuments, GradeHallucinations
+from components.schemas import (
+    GradeAnswer,
+    GradeDocuments,
+    GradeDocumentsBatch,
+    GradeHallucinations,
+)
+from components.verdict_cache import normalize_text, text_hash, with_verdict_cache
+
+_LIST_MARKER = re.compile(r"^\s*(?:[-*]|\d+[.)])\s+")
 
 
 def create_rag_chain(llm: LLM):
@@ -22,12 +33,12 @@ def create_rag_chain(llm: LLM):
 
     prompt = ChatPromptTemplate.from_messages([("human", human)])
 
-    return prompt | llm | StrOutputParser()
+    return prompt | llm.with_config(run_name="rag_chain") | StrOutputParser()
 
 
 def create_retrieval_grader(llm: LLM):
     """
-    Create the retrieval grader.
+    Create the retrieval grader. Its verdicts are cached, see `with_verdict_cache`.
 
     Returns:
         The retrieval grader.
@@ -51,12 +62,66 @@ def create_retrieval_grader(llm: LLM):
         ]
     ).partial(format_instructions=parser.get_format_instructions())
 
-    return prompt | llm.with_config(run_name="retrieval_grader") | parser
+    return with_verdict_cache(
+        prompt | llm.with_config(run_name="retrieval_grader") | parser,
+        name="retrieval_grader",
+        key_fn=lambda x: f"{normalize_text(x['question'])}|{text_hash(x['document'])}",
+        llm=llm,
+    )
+
+
+def number_documents(documents: List[str]) -> str:
+    """Number documents for a listwise prompt, "[1] text", from 1."""
+    return "\n\n".join(f"[{i}] {text}" for i, text in enumerate(documents, start=1))
+
+
+def create_batch_retrieval_grader(llm: LLM):
+    """
+    Create the listwise retrieval grader, which grades all retrieved documents in one
+    call. It takes the question and a list of document texts, and returns a
+    `GradeDocumentsBatch` whose grades refer to the documents by their number, from 1.
+    Its verdicts are cached, see `with_verdict_cache`.
+
+    Returns:
+        The batch retrieval grader.
+    """
+
+    system = """You are a grader assessing relevance of retrieved documents to a user question. \n
+        It does not need to be a stringent test. The goal is to filter out erroneous retrievals. \n
+        The documents are numbered. Grade each document separately: if it contains keyword(s) or semantic meaning \n
+        related to the user question, grade it as relevant. \n
+        Give a binary score 'yes' or 'no' for every document, with its number, to indicate whether it is relevant to the question. \n
+        {format_instructions}"""
+
+    parser = PydanticOutputParser(pydantic_object=GradeDocumentsBatch)
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            (
+                "human",
+                "Retrieved documents: \n\n {documents} \n\n User question: {question}",
+            ),
+        ]
+    ).partial(format_instructions=parser.get_format_instructions())
+
+    def format_input(x):
+        return {"question": x["question"], "documents": number_documents(x["documents"])}
+
+    return with_verdict_cache(
+        format_input
+        | prompt
+        | llm.with_config(run_name="batch_retrieval_grader")
+        | parser,
+        name="batch_retrieval_grader",
+        key_fn=lambda x: f"{normalize_text(x['question'])}|{text_hash(x['documents'])}",
+        llm=llm,
+    )
 
 
 def create_hallucination_grader(llm: LLM):
     """
-    Create the hallucination grader.
+    Create the hallucination grader. Its verdicts are cached, see `with_verdict_cache`.
 
     Returns:
         The hallucination grader.
@@ -78,12 +143,17 @@ def create_hallucination_grader(llm: LLM):
         ]
     ).partial(format_instructions=parser.get_format_instructions())
 
-    return prompt | llm.with_config(run_name="hallucination_grader") | parser
+    return with_verdict_cache(
+        prompt | llm.with_config(run_name="hallucination_grader") | parser,
+        name="hallucination_grader",
+        key_fn=lambda x: f"{text_hash(x['documents'])}|{text_hash(x['generation'])}",
+        llm=llm,
+    )
 
 
 def create_answer_grader(llm: LLM):
     """
-    Create the answer grader.
+    Create the answer grader. Its verdicts are cached, see `with_verdict_cache`.
 
     Returns:
         The answer grader.
@@ -102,7 +172,12 @@ def create_answer_grader(llm: LLM):
         ]
     ).partial(format_instructions=parser.get_format_instructions())
 
-    return prompt | llm.with_config(run_name="answer_grader") | parser
+    return with_verdict_cache(
+        prompt | llm.with_config(run_name="answer_grader") | parser,
+        name="answer_grader",
+        key_fn=lambda x: f"{normalize_text(x['question'])}|{text_hash(x['generation'])}",
+        llm=llm,
+    )
 
 
 def create_question_rewriter(llm: LLM):
@@ -128,3 +203,40 @@ def create_question_rewriter(llm: LLM):
     )
 
     return prompt | llm.with_config(run_name="question_rewriter") | StrOutputParser()
+
+
+def create_multi_query_rewriter(llm: LLM, num_queries: int):
+    """
+    Create the multi-query rewriter, which writes several versions of a question in
+    one call.
+
+    Returns:
+        The multi-query rewriter, returning a list of questions.
+    """
+
+    system = """You a question re-writer that converts an input question to better versions that are optimized \n
+            for vectorstore retrieval. Look at the input and try to reason about the underlying semantic intent / meaning. \n
+            Write {num_queries} different versions that approach the question from different angles, one per line, \n
+            without numbering or any explanation."""
+
+    prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", system),
+            (
+                "human",
+                "Here is the initial question: \n\n {question} \n Formulate improved questions.",
+            ),
+        ]
+    ).partial(num_queries=str(num_queries))
+
+    def parse_questions(text: str) -> List[str]:
+        # Drop the list markers models add despite the instructions
+        questions = [_LIST_MARKER.sub("", line).strip() for line in text.splitlines()]
+        return [question for question in questions if question][:num_queries]
+
+    return (
+        prompt
+        | llm.with_config(run_name="multi_query_rewriter")
+        | StrOutputParser()
+        | parse_questions
+    )
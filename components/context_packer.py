@@ -0,0 +1,139 @@
+import math
+from typing import List, Optional, Tuple
+
+from langchain_core.documents import Document
+from loguru import logger
+
+from config import settings
+
+# Overlaps shorter than this are treated as coincidental
+MIN_OVERLAP_CHARS = 20
+# A passage is not truncated to fewer tokens than this
+MIN_TRUNCATED_TOKENS = 32
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens of a text, see `settings.CHARS_PER_TOKEN`."""
+    return math.ceil(len(text) / settings.CHARS_PER_TOKEN)
+
+
+def _overlap(left: str, right: str) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`."""
+    longest = min(len(left), len(right), settings.CHUNK_OVERLAP)
+    for size in range(longest, MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+
+    return 0
+
+
+def _join(passage: str, text: str) -> Optional[str]:
+    """Merge two texts of a page if one contains or overlaps the other."""
+    if text in passage:
+        return passage
+    if passage in text:
+        return text
+    if overlap := _overlap(passage, text):
+        return passage + text[overlap:]
+    if overlap := _overlap(text, passage):
+        return text + passage[overlap:]
+
+    return None
+
+
+def merge_chunks(
+    documents: List[Document],
+) -> List[Tuple[Optional[str], Optional[int], str]]:
+    """
+    Merge the chunks of each page into passages, without the text they share.
+
+    Chunks of a page overlap by up to `settings.CHUNK_OVERLAP` characters. Chunks that
+    are contained in a passage are dropped, and chunks that overlap a passage are
+    merged into it. Passages keep the order of their most relevant chunk.
+
+    Args:
+        documents (List[Document]): Retrieved chunks, most relevant first.
+
+    Returns:
+        List[Tuple[Optional[str], Optional[int], str]]: Document name, for the chunks
+            of a corpus, page number and text of each passage.
+    """
+    passages: List[Tuple[Tuple, str]] = []
+    for doc in documents:
+        key = (
+            doc.metadata.get("source"),
+            doc.metadata.get("document_name"),
+            doc.metadata.get("page"),
+        )
+        text = doc.page_content.strip()
+        position = len(passages)
+        # A chunk can bridge two passages, so merge until nothing overlaps
+        merged = True
+        while merged:
+            merged = False
+            for i, (passage_key, passage) in enumerate(passages):
+                joined = _join(passage, text) if passage_key == key else None
+                if joined is not None:
+                    del passages[i]
+                    text = joined
+                    position = min(position, i)
+                    merged = True
+                    break
+            position = min(position, len(passages))
+        passages.insert(position, (key, text))
+
+    return [(key[1], key[2], text) for key, text in passages]
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    max_chars = int(max_tokens * settings.CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+
+def pack_context(documents: List[Document], max_tokens: int, chain: str = "") -> str:
+    """
+    Format retrieved chunks as a prompt context within a token budget.
+
+    Only the page text is kept, prefixed with a page citation such as "[p. 3]", or
+    "[contract.pdf, p. 3]" for the chunks of a corpus, which name their document.
+    Overlapping chunks are merged, see `merge_chunks`, and passages are added most
+    relevant first until the budget is spent, truncating the last one.
+
+    Args:
+        documents (List[Document]): Retrieved chunks, most relevant first.
+        max_tokens (int): Token budget of the context.
+        chain (str): Name of the chain the context is for, used in logs.
+
+    Returns:
+        str: The context.
+    """
+    parts = []
+    budget = max_tokens
+    for name, page, text in merge_chunks(documents):
+        labels = [name] if name else []
+        if page is not None:
+            labels.append(f"p. {page + 1}")
+        citation = f"[{', '.join(labels)}] " if labels else ""
+        part = citation + text
+        tokens = estimate_tokens(part) + 1
+        if tokens > budget:
+            remaining = budget - estimate_tokens(citation) - 1
+            if remaining >= MIN_TRUNCATED_TOKENS:
+                parts.append(citation + _truncate(text, remaining))
+            break
+        parts.append(part)
+        budget -= tokens
+    context = "\n\n".join(parts)
+
+    # Documents used to be rendered as the repr of the list
+    unpacked_tokens = estimate_tokens(str(documents))
+    packed_tokens = estimate_tokens(context)
+    logger.info(
+        f"Packed {len(documents)} chunks for {chain or 'context'}: {packed_tokens} "
+        f"tokens, {unpacked_tokens - packed_tokens} saved"
+    )
+
+    return context
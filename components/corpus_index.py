@@ -0,0 +1,130 @@
+import asyncio
+import hashlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from components.index_builder import get_embeddings
+from components.lexical_index import chunk_key, reciprocal_rank_fusion
+from components.progressive_index import ProgressiveIndex
+from config import settings
+
+
+def corpus_key(keys: List[str]) -> str:
+    """Identity of a corpus, from the index cache keys of its documents in any order."""
+    return hashlib.sha256("\n".join(sorted(set(keys))).encode()).hexdigest()
+
+
+class CorpusIndex:
+    """Index of a corpus of documents, searched as one.
+
+    Each document keeps its own `ProgressiveIndex`, so it is cached, shared by sessions
+    and re-indexed like a document uploaded alone, and is searchable while it is
+    indexed. A search embeds the query once, merges the vector and the lexical
+    rankings of all the documents by score, and fuses them with
+    `reciprocal_rank_fusion`. Vector scores are cosine similarities of the same model,
+    BM25 scores only roughly comparable, their statistics being per document.
+
+    The files of the documents, which have a `name` and a `path`, are kept by index
+    cache key, and the names of the files that could not be opened at all in
+    `unopened`. The chunks found carry the index cache key and the file name of their
+    document in their metadata, as `document_id` and `document_name`.
+    """
+
+    def __init__(
+        self,
+        indexes: Dict[str, ProgressiveIndex],
+        files: Dict[str, Any],
+        unopened: Optional[List[str]] = None,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        self.indexes = indexes
+        self.files = files
+        self.unopened = unopened or []
+        self.embeddings = embeddings
+        self.key = corpus_key(list(indexes))
+
+    @property
+    def done(self) -> bool:
+        """Whether every document is indexed."""
+        return all(index.done for index in self.indexes.values())
+
+    @property
+    def num_pages(self) -> int:
+        return sum(index.num_pages for index in self.indexes.values())
+
+    def indexed_documents(self) -> List[str]:
+        """Names of the documents that are fully indexed."""
+        return [
+            self.files[key].name for key, index in self.indexes.items() if index.done
+        ]
+
+    def failed_documents(self) -> List[str]:
+        """Names of the documents that could not be opened or whose indexing failed."""
+        return self.unopened + [
+            self.files[key].name
+            for key, index in self.indexes.items()
+            if index.error is not None
+        ]
+
+    async def wait_done(self) -> None:
+        """Wait until every document is indexed, or failed, raising the first error."""
+        results = await asyncio.gather(
+            *(index.wait_done() for index in self.indexes.values()),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    def search(
+        self, query: str, k: int, search_kwargs: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        """
+        Search the pages of all the documents indexed so far.
+
+        Args:
+            query (str): The query.
+            k (int): Maximum number of documents returned.
+            search_kwargs (Optional[Dict[str, Any]]): Keyword arguments of the Qdrant
+                searches, ignored by quantized searches.
+
+        Returns:
+            List[Document]: The matching documents, best first, with their scores and
+                their document in their metadata.
+        """
+        candidates = k
+        if settings.HYBRID_RETRIEVAL:
+            candidates = max(k, settings.RETRIEVAL_CANDIDATES)
+        self.embeddings = self.embeddings or get_embeddings()
+        query_vector = self.embeddings.embed_query(query)
+
+        merged: Dict[str, List[Tuple[float, str, Document]]] = {}
+        for key, index in self.indexes.items():
+            rankings = index.rankings(query, candidates, search_kwargs, query_vector)
+            for name, ranking in rankings.items():
+                merged.setdefault(name, []).extend(
+                    (score, key, doc) for doc, score in ranking
+                )
+
+        rankings = {
+            name: [
+                (self._annotate(doc, key), score)
+                for score, key, doc in sorted(
+                    ranking, key=lambda item: item[0], reverse=True
+                )[:candidates]
+            ]
+            for name, ranking in merged.items()
+        }
+
+        return reciprocal_rank_fusion(rankings, k=k, rrf_k=settings.RRF_K)
+
+    def _annotate(self, doc: Document, key: str) -> Document:
+        metadata = dict(
+            doc.metadata, document_id=key, document_name=self.files[key].name
+        )
+        # The same chunk may be in several documents, each is a source of its own
+        metadata["chunk_id"] = f"{key}:{chunk_key(doc)}"
+
+        return Document(page_content=doc.page_content, metadata=metadata)
@@ -1,28 +1,140 @@
-from typing import List
+import hashlib
+import multiprocessing
+import os
+from collections import Counter, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
 
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyPDFLoader
+from langchain_core.documents import Document
 from loguru import logger
+from pypdf import PdfReader
 
 from config import settings
 
+_executor: Optional[Executor] = None
 
-def load_documents(file_path: str) -> List:
+
+def _num_workers() -> int:
+    return settings.INGEST_WORKERS or os.cpu_count() or 1
+
+
+def _get_executor() -> Executor:
+    """Process pool shared by all ingestions, started on first use."""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=_num_workers(),
+            # Forking the threaded server process is unsafe
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _executor
+
+
+def shutdown_executor() -> None:
+    """Stop the ingestion process pool, which is started again on next use."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+def _extract_pages(file_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """Extract the text of pages [start, stop) of a PDF file."""
+    reader = PdfReader(file_path)
+
+    return [(i, reader.pages[i].extract_text()) for i in range(start, stop)]
+
+
+def count_pages(file_path: str) -> int:
+    """Number of pages of a PDF file."""
+    return len(PdfReader(file_path).pages)
+
+
+def _iter_page_ranges(file_path: str) -> Iterator[List[Tuple[int, str]]]:
+    """Extract page ranges in the process pool, keeping a bounded number in flight."""
+    num_pages = count_pages(file_path)
+    pages_per_task = settings.INGEST_PAGES_PER_TASK
+
+    # Small documents are parsed in the pool too, so that the documents of a corpus,
+    # each indexed from its own thread, are parsed in parallel
+    executor = _get_executor()
+    max_in_flight = 2 * _num_workers()
+    pending = deque()
+    try:
+        for start in range(0, num_pages, pages_per_task):
+            stop = min(start + pages_per_task, num_pages)
+            pending.append(executor.submit(_extract_pages, file_path, start, stop))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def iter_pages(file_path: str) -> Iterator[Document]:
     """
-    Load and split documents from a PDF file.
+    Parse the pages of a PDF file across a process pool.
+
+    Pages are parsed in ranges of `settings.INGEST_PAGES_PER_TASK` and yielded in order
+    as soon as their range is parsed, while later ranges are still being parsed. At most
+    two ranges per worker are in flight, so memory does not grow with the file size.
 
     Args:
         file_path (str): Path to the PDF file.
 
-    Returns:
-        List: List of document chunks.
+    Yields:
+        Document: One document per page, with the same metadata as `PyPDFLoader`.
+    """
+    for pages in _iter_page_ranges(file_path):
+        for page, text in pages:
+            yield Document(
+                page_content=text, metadata={"source": file_path, "page": page}
+            )
+
+
+def iter_documents(file_path: str) -> Iterator[Document]:
+    """
+    Load and split documents from a PDF file, one page at a time.
+
+    Each chunk gets a `chunk_id` in its metadata, derived from its text, so that the
+    same chunk has the same id in every index of the document.
+
+    Args:
+        file_path (str): Path to the PDF file.
+
+    Yields:
+        Document: Document chunks, in page order.
     """
 
     logger.info(f"Loading documents from {file_path}")
-    loader = PyPDFLoader(file_path)
-    document = loader.load()
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=settings.CHUNK_SIZE, chunk_overlap=settings.CHUNK_OVERLAP
     )
+    occurrences = Counter()
+
+    for page in iter_pages(file_path):
+        for chunk in text_splitter.split_documents([page]):
+            text_hash = hashlib.sha256(chunk.page_content.encode()).hexdigest()[:32]
+            # Repeated chunks, e.g. page headers, are told apart by their occurrence
+            chunk.metadata["chunk_id"] = f"{text_hash}-{occurrences[text_hash]}"
+            occurrences[text_hash] += 1
+            yield chunk
+
+
+def load_documents(file_path: str) -> List:
+    """
+    Load and split documents from a PDF file.
+
+    Args:
+        file_path (str): Path to the PDF file.
+
+    Returns:
+        List: List of document chunks.
+    """
 
-    return text_splitter.split_documents(document)
+    return list(iter_documents(file_path))
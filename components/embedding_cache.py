@@ -0,0 +1,210 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+from config import settings
+
+
+class EmbeddingCache:
+    """On-disk cache of chunk embeddings keyed by (model, dtype, chunk text hash).
+
+    Vectors of one model are appended to a flat float16/float32 file per dtype that is
+    read back through a memory map, and a SQLite table maps each key to its row in that
+    file. Rows missing from their file, e.g. after it was deleted, are cache misses.
+    """
+
+    def __init__(self, directory: str, dtype: str = "float16"):
+        self.directory = directory
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._memmaps: Dict[Tuple[str, int], np.memmap] = {}
+
+    @property
+    def hit_rate(self) -> float:
+        """Share of looked up chunks that were found in the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        Look up the embeddings of texts.
+
+        Args:
+            model (str): Embedding model name.
+            texts (List[str]): Texts to look up.
+
+        Returns:
+            List[Optional[List[float]]]: Embedding of each text, None when not cached.
+        """
+        hashes = [self.text_hash(text) for text in texts]
+
+        with self._lock:
+            rows = {}
+            connection = self._connect()
+            # Stay well below SQLite's limit on query parameters
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start : start + 500]
+                rows.update(
+                    (text_hash, (dim, row))
+                    for text_hash, dim, row in connection.execute(
+                        "SELECT text_hash, dim, row FROM vector_rows"
+                        " WHERE model = ? AND dtype = ?"
+                        f" AND text_hash IN ({','.join('?' * len(batch))})",
+                        [model, self.dtype.name, *batch],
+                    )
+                )
+
+            embeddings = []
+            for text_hash in hashes:
+                vectors = None
+                if text_hash in rows:
+                    dim, row = rows[text_hash]
+                    vectors = self._vectors(model, dim, row + 1)
+                if vectors is not None:
+                    embeddings.append(vectors[row].astype(np.float32).tolist())
+                else:
+                    embeddings.append(None)
+
+            found = sum(embedding is not None for embedding in embeddings)
+            self.hits += found
+            self.misses += len(embeddings) - found
+
+        return embeddings
+
+    def put_many(
+        self, model: str, texts: List[str], embeddings: List[List[float]]
+    ) -> None:
+        """
+        Store the embeddings of texts.
+
+        Args:
+            model (str): Embedding model name.
+            texts (List[str]): Embedded texts.
+            embeddings (List[List[float]]): Embedding of each text.
+        """
+        if not texts:
+            return
+
+        vectors = np.asarray(embeddings, dtype=self.dtype)
+        dim = vectors.shape[1]
+
+        with self._lock:
+            connection = self._connect()
+            path = self._vectors_path(model, dim)
+            first_row = os.path.getsize(path) // (dim * self.dtype.itemsize)
+            with open(path, "ab") as f:
+                f.write(vectors.tobytes())
+
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO vector_rows"
+                    " (model, dtype, text_hash, dim, row) VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (
+                            model,
+                            self.dtype.name,
+                            self.text_hash(text),
+                            dim,
+                            first_row + i,
+                        )
+                        for i, text in enumerate(texts)
+                    ],
+                )
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite"), check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS vector_rows ("
+                "model TEXT, dtype TEXT, text_hash TEXT, dim INTEGER, row INTEGER,"
+                " PRIMARY KEY (model, dtype, text_hash))"
+            )
+
+        return self._connection
+
+    def _vectors_path(self, model: str, dim: int) -> str:
+        name = re.sub(r"[^\w.-]", "_", model)
+        path = os.path.join(self.directory, f"{name}-{dim}.{self.dtype.name}")
+        if not os.path.exists(path):
+            open(path, "wb").close()
+
+        return path
+
+    def _vectors(self, model: str, dim: int, min_rows: int) -> Optional[np.memmap]:
+        """
+        Memory map of a model's vectors, remapped when rows were appended, or None if
+        the file has fewer than `min_rows` rows.
+        """
+        vectors = self._memmaps.get((model, dim))
+        if vectors is None or len(vectors) < min_rows:
+            path = self._vectors_path(model, dim)
+            rows = os.path.getsize(path) // (dim * self.dtype.itemsize)
+            if rows < min_rows:
+                return None
+            vectors = np.memmap(path, dtype=self.dtype, mode="r", shape=(rows, dim))
+            self._memmaps[(model, dim)] = vectors
+
+        return vectors
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings that look chunks up in an `EmbeddingCache` before calling the provider.
+
+    Queries are not cached, they go straight to the provider.
+    """
+
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        embeddings = self.cache.get_many(self.model, texts)
+
+        missing = list(
+            dict.fromkeys(
+                text for text, embedding in zip(texts, embeddings) if embedding is None
+            )
+        )
+        if missing:
+            computed = dict(zip(missing, self.embeddings.embed_documents(missing)))
+            self.cache.put_many(self.model, missing, list(computed.values()))
+            embeddings = [
+                computed[text] if embedding is None else embedding
+                for text, embedding in zip(texts, embeddings)
+            ]
+
+        logger.info(
+            f"Embedding cache: {len(texts) - len(missing)}/{len(texts)} chunks cached,"
+            f" hit rate {self.cache.hit_rate:.1%}"
+        )
+
+        return embeddings
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.embeddings.aembed_query(text)
+
+
+embedding_cache = EmbeddingCache(
+    directory=settings.EMBEDDING_CACHE_DIR, dtype=settings.EMBEDDING_CACHE_DTYPE
+)
@@ -0,0 +1,42 @@
+import os
+from typing import Optional
+
+from loguru import logger
+
+
+def render_workflow_graph(
+    app, image_path: str = "resources/rag_workflow.png"
+) -> Optional[str]:
+    """
+    Render the diagram of a compiled graph, reusing the image on disk when it is current.
+
+    The mermaid source of the graph is stored next to the image. The image is rendered
+    again, through the remote mermaid renderer, only when the graph structure changed.
+
+    Args:
+        app (CompiledGraph): The compiled graph.
+        image_path (str): Path of the PNG image.
+
+    Returns:
+        Optional[str]: Path of the image, or None if it could not be rendered.
+    """
+    mermaid = app.get_graph().draw_mermaid()
+    mermaid_path = os.path.splitext(image_path)[0] + ".mmd"
+
+    if os.path.exists(image_path) and os.path.exists(mermaid_path):
+        with open(mermaid_path) as f:
+            if f.read() == mermaid:
+                return image_path
+
+    try:
+        img_data = app.get_graph().draw_mermaid_png()
+    except Exception as e:
+        logger.warning(f"Could not render the workflow graph: {e!r}")
+        return None
+
+    with open(image_path, "wb") as f:
+        f.write(img_data)
+    with open(mermaid_path, "w") as f:
+        f.write(mermaid)
+
+    return image_path
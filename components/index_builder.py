@@ -1,47 +1,288 @@
-import os
-from typing import List
+import json
+import shutil
+import uuid
+from contextlib import nullcontext
+from itertools import islice
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Tuple
 
-from langchain_community.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from langchain_core.documents import Document
 from langchain_qdrant import Qdrant
 from langchain_voyageai import VoyageAIEmbeddings
+from qdrant_client.http import models
 from loguru import logger
 
+from components.embedding_cache import CachedEmbeddings, embedding_cache
+from components.lexical_index import LexicalIndex, chunk_key
+from components.quantized_vectors import save_vectors
+from components.rate_limiter import ConcurrencyLimitedEmbeddings, embedding_slots
 from config import settings
 
+# Metadata shared by all the chunks of a document, updated in bulk on re-indexing
+DOCUMENT_METADATA_KEYS = ("source",)
 
-def build_index(documents: List, persist_directory: str) -> Chroma:
+_POINT_ID_NAMESPACE = uuid.UUID("6f1c1e0a-43b5-4c59-9a4e-1a3e2b7d5c10")
+
+
+def point_id(doc: Document) -> str:
+    """Qdrant point id of a chunk, stable across the indexes of its document."""
+    return str(uuid.uuid5(_POINT_ID_NAMESPACE, chunk_key(doc)))
+
+
+def get_embeddings() -> Embeddings:
+    """Create the embedding model used to build and query indexes."""
+    logger.info(f"Embeddings used: {settings.EMBEDDING_MODEL}")
+
+    embeddings = ConcurrencyLimitedEmbeddings(
+        VoyageAIEmbeddings(
+            voyage_api_key=settings.VOYAGE_API_KEY, model=settings.EMBEDDING_MODEL
+        ),
+        slots=embedding_slots,
+    )
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return embeddings
+
+    return CachedEmbeddings(
+        embeddings=embeddings, model=settings.EMBEDDING_MODEL, cache=embedding_cache
+    )
+
+
+def build_index(
+    documents: Iterable,
+    persist_directory: str,
+    lock: Optional[ContextManager] = None,
+    on_batch: Optional[Callable[[Qdrant, List], None]] = None,
+    lexical_index: Optional[LexicalIndex] = None,
+    embeddings: Optional[Embeddings] = None,
+) -> Qdrant:
     """Build a vectorstore index from documents.
 
+    Documents are consumed in batches of `settings.INDEX_BATCH_SIZE`, so a generator
+    such as `iter_documents` is embedded and upserted while it is still being parsed.
+    A lexical index of the same documents is saved next to the collection, see
+    `LexicalIndex`, and so are the vectors, for quantized searches, see
+    `QuantizedVectors`.
+
     Args:
-        documents (List): List of document chunks.
+        documents (Iterable): Document chunks.
         persist_directory (str): Directory to persist the index.
+        lock (Optional[ContextManager]): Held while an embedded batch is added to the
+            index, for indexes that are searched while they are built.
+        on_batch (Optional[Callable[[Qdrant, List], None]]): Called after each batch is
+            indexed with the vectorstore and the batch.
+        lexical_index (Optional[LexicalIndex]): Lexical index the documents are added
+            to, for indexes that are searched while they are built.
+        embeddings (Optional[Embeddings]): Embedding model, defaults to
+            `get_embeddings()`.
 
     Returns:
-        Chroma: Vectorstore object.
+        Qdrant: Vectorstore object.
     """
-    embeddings = VoyageAIEmbeddings(
-        voyage_api_key=settings.VOYAGE_API_KEY, model=settings.EMBEDDING_MODEL
-    )
-    logger.info(f"Embeddings used: {settings.EMBEDDING_MODEL}")
-
-    if os.path.exists(persist_directory):
-        logger.info(f"Index already exists in {persist_directory}")
-        vector_db = Qdrant.from_existing_collection(
-            embedding=embeddings,
-            path=persist_directory,
-            collection_name="GPTs",
-        )
-
-        return vector_db
-
     logger.info("Building index ...")
+    embeddings = embeddings or get_embeddings()
+    documents = iter(documents)
+    lexical_index = lexical_index if lexical_index is not None else LexicalIndex()
+
+    batch = list(islice(documents, settings.INDEX_BATCH_SIZE))
+    if not batch:
+        raise ValueError("No text could be extracted from the document.")
 
     vector_db = Qdrant.from_documents(
-        documents=documents,
+        documents=batch,
         embedding=embeddings,
+        ids=[point_id(doc) for doc in batch],
         path=persist_directory,
         collection_name="GPTs",
     )
-    logger.info(f"Index built in {persist_directory}")
+    with lock or nullcontext():
+        lexical_index.add_documents(batch)
+    num_documents = len(batch)
+    if on_batch is not None:
+        on_batch(vector_db, batch)
+
+    while batch := list(islice(documents, settings.INDEX_BATCH_SIZE)):
+        # Searches are only locked out while the embedded batch is upserted
+        vectors = embeddings.embed_documents([doc.page_content for doc in batch])
+        with lock or nullcontext():
+            _upsert(vector_db, batch, vectors)
+            lexical_index.add_documents(batch)
+        num_documents += len(batch)
+        if on_batch is not None:
+            on_batch(vector_db, batch)
+
+    lexical_index.save(persist_directory)
+    save_vectors(vector_db, lexical_index, persist_directory)
+    logger.info(f"Index of {num_documents} chunks built in {persist_directory}")
+    if settings.EMBEDDING_CACHE_ENABLED:
+        logger.info(f"Embedding cache hit rate: {embedding_cache.hit_rate:.1%}")
 
     return vector_db
+
+
+def _upsert(vector_db: Qdrant, documents: List[Document], vectors: List) -> None:
+    """Upsert embedded chunks, with the point ids and payloads of `add_documents`."""
+    vector_db.client.upsert(
+        collection_name=vector_db.collection_name,
+        points=[
+            models.PointStruct(
+                id=point_id(doc),
+                vector=vector
+                if vector_db.vector_name is None
+                else {vector_db.vector_name: vector},
+                payload={
+                    vector_db.content_payload_key: doc.page_content,
+                    vector_db.metadata_payload_key: doc.metadata,
+                },
+            )
+            for doc, vector in zip(documents, vectors)
+        ],
+    )
+
+
+def _chunk_metadata(doc: Document) -> Dict:
+    return {
+        name: value
+        for name, value in doc.metadata.items()
+        if name not in DOCUMENT_METADATA_KEYS
+    }
+
+
+def _chunks_filter(keys: List[str]) -> models.Filter:
+    """Filter of the points of chunks, by chunk id whatever their point ids."""
+    return models.Filter(
+        must=[
+            models.FieldCondition(
+                key="metadata.chunk_id", match=models.MatchAny(any=keys)
+            )
+        ]
+    )
+
+
+def update_index(
+    documents: Iterable,
+    base_directory: str,
+    persist_directory: str,
+    lexical_index: Optional[LexicalIndex] = None,
+    embeddings: Optional[Embeddings] = None,
+) -> Qdrant:
+    """Build the index of a revised document from the index of a previous revision.
+
+    The previous index is copied, and diffed with the new chunks by their `chunk_id`
+    in batches of `settings.INDEX_BATCH_SIZE`, as they are parsed: only new chunks are
+    embedded and upserted, chunks that moved, e.g. to another page, get their new
+    metadata, and chunks that are gone are deleted at the end. Only the chunk ids of
+    the new revision are kept besides the lexical index, as by `build_index`. The
+    metadata in `DOCUMENT_METADATA_KEYS` is set on all the chunks at once. The lexical
+    index and the vectors are saved again, as by `build_index`.
+
+    Args:
+        documents (Iterable): Document chunks of the new revision.
+        base_directory (str): Directory of the index of the previous revision.
+        persist_directory (str): Directory to persist the index, which must not exist.
+        lexical_index (Optional[LexicalIndex]): Lexical index the documents are added
+            to.
+        embeddings (Optional[Embeddings]): Embedding model, defaults to
+            `get_embeddings()`.
+
+    Returns:
+        Qdrant: Vectorstore object.
+    """
+    logger.info(f"Updating index from {base_directory} ...")
+    documents = iter(documents)
+    batch = list(islice(documents, settings.INDEX_BATCH_SIZE))
+    if not batch:
+        raise ValueError("No text could be extracted from the document.")
+
+    base_index = LexicalIndex.load(base_directory)
+    if base_index is None:
+        raise ValueError(f"No lexical index to diff with in {base_directory}")
+    base_chunks = {chunk_key(doc): _chunk_metadata(doc) for doc in base_index.documents}
+    document_metadata = {
+        name: batch[0].metadata[name]
+        for name in DOCUMENT_METADATA_KEYS
+        if name in batch[0].metadata
+    }
+
+    shutil.copytree(base_directory, persist_directory)
+    vector_db = load_index(persist_directory, embeddings=embeddings)
+    lexical_index = lexical_index if lexical_index is not None else LexicalIndex()
+    new_keys = set()
+    num_added = 0
+    while batch:
+        added = [doc for doc in batch if chunk_key(doc) not in base_chunks]
+        if added:
+            vector_db.add_documents(added, ids=[point_id(doc) for doc in added])
+        # Chunks that only moved keep their vectors, their changed metadata is updated
+        moved: Dict[str, Tuple[Dict, List[str]]] = {}
+        for doc in batch:
+            base_metadata = base_chunks.get(chunk_key(doc))
+            if base_metadata is None or base_metadata == _chunk_metadata(doc):
+                continue
+            changes = {
+                name: value
+                for name, value in _chunk_metadata(doc).items()
+                if base_metadata.get(name) != value
+            }
+            group = moved.setdefault(
+                json.dumps(changes, sort_keys=True), (changes, [])
+            )
+            group[1].append(chunk_key(doc))
+        for changes, keys in moved.values():
+            vector_db.client.set_payload(
+                collection_name=vector_db.collection_name,
+                payload=changes,
+                points=_chunks_filter(keys),
+                key=vector_db.metadata_payload_key,
+            )
+        lexical_index.add_documents(batch)
+        new_keys.update(chunk_key(doc) for doc in batch)
+        num_added += len(added)
+        batch = list(islice(documents, settings.INDEX_BATCH_SIZE))
+
+    removed = [key for key in base_chunks if key not in new_keys]
+    for start in range(0, len(removed), settings.INDEX_BATCH_SIZE):
+        vector_db.client.delete(
+            collection_name=vector_db.collection_name,
+            points_selector=_chunks_filter(
+                removed[start : start + settings.INDEX_BATCH_SIZE]
+            ),
+        )
+    if document_metadata:
+        vector_db.client.set_payload(
+            collection_name=vector_db.collection_name,
+            payload=document_metadata,
+            points=models.Filter(),
+            key=vector_db.metadata_payload_key,
+        )
+
+    lexical_index.save(persist_directory)
+    save_vectors(vector_db, lexical_index, persist_directory)
+    logger.info(
+        f"Index of {len(new_keys)} chunks updated in {persist_directory}: "
+        f"{num_added} embedded, {len(removed)} deleted, "
+        f"{len(new_keys) - num_added} reused"
+    )
+
+    return vector_db
+
+
+def load_index(
+    persist_directory: str, embeddings: Optional[Embeddings] = None
+) -> Qdrant:
+    """Load a vectorstore index built by `build_index`.
+
+    Args:
+        persist_directory (str): Directory the index is persisted in.
+        embeddings (Optional[Embeddings]): Embedding model, defaults to
+            `get_embeddings()`.
+
+    Returns:
+        Qdrant: Vectorstore object.
+    """
+    logger.info(f"Loading index from {persist_directory}")
+
+    return Qdrant.from_existing_collection(
+        embedding=embeddings or get_embeddings(),
+        path=persist_directory,
+        collection_name="GPTs",
+    )
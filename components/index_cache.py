@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Set
+
+from loguru import logger
+
+from config import settings
+
+# Bump when the on-disk layout of an index changes, so old entries are not reused.
+INDEX_FORMAT_VERSION = 3
+
+LAST_USED_FILE = ".last_used"
+TMP_PREFIX = ".tmp-"
+# Key of the last index opened per user and document name, to re-index revisions
+# incrementally, for the users that opened a document most recently
+VERSIONS_FILE = "versions.json"
+MAX_VERSION_OWNERS = 1000
+# Owners of the chat sessions of earlier versions, which are never looked up again
+_SESSION_OWNER_PREFIX = "session:"
+
+
+def _directory_size(path: str) -> int:
+    size = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                size += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+
+    return size
+
+
+class IndexCache:
+    """Content-addressed store of vectorstore indexes.
+
+    An index is keyed by the hash of the file content together with the chunking and
+    embedding settings used to build it. Indexes are built in a temporary directory and
+    published with an atomic rename, and the least recently used ones are evicted once
+    the store grows past `max_bytes`. Keys in `pinned`, of indexes that are open, are
+    never evicted.
+    """
+
+    def __init__(self, root_directory: str, max_bytes: int):
+        self.root_directory = root_directory
+        self.max_bytes = max_bytes
+        self.pinned: Set[str] = set()
+
+    def key_for(self, file_path: str) -> str:
+        """
+        Compute the cache key of a file.
+
+        Args:
+            file_path (str): Path to the file.
+
+        Returns:
+            str: Hex digest identifying the content and the index settings.
+        """
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+
+        digest.update(
+            (
+                f"|v{INDEX_FORMAT_VERSION}|{settings.EMBEDDING_MODEL}"
+                f"|{settings.CHUNK_SIZE}|{settings.CHUNK_OVERLAP}"
+            ).encode()
+        )
+
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        """Directory of the index stored under `key`."""
+        return os.path.join(self.root_directory, key)
+
+    def lookup(self, key: str) -> Optional[str]:
+        """
+        Look up a published index and mark it as recently used.
+
+        Args:
+            key (str): Cache key.
+
+        Returns:
+            Optional[str]: Directory of the index, or None if it is not cached.
+        """
+        path = self.path(key)
+        if not os.path.isdir(path):
+            return None
+
+        self._touch(path)
+        logger.info(f"Index cache hit: {key}")
+
+        return path
+
+    def latest_version(self, owner: str, name: str) -> Optional[str]:
+        """
+        Key of the index an owner last opened for a document name, e.g. of a previous
+        revision of a document uploaded again.
+
+        Args:
+            owner (str): Identifier of the user who opened the document.
+            name (str): Name of the document, e.g. its file name.
+
+        Returns:
+            Optional[str]: Cache key, or None if the owner opened no document of
+                that name.
+        """
+        versions = self._load_versions().get(owner)
+        if not isinstance(versions, dict):
+            return None
+
+        return versions.get(name)
+
+    def record_version(self, owner: str, name: str, key: str) -> None:
+        """
+        Record the key of the index an owner last opened for a document name.
+
+        Documents are only matched by name among the documents of the same owner, so
+        a document is never taken for a revision of a document of someone else. The
+        owner must be stable across chat sessions, e.g. an authenticated user.
+
+        Args:
+            owner (str): Identifier of the user who opened the document.
+            name (str): Name of the document, e.g. its file name.
+            key (str): Cache key of its index.
+        """
+        versions = {
+            owner: owned
+            for owner, owned in self._load_versions().items()
+            if isinstance(owned, dict) and not owner.startswith(_SESSION_OWNER_PREFIX)
+        }
+        owned = versions.pop(owner, None)
+        if not isinstance(owned, dict):
+            owned = {}
+        owned[name] = key
+        versions[owner] = owned
+        while len(versions) > MAX_VERSION_OWNERS:
+            del versions[next(iter(versions))]
+
+        path = os.path.join(self.root_directory, VERSIONS_FILE)
+        os.makedirs(self.root_directory, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}"
+        with open(tmp_path, "w") as f:
+            json.dump(versions, f)
+        os.replace(tmp_path, path)
+
+    def _load_versions(self) -> Dict[str, Any]:
+        try:
+            with open(os.path.join(self.root_directory, VERSIONS_FILE)) as f:
+                versions = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return versions if isinstance(versions, dict) else {}
+
+    @contextmanager
+    def publish(self, key: str) -> Iterator[str]:
+        """
+        Build an index in a temporary directory and publish it under `key`.
+
+        The temporary directory is renamed to its final location only if the block
+        succeeds, so readers never see a partially built index. If another build
+        published the same key first, the new build is discarded.
+
+        Args:
+            key (str): Cache key.
+
+        Yields:
+            str: Temporary directory to build the index in.
+        """
+        os.makedirs(self.root_directory, exist_ok=True)
+        build_directory = os.path.join(
+            self.root_directory, f"{TMP_PREFIX}{key}-{uuid.uuid4().hex}"
+        )
+
+        try:
+            yield build_directory
+            self._touch(build_directory)
+            try:
+                os.rename(build_directory, self.path(key))
+                logger.info(f"Index published: {key}")
+            except OSError:
+                if not os.path.isdir(self.path(key)):
+                    raise
+                logger.info(f"Index {key} was published by another build")
+        finally:
+            shutil.rmtree(build_directory, ignore_errors=True)
+
+        self.evict(keep=key)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Remove the least recently used indexes until the store fits in `max_bytes`.
+
+        Args:
+            keep (Optional[str]): Key that must not be evicted.
+        """
+        entries = []
+        for name in os.listdir(self.root_directory):
+            path = os.path.join(self.root_directory, name)
+            if name.startswith(TMP_PREFIX) or not os.path.isdir(path):
+                continue
+            entries.append((self._last_used(path), name, _directory_size(path)))
+
+        total_bytes = sum(size for _, _, size in entries)
+        for _, name, size in sorted(entries):
+            if total_bytes <= self.max_bytes:
+                break
+            if name == keep or name in self.pinned:
+                continue
+
+            logger.info(f"Evicting index {name} ({size} bytes)")
+            shutil.rmtree(os.path.join(self.root_directory, name), ignore_errors=True)
+            total_bytes -= size
+
+    @staticmethod
+    def _touch(path: str) -> None:
+        with open(os.path.join(path, LAST_USED_FILE), "w") as f:
+            f.write(str(time.time()))
+
+    @staticmethod
+    def _last_used(path: str) -> float:
+        try:
+            return os.path.getmtime(os.path.join(path, LAST_USED_FILE))
+        except OSError:
+            return os.path.getmtime(path)
+
+
+index_cache = IndexCache(
+    root_directory=settings.INDEX_CACHE_DIR, max_bytes=settings.INDEX_CACHE_MAX_BYTES
+)
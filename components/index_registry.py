@@ -0,0 +1,182 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional
+
+from loguru import logger
+
+from components.index_cache import index_cache
+from components.progressive_index import ProgressiveIndex
+from config import settings
+
+
+class _Entry:
+    def __init__(self, task: asyncio.Future):
+        self.task = task
+        self.refs = 1
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+        # Set while no session holds the index
+        self.released = asyncio.Event()
+
+    def holds(self, index: ProgressiveIndex) -> bool:
+        return (
+            self.task.done()
+            and not self.task.cancelled()
+            and self.task.exception() is None
+            and self.task.result() is index
+        )
+
+
+class IndexRegistry:
+    """Process-wide registry of the open indexes, shared by all chat sessions.
+
+    Qdrant local mode locks the directory of a collection and loads the whole
+    collection in memory, so each document is opened once, however many sessions ask
+    about it, and a document that is being indexed is built once. Sessions acquire the
+    index of their document and release it when they end. An index that no session
+    holds is closed after `idle_seconds`, unless it is acquired again, and is not
+    evicted from the index cache while it is open. An index whose build fails is
+    forgotten, so the next session to acquire it builds it again, and is closed once
+    the sessions that still hold it release it.
+    """
+
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        self._entries: Dict[str, _Entry] = {}
+        # Entries of the indexes whose build failed, by index, while sessions hold them
+        self._failed: Dict[int, _Entry] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    async def acquire(
+        self, key: str, open_index: Callable[[], Awaitable[ProgressiveIndex]]
+    ) -> ProgressiveIndex:
+        """
+        Get the open index of a document, opening it if no session holds it.
+
+        Args:
+            key (str): Index cache key of the document.
+            open_index (Callable[[], Awaitable[ProgressiveIndex]]): Opens or builds
+                the index, called only if it is not open.
+
+        Returns:
+            ProgressiveIndex: The index, to `release` when the session ends.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = _Entry(asyncio.ensure_future(open_index()))
+            entry.task.add_done_callback(
+                lambda task: self._watch_build(key, entry, task)
+            )
+            self._entries[key] = entry
+            index_cache.pinned.add(key)
+            logger.info(f"Opening index {key} ({len(self._entries)} open)")
+        else:
+            entry.refs += 1
+            entry.released.clear()
+            if entry.idle_timer is not None:
+                entry.idle_timer.cancel()
+                entry.idle_timer = None
+            logger.info(f"Sharing index {key} with {entry.refs} sessions")
+
+        try:
+            return await asyncio.shield(entry.task)
+        except asyncio.CancelledError:
+            # The session ended while waiting, the index is kept for the others
+            self.release(key)
+            raise
+        except Exception:
+            # Every session waiting for the index gets the error, the next one retries
+            self._forget(key, entry)
+            raise
+
+    def release(self, key: str, index: Optional[ProgressiveIndex] = None) -> None:
+        """
+        Release an index acquired by a session.
+
+        Args:
+            key (str): Index cache key of the document.
+            index (Optional[ProgressiveIndex]): The acquired index, so that releasing
+                an index forgotten after its build failed leaves its rebuild open.
+        """
+        entry = self._entries.get(key)
+        if index is not None and (entry is None or not entry.holds(index)):
+            failed = self._failed.get(id(index))
+            if failed is not None:
+                failed.refs -= 1
+                if failed.refs <= 0:
+                    del self._failed[id(index)]
+                    failed.released.set()
+                    index.close()
+            return
+        if entry is None:
+            return
+
+        entry.refs -= 1
+        if entry.refs <= 0:
+            entry.released.set()
+            entry.idle_timer = asyncio.get_running_loop().call_later(
+                self.idle_seconds, self._close_idle, key
+            )
+
+    async def wait_released(self, index: ProgressiveIndex) -> None:
+        """Wait until no session holds an index, e.g. after its build failed."""
+        entry = self._failed.get(id(index))
+        if entry is None:
+            entry = next(
+                (entry for entry in self._entries.values() if entry.holds(index)), None
+            )
+        if entry is None:
+            return
+
+        while entry.refs > 0:
+            await entry.released.wait()
+
+    def _watch_build(self, key: str, entry: _Entry, task: asyncio.Future) -> None:
+        if task.cancelled() or task.exception() is not None:
+            return
+        if task.result().building:
+            asyncio.ensure_future(self._forget_if_build_fails(key, entry))
+
+    async def _forget_if_build_fails(self, key: str, entry: _Entry) -> None:
+        try:
+            await entry.task.result().wait_done()
+        except Exception:
+            logger.warning(f"Indexing {key} failed, it is built again on next use")
+            self._forget(key, entry)
+            index = entry.task.result()
+            if entry.idle_timer is not None:
+                entry.idle_timer.cancel()
+                entry.idle_timer = None
+            if entry.refs > 0:
+                self._failed[id(index)] = entry
+            else:
+                index.close()
+
+    def _forget(self, key: str, entry: _Entry) -> None:
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+            index_cache.pinned.discard(key)
+
+    def _close_idle(self, key: str) -> None:
+        entry = self._entries.get(key)
+        if entry is None or entry.refs > 0:
+            return
+        if entry.task.done() and entry.task.exception() is not None:
+            self._forget(key, entry)
+            return
+        if not entry.task.done() or entry.task.result().building:
+            # The index is closed once it is built
+            entry.idle_timer = asyncio.get_running_loop().call_later(
+                self.idle_seconds, self._close_idle, key
+            )
+            return
+
+        self._forget(key, entry)
+        entry.task.result().close()
+        logger.info(f"Closed idle index {key} ({len(self._entries)} open)")
+
+
+index_registry = IndexRegistry(idle_seconds=settings.INDEX_IDLE_SECONDS)
@@ -0,0 +1,150 @@
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from langchain_core.documents import Document
+from loguru import logger
+
+LEXICAL_INDEX_FILE = "lexical_index.jsonl"
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_PATTERN.findall(text.lower()) if len(token) > 1]
+
+
+def chunk_key(doc: Document) -> str:
+    """Identity of a chunk across the lexical and the vector index."""
+    return doc.metadata.get("chunk_id") or doc.page_content
+
+
+class LexicalIndex:
+    """In-memory BM25 inverted index of document chunks.
+
+    Chunks can be added while the index is searched, so it can follow an index that is
+    being built. It is saved next to the vector collection as one JSON line per chunk,
+    and the postings are rebuilt when it is loaded.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.documents: List[Document] = []
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._lengths: List[int] = []
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add_documents(self, documents: Iterable[Document]) -> None:
+        for doc in documents:
+            doc_id = len(self.documents)
+            tokens = tokenize(doc.page_content)
+            for token, count in Counter(tokens).items():
+                self._postings[token][doc_id] = count
+            self.documents.append(doc)
+            self._lengths.append(len(tokens))
+            self._total_length += len(tokens)
+
+    def search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        """
+        Find the chunks that best match a query by BM25 score.
+
+        Args:
+            query (str): The query.
+            k (int): Maximum number of chunks returned.
+
+        Returns:
+            List[Tuple[Document, float]]: Chunks and their scores, best first.
+        """
+        if not self.documents:
+            return []
+
+        num_documents = len(self.documents)
+        average_length = self._total_length / num_documents or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for token in set(tokenize(query)):
+            postings = self._postings.get(token)
+            if not postings:
+                continue
+            idf = math.log(
+                1 + (num_documents - len(postings) + 0.5) / (len(postings) + 0.5)
+            )
+            for doc_id, count in postings.items():
+                norm = self.k1 * (
+                    1 - self.b + self.b * self._lengths[doc_id] / average_length
+                )
+                scores[doc_id] += idf * count * (self.k1 + 1) / (count + norm)
+
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+        return [(self.documents[doc_id], score) for doc_id, score in best]
+
+    def save(self, directory: str) -> None:
+        with open(os.path.join(directory, LEXICAL_INDEX_FILE), "w") as f:
+            for doc in self.documents:
+                f.write(
+                    json.dumps(
+                        {"page_content": doc.page_content, "metadata": doc.metadata}
+                    )
+                    + "\n"
+                )
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["LexicalIndex"]:
+        """Load the lexical index saved in a directory, None if there is none."""
+        path = os.path.join(directory, LEXICAL_INDEX_FILE)
+        if not os.path.exists(path):
+            logger.warning(f"No lexical index in {directory}")
+            return None
+
+        index = cls()
+        with open(path) as f:
+            index.add_documents(Document(**json.loads(line)) for line in f)
+
+        return index
+
+
+def reciprocal_rank_fusion(
+    rankings: Dict[str, List[Tuple[Document, Optional[float]]]],
+    k: int,
+    rrf_k: int = 60,
+) -> List[Document]:
+    """
+    Fuse rankings of chunks with reciprocal rank fusion.
+
+    The score of each ranking, unless it is None, is kept in the metadata of the fused
+    chunks as `<name>_score`, together with the fused `rrf_score`.
+
+    Args:
+        rankings (Dict[str, List[Tuple[Document, Optional[float]]]]): Chunks and
+            scores, best first, per ranking name, e.g. "vector" and "lexical".
+        k (int): Maximum number of chunks returned.
+        rrf_k (int): Rank offset, higher values flatten the contribution of the top ranks.
+
+    Returns:
+        List[Document]: The fused chunks, best first.
+    """
+    fused: Dict[str, Document] = {}
+    fused_scores: Dict[str, float] = defaultdict(float)
+    for name, ranking in rankings.items():
+        for rank, (doc, score) in enumerate(ranking):
+            key = chunk_key(doc)
+            if key not in fused:
+                fused[key] = Document(
+                    page_content=doc.page_content, metadata=dict(doc.metadata)
+                )
+            if score is not None:
+                fused[key].metadata[f"{name}_score"] = score
+            fused_scores[key] += 1 / (rrf_k + rank + 1)
+
+    best = sorted(fused_scores, key=fused_scores.get, reverse=True)[:k]
+    for key in best:
+        fused[key].metadata["rrf_score"] = fused_scores[key]
+
+    return [fused[key] for key in best]
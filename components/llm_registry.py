@@ -0,0 +1,239 @@
+import random
+import time
+from functools import lru_cache
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_openai import ChatOpenAI
+from loguru import logger
+
+from components.rate_limiter import get_rate_limiter
+from components.telemetry import metrics
+from components.verdict_cache import model_name
+from config import settings
+
+
+def _connection_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=settings.LLM_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY_SECONDS,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_chat_model(provider: str) -> BaseChatModel:
+    """
+    Get the process-wide chat model of a provider.
+
+    Clients are created once and shared by every chat session, so connections are
+    pooled and kept alive across requests instead of being opened per session.
+
+    Args:
+        provider (str): "yi" or "google".
+
+    Returns:
+        BaseChatModel: The chat model.
+    """
+    if provider == "yi":
+        return ChatOpenAI(
+            model="yi-large",
+            temperature=0,
+            api_key=settings.YI_API_KEY,
+            base_url=settings.YI_BASE_URL,
+            timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=httpx.Client(limits=_connection_limits()),
+            http_async_client=httpx.AsyncClient(limits=_connection_limits()),
+        )
+    if provider == "google":
+        # A single gRPC channel multiplexes every request of the client
+        return ChatGoogleGenerativeAI(
+            model="gemini-1.5-flash-latest",
+            temperature=0.15,
+            google_api_key=settings.GOOGLE_API_KEY_B,
+            timeout=settings.LLM_REQUEST_TIMEOUT_SECONDS,
+            max_retries=settings.LLM_MAX_RETRIES,
+        )
+
+    raise ValueError(f"Unknown LLM provider: {provider}")
+
+
+class ProviderHealth:
+    """Moving averages of the latency and error rate observed for a provider."""
+
+    def __init__(self, alpha: float = 0.2):
+        self.alpha = alpha
+        self.latency: Optional[float] = None
+        self.error_rate = 0.0
+
+    def record(self, latency: float, error: bool) -> None:
+        if not error:
+            self.latency = (
+                latency
+                if self.latency is None
+                else self.alpha * latency + (1 - self.alpha) * self.latency
+            )
+        self.error_rate = self.alpha * error + (1 - self.alpha) * self.error_rate
+
+    def is_degraded(self, best_latency: Optional[float]) -> bool:
+        """Whether the provider errors too often, or is much slower than the best one."""
+        if self.error_rate > settings.LLM_FAILOVER_ERROR_RATE:
+            return True
+
+        return (
+            self.latency is not None
+            and best_latency is not None
+            and self.latency > settings.LLM_FAILOVER_LATENCY_RATIO * best_latency
+        )
+
+
+_health: Dict[str, ProviderHealth] = {}
+
+
+def get_provider_health(provider: str) -> ProviderHealth:
+    return _health.setdefault(provider, ProviderHealth())
+
+
+class ProviderRouter(Runnable):
+    """Chat model that routes each call across providers.
+
+    Providers are tried in preference order, except that degraded providers are moved
+    to the back, apart from a few probe calls that let them recover. A call that fails
+    is retried on the next provider. The run config, including the run name set with
+    `with_config`, is passed to the chosen chat model, so callback events look the
+    same as when the chat model is used directly.
+    """
+
+    def __init__(self, providers: List[str]):
+        self.providers = providers
+
+    @property
+    def model_name(self) -> str:
+        """Model of the provider that calls currently go to first."""
+        return model_name(get_chat_model(self._by_health()[0]))
+
+    def route(self) -> List[str]:
+        """Providers in the order they should be tried."""
+        # Now and then keep the preference order, so degraded providers are probed
+        if random.random() < settings.LLM_FAILOVER_PROBE_RATE:
+            return list(self.providers)
+
+        return self._by_health()
+
+    def _by_health(self) -> List[str]:
+        """Providers in preference order, degraded ones last."""
+        latencies = [
+            get_provider_health(provider).latency
+            for provider in self.providers
+            if get_provider_health(provider).latency is not None
+        ]
+        best_latency = min(latencies, default=None)
+
+        return sorted(
+            self.providers,
+            key=lambda provider: get_provider_health(provider).is_degraded(
+                best_latency
+            ),
+        )
+
+    def invoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        error = None
+        for provider in self.route():
+            start = time.perf_counter()
+            try:
+                output = get_chat_model(provider).invoke(input, config, **kwargs)
+            except Exception as e:
+                error = self._record_failure(provider, start, e)
+                continue
+
+            self._record_success(provider, start)
+            return output
+
+        raise error
+
+    async def ainvoke(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Any:
+        error = None
+        for provider in self.route():
+            await get_rate_limiter(provider).acquire()
+            start = time.perf_counter()
+            try:
+                output = await get_chat_model(provider).ainvoke(input, config, **kwargs)
+            except Exception as e:
+                error = self._record_failure(provider, start, e)
+                continue
+
+            self._record_success(provider, start)
+            return output
+
+        raise error
+
+    def stream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> Iterator[Any]:
+        error = None
+        for provider in self.route():
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in get_chat_model(provider).stream(input, config, **kwargs):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                # Chunks already sent cannot be taken back
+                if started:
+                    raise
+                error = self._record_failure(provider, start, e)
+                continue
+
+            self._record_success(provider, start)
+            return
+
+        raise error
+
+    async def astream(
+        self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any
+    ) -> AsyncIterator[Any]:
+        error = None
+        for provider in self.route():
+            await get_rate_limiter(provider).acquire()
+            start = time.perf_counter()
+            started = False
+            try:
+                async for chunk in get_chat_model(provider).astream(
+                    input, config, **kwargs
+                ):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                # Chunks already sent cannot be taken back
+                if started:
+                    raise
+                error = self._record_failure(provider, start, e)
+                continue
+
+            self._record_success(provider, start)
+            return
+
+        raise error
+
+    @staticmethod
+    def _record_success(provider: str, start: float) -> None:
+        latency = time.perf_counter() - start
+        get_provider_health(provider).record(latency, False)
+        metrics.provider_seconds.observe(latency, provider=provider)
+
+    @staticmethod
+    def _record_failure(provider: str, start: float, error: Exception) -> Exception:
+        get_provider_health(provider).record(time.perf_counter() - start, True)
+        metrics.llm_failovers.inc(provider=provider)
+        logger.warning(f"LLM provider {provider} failed ({error!r}), failing over")
+
+        return error
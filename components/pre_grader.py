@@ -0,0 +1,212 @@
+import asyncio
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from langchain_core.documents import Document
+
+from components.lexical_index import tokenize
+from config import settings
+
+# Words that carry no evidence of relevance when computing the query term overlap
+STOP_WORDS = set(
+    "about an and are as at be by can do does for from how in is it of on or that the "
+    "this to was what when where which who why with".split()
+)
+
+
+def query_term_overlap(question: str, text: str) -> float:
+    """Share of the question's content words that occur in a text."""
+    terms = set(tokenize(question)) - STOP_WORDS
+    if not terms:
+        return 0.0
+
+    return len(terms & set(tokenize(text))) / len(terms)
+
+
+class PreGrader:
+    """Grades retrieved chunks from their retrieval scores, before the LLM grader.
+
+    Chunks whose vector score or query term overlap is at least its accept threshold
+    are relevant, chunks at or below both reject thresholds are not, and every other
+    chunk is left to the LLM grader. With a `log_path`, the features and verdicts of
+    the LLM grader are appended to a JSON lines log, from which `calibrate` derives
+    the thresholds.
+    """
+
+    def __init__(
+        self,
+        accept_score: float,
+        reject_score: float,
+        accept_overlap: float,
+        reject_overlap: float,
+        log_path: Optional[str] = None,
+    ):
+        self.accept_score = accept_score
+        self.reject_score = reject_score
+        self.accept_overlap = accept_overlap
+        self.reject_overlap = reject_overlap
+        self.log_path = log_path
+        self.accepted = 0
+        self.rejected = 0
+        self.llm_graded = 0
+        self._log_lock = threading.Lock()
+
+    @property
+    def llm_calls_avoided(self) -> int:
+        return self.accepted + self.rejected
+
+    def stats(self) -> Dict[str, int]:
+        """Counts of pre-graded chunks and of chunks left to the LLM grader."""
+        return {
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "llm_graded": self.llm_graded,
+            "llm_calls_avoided": self.llm_calls_avoided,
+        }
+
+    @staticmethod
+    def features(question: str, document: Document) -> Dict[str, Optional[float]]:
+        return {
+            "vector_score": document.metadata.get("vector_score"),
+            "overlap": query_term_overlap(question, document.page_content),
+        }
+
+    def decide(self, vector_score: Optional[float], overlap: float) -> Optional[str]:
+        """Verdict on a chunk with the given features, None if the LLM is needed."""
+        if (vector_score is not None and vector_score >= self.accept_score) or (
+            overlap >= self.accept_overlap
+        ):
+            return "yes"
+        if (vector_score is None or vector_score <= self.reject_score) and (
+            overlap <= self.reject_overlap
+        ):
+            return "no"
+
+        return None
+
+    def grade(self, question: str, document: Document) -> Optional[str]:
+        """
+        Grade a chunk from its scores alone.
+
+        Args:
+            question (str): The question.
+            document (Document): The chunk, with its vector score in its metadata.
+
+        Returns:
+            Optional[str]: "yes" or "no", or None if the LLM grader is needed.
+        """
+        verdict = self.decide(**self.features(question, document))
+        if verdict == "yes":
+            self.accepted += 1
+        elif verdict == "no":
+            self.rejected += 1
+        else:
+            self.llm_graded += 1
+
+        return verdict
+
+    def record(
+        self, question: str, documents: List[Document], verdicts: List[str]
+    ) -> None:
+        """Log the LLM grader's verdicts on chunks, for `calibrate`."""
+        if not self.log_path:
+            return
+
+        lines = "".join(
+            json.dumps({**self.features(question, document), "verdict": verdict})
+            + "\n"
+            for document, verdict in zip(documents, verdicts)
+        )
+        with self._log_lock:
+            os.makedirs(os.path.dirname(self.log_path) or ".", exist_ok=True)
+            with open(self.log_path, "a") as f:
+                f.write(lines)
+
+    async def arecord(
+        self, question: str, documents: List[Document], verdicts: List[str]
+    ) -> None:
+        """Log the LLM grader's verdicts on chunks from a thread, off the event loop."""
+        if self.log_path and documents:
+            await asyncio.to_thread(self.record, question, documents, verdicts)
+
+
+def _threshold(
+    values: List[float],
+    verdicts: List[str],
+    verdict: str,
+    precision: float,
+    min_samples: int,
+) -> Optional[float]:
+    """
+    Loosest threshold at which the chunks decided as `verdict` agree with `precision`.
+
+    Chunks are decided from the most confident one, at or above the threshold for
+    "yes" and at or below it for "no", so chunks with the same value are decided
+    together.
+    """
+    ranked = sorted(zip(values, verdicts), reverse=verdict == "yes")
+    threshold, agreed = None, 0
+    for count, (value, actual) in enumerate(ranked, start=1):
+        agreed += actual == verdict
+        if count < len(ranked) and ranked[count][0] == value:
+            continue
+        if count >= min_samples:
+            if agreed / count < precision:
+                break
+            threshold = value
+
+    return threshold
+
+
+def calibrate(
+    log_path: str, precision: float = 0.95, min_samples: int = 20
+) -> Dict[str, Optional[float]]:
+    """
+    Derive the pre-grader thresholds from logged LLM grader verdicts.
+
+    Each threshold is the loosest one at which the chunks it decides agree with the
+    LLM grader at least `precision` of the time, counting from the most confident
+    chunk and only once `min_samples` chunks are decided.
+
+    Args:
+        log_path (str): JSON lines log written by `PreGrader.record`.
+        precision (float): Required agreement with the LLM grader.
+        min_samples (int): Minimum number of chunks a threshold must decide.
+
+    Returns:
+        Dict[str, Optional[float]]: The thresholds, None where no threshold reaches
+            the required agreement.
+    """
+    with open(log_path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+
+    scored = [r for r in records if r["vector_score"] is not None]
+    scores = [r["vector_score"] for r in scored]
+    overlaps = [r["overlap"] for r in records]
+
+    score_verdicts = [r["verdict"] for r in scored]
+    overlap_verdicts = [r["verdict"] for r in records]
+
+    return {
+        "accept_score": _threshold(
+            scores, score_verdicts, "yes", precision, min_samples
+        ),
+        "reject_score": _threshold(scores, score_verdicts, "no", precision, min_samples),
+        "accept_overlap": _threshold(
+            overlaps, overlap_verdicts, "yes", precision, min_samples
+        ),
+        "reject_overlap": _threshold(
+            overlaps, overlap_verdicts, "no", precision, min_samples
+        ),
+    }
+
+
+pre_grader = PreGrader(
+    accept_score=settings.PRE_GRADER_ACCEPT_SCORE,
+    reject_score=settings.PRE_GRADER_REJECT_SCORE,
+    accept_overlap=settings.PRE_GRADER_ACCEPT_OVERLAP,
+    reject_overlap=settings.PRE_GRADER_REJECT_OVERLAP,
+    log_path=settings.GRADER_VERDICT_LOG,
+)
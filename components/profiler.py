@@ -0,0 +1,155 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from loguru import logger
+
+from config import settings
+
+# Leaf frames of threads that wait instead of running, e.g. the event loop's selector
+# and idle executor threads, dropped so that the profile approximates CPU time
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Only one profile is captured at a time, so concurrent requests are not profiled twice
+_profiling = threading.Lock()
+
+
+def should_profile(session_sampled: bool = False) -> bool:
+    """
+    Whether to profile a request.
+
+    Requests are sampled at `settings.PROFILE_SAMPLE_RATE`, and every request of the
+    sessions sampled at `settings.PROFILE_SESSION_SAMPLE_RATE`.
+
+    Args:
+        session_sampled (bool): Whether the session was sampled, see
+            `should_profile_session`.
+
+    Returns:
+        bool: Whether to profile the request.
+    """
+    return session_sampled or random.random() < settings.PROFILE_SAMPLE_RATE
+
+
+def should_profile_session() -> bool:
+    """Whether to profile every request of a session."""
+    return random.random() < settings.PROFILE_SESSION_SAMPLE_RATE
+
+
+def _frame_name(frame) -> Tuple[str, str, str]:
+    code = frame.f_code
+    return os.path.basename(code.co_filename), code.co_name, str(frame.f_lineno)
+
+
+class StackSampler:
+    """Samples the Python stacks of all threads of the process at a fixed interval.
+
+    Stacks are counted in the collapsed format of flame graph tools, one line per
+    distinct stack: "thread;outer (file:line);...;inner (file:line) count".
+    """
+
+    def __init__(self, interval: float, max_seconds: float):
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            threads = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if _frame_name(frame)[:2] in IDLE_FRAMES:
+                    continue
+                stack = []
+                while frame is not None:
+                    file_name, function, line = _frame_name(frame)
+                    stack.append(f"{function} ({file_name}:{line})")
+                    frame = frame.f_back
+                stack.append(threads.get(thread_id, str(thread_id)))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self, n: int) -> List[Tuple[str, int]]:
+        """Functions with the most samples at the top of a stack."""
+        leaves: Counter = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+
+        return leaves.most_common(n)
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def profile_request(request_id: str, enabled: bool) -> Iterator[Optional[str]]:
+    """
+    Capture a CPU profile of a request.
+
+    The stacks of every thread are sampled every `settings.PROFILE_INTERVAL_SECONDS`,
+    for at most `settings.PROFILE_MAX_SECONDS`, and saved as
+    `<settings.PROFILE_DIR>/<request_id>.folded`. The profile covers the event loop and
+    the executor threads, e.g. Qdrant searches, but not the PDF parser processes.
+    Requests of other sessions running at the same time are sampled too. Only one
+    request is profiled at a time; a request that would overlap is not profiled.
+
+    Args:
+        request_id (str): Name of the profile.
+        enabled (bool): Whether to profile the request, see `should_profile`.
+
+    Yields:
+        Optional[str]: Path of the profile, or None if the request is not profiled.
+    """
+    if not enabled or not _profiling.acquire(blocking=False):
+        yield None
+        return
+
+    path = os.path.join(settings.PROFILE_DIR, f"{request_id}.folded")
+    sampler = StackSampler(
+        interval=settings.PROFILE_INTERVAL_SECONDS,
+        max_seconds=settings.PROFILE_MAX_SECONDS,
+    )
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        yield path
+    finally:
+        sampler.stop()
+        _profiling.release()
+        sampler.save(path)
+        busy = sum(sampler.stacks.values())
+        top = ", ".join(
+            f"{name} {count / max(busy, 1):.0%}"
+            for name, count in sampler.top_functions(5)
+        )
+        logger.info(
+            f"Profiled request {request_id} for {time.perf_counter() - start:.2f}s "
+            f"({sampler.samples} samples) into {path}, top: {top}"
+        )
@@ -0,0 +1,384 @@
+import asyncio
+import threading
+from itertools import chain, islice
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_qdrant import Qdrant
+from loguru import logger
+
+from components.document_loader import count_pages, iter_documents
+from components.index_builder import (
+    build_index,
+    get_embeddings,
+    load_index,
+    update_index,
+)
+from components.index_cache import index_cache
+from components.lexical_index import (
+    LexicalIndex,
+    chunk_key,
+    reciprocal_rank_fusion,
+)
+from components.quantized_vectors import QuantizedVectors
+from config import settings
+
+_build_slots: Optional[asyncio.Semaphore] = None
+
+
+def _get_build_slots() -> asyncio.Semaphore:
+    """Slots of the documents indexed at once, shared by all sessions."""
+    global _build_slots
+    if _build_slots is None:
+        _build_slots = asyncio.Semaphore(max(settings.INGEST_MAX_DOCUMENTS, 1))
+
+    return _build_slots
+
+
+def format_page_ranges(pages: List[int]) -> str:
+    """
+    Format 0-based page numbers as 1-based ranges, e.g. "1-8, 10".
+
+    Args:
+        pages (List[int]): Page numbers.
+
+    Returns:
+        str: The page ranges.
+    """
+    ranges = []
+    for page in sorted(set(pages)):
+        if ranges and ranges[-1][1] == page - 1:
+            ranges[-1][1] = page
+        else:
+            ranges.append([page, page])
+
+    return ", ".join(
+        f"{start + 1}" if start == stop else f"{start + 1}-{stop + 1}"
+        for start, stop in ranges
+    )
+
+
+class ProgressiveIndex:
+    """Index of one document that can be searched while the document is indexed.
+
+    The document is parsed and embedded in a background thread. Each indexed batch
+    becomes searchable right away, and the finished index is published to the index
+    cache, after which searches are served from the published copy. At most
+    `settings.INGEST_MAX_DOCUMENTS` documents are indexed at once, the others wait
+    their turn.
+
+    A revision of a document is indexed from the index of its previous revision, see
+    `update_index`, if `settings.INCREMENTAL_MIN_SHARED_CHUNKS` of the chunks of its
+    first batch are in that index, and searches are then served by that `previous`
+    index until the new one is published, or for good if indexing fails.
+
+    Searches fuse the vector search with a BM25 search of the lexical index built next
+    to the collection, see `reciprocal_rank_fusion`, unless
+    `settings.HYBRID_RETRIEVAL` is off. Unless `settings.VECTOR_STORAGE` is "full",
+    the vector search of the published index runs on quantized vectors instead of the
+    Qdrant collection, which is not opened, see `QuantizedVectors`. Its scores are
+    cosine similarities, as are the scores of the Qdrant collection, which
+    the pre-grader is calibrated on.
+    """
+
+    def __init__(
+        self, key: str, num_pages: int, embeddings: Optional[Embeddings] = None
+    ):
+        self.key = key
+        self.num_pages = num_pages
+        self.embeddings = embeddings
+        self.previous: Optional["ProgressiveIndex"] = None
+        self.vector_db: Optional[Qdrant] = None
+        self.quantized: Optional[QuantizedVectors] = None
+        self.lexical_index = LexicalIndex()
+        self.indexed_pages = set()
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._lock = threading.Lock()
+        self._first_batch = threading.Event()
+        self._task: Optional[asyncio.Future] = None
+
+    @classmethod
+    def from_directory(
+        cls,
+        key: str,
+        num_pages: Optional[int] = None,
+        embeddings: Optional[Embeddings] = None,
+    ) -> "ProgressiveIndex":
+        """
+        Open an index that is already published to the index cache.
+
+        Args:
+            key (str): Index cache key of the file.
+            num_pages (Optional[int]): Number of pages of the file, by default the
+                pages of the indexed chunks, e.g. when the file is gone.
+            embeddings (Optional[Embeddings]): Embedding model, defaults to
+                `get_embeddings()`.
+
+        Returns:
+            ProgressiveIndex: The index.
+        """
+        lexical_index = LexicalIndex.load(index_cache.path(key))
+        if num_pages is None:
+            documents = lexical_index.documents if lexical_index is not None else []
+            num_pages = max((doc.metadata["page"] for doc in documents), default=-1) + 1
+        index = cls(key=key, num_pages=num_pages, embeddings=embeddings)
+        index.lexical_index = lexical_index
+        index._open_published()
+        index.indexed_pages = set(range(num_pages))
+        index.done = True
+        index._first_batch.set()
+
+        return index
+
+    @classmethod
+    async def start(
+        cls,
+        file_path: str,
+        key: str,
+        previous: Optional["ProgressiveIndex"] = None,
+        wait: bool = True,
+        embeddings: Optional[Embeddings] = None,
+    ) -> "ProgressiveIndex":
+        """
+        Start indexing a document in the background.
+
+        Args:
+            file_path (str): Path to the PDF file.
+            key (str): Index cache key of the file.
+            previous (Optional[ProgressiveIndex]): Published index of a presumed
+                previous revision of the document, to index the changes only if the
+                document shares enough chunks with it.
+            wait (bool): Whether to wait until the first batch is searchable, e.g.
+                not for the documents of a corpus, which may wait for their turn.
+            embeddings (Optional[Embeddings]): Embedding model, defaults to
+                `get_embeddings()`.
+
+        Returns:
+            ProgressiveIndex: The index, once its first batch or its previous index is
+                searchable, or right away if `wait` is off.
+        """
+        index = cls(key=key, num_pages=count_pages(file_path), embeddings=embeddings)
+        index._task = asyncio.ensure_future(index._run(file_path, key, previous))
+        if not wait:
+            return index
+        await asyncio.to_thread(index._first_batch.wait)
+        searchable = index.vector_db is not None or index.previous is not None
+        if not searchable and index.error is not None:
+            raise index.error
+
+        return index
+
+    async def wait_done(self) -> None:
+        """Wait until the whole document is indexed, or indexing failed."""
+        if self._task is not None:
+            await asyncio.shield(self._task)
+
+    @property
+    def building(self) -> bool:
+        """Whether the document is still being indexed in the background."""
+        return self._task is not None and not self._task.done()
+
+    def close(self) -> None:
+        """Close the vectorstore client, after which the index finds nothing."""
+        with self._lock:
+            if self.vector_db is not None:
+                self.vector_db.client.close()
+                self.vector_db = None
+            self.quantized = None
+
+    def _open_published(self) -> None:
+        """Open the vector search of the published index."""
+        directory = index_cache.path(self.key)
+        if settings.VECTOR_STORAGE != "full" and self.lexical_index is not None:
+            self.quantized = QuantizedVectors.load(directory, settings.VECTOR_STORAGE)
+            if self.quantized is not None:
+                self.embeddings = self.embeddings or get_embeddings()
+                logger.info(
+                    f"Searching {len(self.quantized)} {settings.VECTOR_STORAGE} "
+                    f"quantized vectors ({self.quantized.nbytes} bytes) of {self.key}"
+                )
+                return
+
+        self.vector_db = load_index(directory, embeddings=self.embeddings)
+
+    def covered_pages(self) -> str:
+        """Page ranges that are searchable so far."""
+        return format_page_ranges(list(self.indexed_pages))
+
+    def rankings(
+        self,
+        query: str,
+        candidates: int,
+        search_kwargs: Optional[Dict[str, Any]] = None,
+        query_vector: Optional[List[float]] = None,
+    ) -> Dict[str, List[Tuple[Document, float]]]:
+        """
+        Rank the chunks of the pages indexed so far, before they are fused.
+
+        Args:
+            query (str): The query.
+            candidates (int): Maximum number of chunks per ranking.
+            search_kwargs (Optional[Dict[str, Any]]): Keyword arguments of the Qdrant
+                search, ignored by quantized searches.
+            query_vector (Optional[List[float]]): Embedding of the query, embedded by
+                the index if not given.
+
+        Returns:
+            Dict[str, List[Tuple[Document, float]]]: Chunks and scores, best first:
+                "vector" with cosine similarities, and "lexical" with BM25
+                scores for hybrid searches. Empty if nothing is searchable yet.
+        """
+        previous = self.previous
+        if previous is not None and not self.done:
+            return previous.rankings(query, candidates, search_kwargs, query_vector)
+
+        hybrid = settings.HYBRID_RETRIEVAL and self.lexical_index is not None
+        quantized = self.quantized
+        searchable = quantized is not None or self.vector_db is not None
+        if searchable and query_vector is None:
+            # Embedded before taking the lock, which batches being indexed wait for
+            self.embeddings = self.embeddings or get_embeddings()
+            query_vector = self.embeddings.embed_query(query)
+        with self._lock:
+            if quantized is not None:
+                rows = quantized.search(
+                    query_vector,
+                    candidates,
+                    rescore=settings.VECTOR_RESCORE,
+                    oversampling=settings.VECTOR_OVERSAMPLING,
+                )
+                vector_ranking = [
+                    (self.lexical_index.documents[row], score) for row, score in rows
+                ]
+            elif self.vector_db is not None and query_vector is not None:
+                vector_ranking = self.vector_db.similarity_search_with_score_by_vector(
+                    query_vector, k=candidates, **(search_kwargs or {})
+                )
+            else:
+                return {}
+            rankings = {"vector": vector_ranking}
+            if hybrid:
+                rankings["lexical"] = self.lexical_index.search(query, candidates)
+
+        return rankings
+
+    def search(
+        self, query: str, k: int, search_kwargs: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        """
+        Search the pages indexed so far.
+
+        Args:
+            query (str): The query.
+            k (int): Maximum number of documents returned.
+            search_kwargs (Optional[Dict[str, Any]]): Keyword arguments of
+                `similarity_search_with_score_by_vector`, ignored by quantized
+                searches.
+
+        Returns:
+            List[Document]: The matching documents, best first, with their scores in
+                their metadata.
+        """
+        candidates = k
+        if settings.HYBRID_RETRIEVAL:
+            candidates = max(k, settings.RETRIEVAL_CANDIDATES)
+        rankings = self.rankings(query, candidates, search_kwargs)
+
+        return reciprocal_rank_fusion(rankings, k=k, rrf_k=settings.RRF_K)
+
+    def _on_batch(self, vector_db: Qdrant, documents: List[Document]) -> None:
+        self.vector_db = vector_db
+        self.indexed_pages.update(doc.metadata["page"] for doc in documents)
+        self._first_batch.set()
+
+    async def _run(
+        self, file_path: str, key: str, previous: Optional["ProgressiveIndex"]
+    ) -> None:
+        async with _get_build_slots():
+            await asyncio.to_thread(self._build, file_path, key, previous)
+
+    def _shares_chunks(
+        self, documents: List[Document], previous: "ProgressiveIndex"
+    ) -> bool:
+        """Whether enough of the first chunks of a document are in the index of a
+        revision."""
+        if previous.lexical_index is None or not documents:
+            return False
+        previous_keys = {chunk_key(doc) for doc in previous.lexical_index.documents}
+        keys = {chunk_key(doc) for doc in documents}
+        shared = len(keys & previous_keys) / len(keys)
+        logger.info(f"{shared:.0%} of the chunks of {self.key} are in {previous.key}")
+
+        return shared >= settings.INCREMENTAL_MIN_SHARED_CHUNKS
+
+    def _build(
+        self, file_path: str, key: str, previous: Optional["ProgressiveIndex"]
+    ) -> None:
+        swapping = False
+        try:
+            with index_cache.publish(key) as build_directory:
+                documents = iter_documents(file_path)
+                if previous is not None:
+                    # The first batch is the evidence, so parsing keeps streaming
+                    first_batch = list(islice(documents, settings.INDEX_BATCH_SIZE))
+                    if self._shares_chunks(first_batch, previous):
+                        self.previous = previous
+                        self._first_batch.set()
+                    documents = chain(first_batch, documents)
+                if self.previous is not None:
+                    vector_db = update_index(
+                        documents=documents,
+                        base_directory=index_cache.path(self.previous.key),
+                        persist_directory=build_directory,
+                        lexical_index=self.lexical_index,
+                        embeddings=self.embeddings,
+                    )
+                    self.indexed_pages.update(
+                        doc.metadata["page"] for doc in self.lexical_index.documents
+                    )
+                else:
+                    vector_db = build_index(
+                        documents=documents,
+                        persist_directory=build_directory,
+                        lock=self._lock,
+                        on_batch=self._on_batch,
+                        lexical_index=self.lexical_index,
+                        embeddings=self.embeddings,
+                    )
+                # Searches wait while the index moves to its published location
+                self._lock.acquire()
+                swapping = True
+                vector_db.client.close()
+                self.vector_db = None
+
+            self._open_published()
+            self.done = True
+            self.previous = None
+            logger.info(f"Indexed all {self.num_pages} pages of {file_path}")
+        except BaseException as e:
+            logger.exception(f"Indexing {file_path} failed")
+            self.error = e
+            if swapping:
+                self.vector_db = None
+            raise
+        finally:
+            if swapping:
+                self._lock.release()
+            self._first_batch.set()
+
+
+class ProgressiveRetriever(BaseRetriever):
+    """Retriever over a `ProgressiveIndex`."""
+
+    index: Any
+    k: int = 5
+    search_kwargs: Dict[str, Any] = {}
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return self.index.search(query, self.k, self.search_kwargs)
@@ -0,0 +1,172 @@
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+from langchain_qdrant import Qdrant
+from loguru import logger
+
+from components.lexical_index import LexicalIndex, chunk_key
+
+VECTORS_FILE = "vectors.npy"
+
+# Rows scored at once, bounding the memory of the dequantized vectors of a search
+_SEARCH_BLOCK_ROWS = 8192
+# Share of the vector components within the int8 range, the rest is clipped
+_INT8_QUANTILE = 0.99
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _blocks(num_rows: int) -> List[slice]:
+    return [
+        slice(i, i + _SEARCH_BLOCK_ROWS) for i in range(0, num_rows, _SEARCH_BLOCK_ROWS)
+    ]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def save_vectors(
+    vector_db: Qdrant, lexical_index: LexicalIndex, persist_directory: str
+) -> None:
+    """
+    Save the vectors of a collection, normalized, in the order of the chunks of its
+    lexical index, so that `QuantizedVectors` can search them without Qdrant.
+
+    Args:
+        vector_db (Qdrant): The vectorstore.
+        lexical_index (LexicalIndex): The lexical index of the same chunks.
+        persist_directory (str): Directory of the index.
+    """
+    vectors = {}
+    offset = None
+    while True:
+        points, offset = vector_db.client.scroll(
+            collection_name=vector_db.collection_name,
+            limit=1024,
+            offset=offset,
+            with_payload=True,
+            with_vectors=True,
+        )
+        for point in points:
+            payload = point.payload or {}
+            key = (payload.get("metadata") or {}).get("chunk_id") or payload.get(
+                "page_content"
+            )
+            vectors[key] = point.vector
+        if offset is None:
+            break
+
+    matrix = np.array(
+        [vectors[chunk_key(doc)] for doc in lexical_index.documents], dtype=np.float32
+    )
+    np.save(os.path.join(persist_directory, VECTORS_FILE), _normalize(matrix))
+
+
+class QuantizedVectors:
+    """Quantized copy of the vectors of an index, searched in memory.
+
+    The normalized vectors saved by `save_vectors` are memory-mapped from disk, and only
+    their quantized codes are loaded in memory: one byte per dimension with "int8"
+    scalar quantization, one bit with "binary" quantization. A search scores all codes,
+    and rescores the `oversampling` times more best candidates with the original
+    vectors, so only their rows are read from disk. Rows are in the order of the chunks
+    of the lexical index.
+    """
+
+    def __init__(self, vectors: np.ndarray, mode: str):
+        self.mode = mode
+        self.vectors = vectors
+        self.dimensions = vectors.shape[1]
+        self.scale = 1.0
+        blocks = _blocks(len(vectors))
+        if mode == "int8":
+            sample = np.abs(vectors[:_SEARCH_BLOCK_ROWS])
+            self.scale = float(np.quantile(sample, _INT8_QUANTILE) / 127) or 1.0
+            self.codes = np.concatenate(
+                [self._quantize_int8(vectors[block]) for block in blocks]
+            )
+        elif mode == "binary":
+            self.codes = np.concatenate(
+                [np.packbits(vectors[block] > 0, axis=1) for block in blocks]
+            )
+        else:
+            raise ValueError(f"Unknown quantization: {mode}")
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the codes."""
+        return self.codes.nbytes
+
+    def _quantize_int8(self, vectors: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(vectors / self.scale), -127, 127).astype(np.int8)
+
+    @classmethod
+    def load(cls, directory: str, mode: str) -> Optional["QuantizedVectors"]:
+        """Quantize the vectors saved in a directory, None if there are none."""
+        path = os.path.join(directory, VECTORS_FILE)
+        if not os.path.exists(path):
+            logger.warning(f"No saved vectors in {directory}")
+            return None
+
+        return cls(np.load(path, mmap_mode="r"), mode)
+
+    def _approximate_scores(self, query: np.ndarray) -> np.ndarray:
+        blocks = _blocks(len(self.codes))
+        if self.mode == "int8":
+            return np.concatenate(
+                [self.codes[block].astype(np.float32) @ query for block in blocks]
+            ) * self.scale
+
+        # The share of differing signs estimates the angle between the vectors
+        query_bits = np.packbits(query > 0)
+        distances = np.concatenate(
+            [
+                _POPCOUNT[self.codes[block] ^ query_bits].sum(axis=1, dtype=np.int32)
+                for block in blocks
+            ]
+        )
+        return np.cos(np.pi * distances / self.dimensions)
+
+    def search(
+        self,
+        query: List[float],
+        k: int,
+        rescore: bool = True,
+        oversampling: float = 3.0,
+    ) -> List[Tuple[int, float]]:
+        """
+        Find the vectors most similar to a query.
+
+        Args:
+            query (List[float]): Query vector.
+            k (int): Maximum number of vectors returned.
+            rescore (bool): Whether to rescore the candidates with the original
+                vectors. Otherwise the scores are approximations of the cosine
+                similarity.
+            oversampling (float): Candidates rescored per vector returned.
+
+        Returns:
+            List[Tuple[int, float]]: Rows and cosine similarities, best first.
+        """
+        if len(self.codes) == 0:
+            return []
+
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        scores = self._approximate_scores(query)
+        num_candidates = max(k, int(k * oversampling)) if rescore else k
+        num_candidates = min(num_candidates, len(scores))
+        rows = np.argpartition(-scores, num_candidates - 1)[:num_candidates]
+        if rescore:
+            # Sorted rows read the memory-mapped vectors in file order
+            rows = np.sort(rows)
+            scores = self.vectors[rows] @ query
+        else:
+            scores = scores[rows]
+        best = np.argsort(-scores, kind="stable")[:k]
+
+        return [(int(rows[i]), float(scores[i])) for i in best]
@@ -1,53 +1,57 @@
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_openai import ChatOpenAI
+import asyncio
+from typing import List, Optional
+
+from langchain_core.exceptions import OutputParserException
+from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END, StateGraph
 from loguru import logger
 
 from components.chains import (
     create_answer_grader,
+    create_batch_retrieval_grader,
     create_hallucination_grader,
+    create_multi_query_rewriter,
     create_question_rewriter,
     create_rag_chain,
     create_retrieval_grader,
 )
+from components.context_packer import pack_context
+from components.lexical_index import reciprocal_rank_fusion
+from components.llm_registry import ProviderRouter
+from components.pre_grader import pre_grader
 from components.schemas import GraphState
+from components.verdict_cache import ServedModel, with_handler
 from config import settings
 
 
 class RAGWorkflow:
     """RAG Workflow using LangGraph."""
 
-    def __init__(self, retriever, max_iterations=1):
+    def __init__(self, max_iterations=1, llm=None, llm1=None):
         self.max_iterations = max_iterations
-        self.retriever = retriever
-        self.llm = ChatOpenAI(
-            model="yi-large",
-            temperature=0,
-            api_key=settings.YI_API_KEY,
-            base_url=settings.YI_BASE_URL,
-        )
-        # self.llm = ChatGoogleGenerativeAI(
-        #     model="gemini-1.5-flash-latest",
-        #     temperature=0.15,
-        #     google_api_key=settings.GOOGLE_API_KEY,
-        # )
-        self.llm1 = ChatGoogleGenerativeAI(
-            model="gemini-1.5-flash-latest",
-            temperature=0.15,
-            google_api_key=settings.GOOGLE_API_KEY_B,
-        )
+        # Both roles can fail over to the other provider
+        self.llm = llm or ProviderRouter(["yi", "google"])
+        self.llm1 = llm1 or ProviderRouter(["google", "yi"])
         self.rag_chain = create_rag_chain(self.llm)
         self.retrieval_grader = create_retrieval_grader(self.llm1)
+        self.batch_retrieval_grader = create_batch_retrieval_grader(self.llm1)
         self.hallucination_grader = create_hallucination_grader(self.llm)
         self.answer_grader = create_answer_grader(self.llm)
         self.question_rewriter = create_question_rewriter(self.llm)
+        self.multi_query_rewriter = create_multi_query_rewriter(
+            self.llm, num_queries=settings.MULTI_QUERY_COUNT
+        )
 
-    def retrieve(self, state: GraphState) -> GraphState:
+    async def retrieve(self, state: GraphState, config: RunnableConfig) -> GraphState:
         """
         Retrieve documents.
 
+        The workflow is shared by all chat sessions, so the retriever of the session is
+        passed in `config["configurable"]["retriever"]`.
+
         Args:
             state (GraphState): The current graph state.
+            config (RunnableConfig): The run config.
 
         Returns:
             state (GraphState): New key added to state, documents.
@@ -55,15 +59,19 @@ class RAGWorkflow:
 
         logger.info("RETRIEVE")
         question = state["question"]
-        documents = self.retriever.invoke(question)
+        retriever = config["configurable"]["retriever"]
+        documents = await retriever.ainvoke(question)
         logger.info(f"Retrieved {len(documents)} documents for question: {question}")
 
         return {"documents": documents}
 
-    def generate(self, state: GraphState) -> GraphState:
+    async def generate(self, state: GraphState) -> GraphState:
         """
         Generate answer.
 
+        The documents are packed into a context within
+        `settings.GENERATE_CONTEXT_MAX_TOKENS`, see `pack_context`.
+
         Args:
             state (GraphState): The current graph state.
 
@@ -74,16 +82,32 @@ class RAGWorkflow:
         logger.info("GENERATE")
         question = state["question"]
         documents = state["documents"]
-        generation = self.rag_chain.invoke({"context": documents, "question": question})
+        context = pack_context(
+            documents, settings.GENERATE_CONTEXT_MAX_TOKENS, chain="rag_chain"
+        )
+        generation = await self.rag_chain.ainvoke(
+            {"context": context, "question": question}
+        )
 
         return {"generation": generation, "documents": documents}
 
-    def grade_documents(self, state: GraphState) -> GraphState:
+    async def grade_documents(
+        self, state: GraphState, config: RunnableConfig
+    ) -> GraphState:
         """
         Determines whether the retrieved documents are relevant to the question.
 
+        Documents that the pre-grader can grade from their retrieval scores skip the
+        LLM grader, see `PreGrader`. With `settings.GRADER_MODE` "per_document", the
+        other documents are graded one per call; with "batch", in one listwise call
+        per `settings.GRADER_BATCH_SIZE` documents, falling back to one call per
+        document for the documents whose verdicts cannot be parsed. Calls run
+        concurrently, bounded by `settings.GRADER_MAX_CONCURRENCY` and the rate limits
+        of the providers. A document whose grading fails or times out is kept.
+
         Args:
             state (GraphState): The current graph state.
+            config (RunnableConfig): The run config.
 
         Returns:
             state (GraphState): Updates documents key with only filtered relevant documents.
@@ -93,12 +117,102 @@ class RAGWorkflow:
         question = state["question"]
         documents = state["documents"]
 
-        filtered_docs = []
-        for d in documents:
-            score = self.retrieval_grader.invoke(
-                {"question": question, "document": d.page_content}
+        semaphore = asyncio.Semaphore(settings.GRADER_MAX_CONCURRENCY)
+        llm_calls = 0
+
+        async def grade(document) -> str:
+            nonlocal llm_calls
+            async with semaphore:
+                llm_calls += 1
+                served = ServedModel()
+                try:
+                    score = await asyncio.wait_for(
+                        self.retrieval_grader.ainvoke(
+                            {"question": question, "document": document.page_content},
+                            with_handler(config, served),
+                        ),
+                        timeout=settings.GRADER_TIMEOUT_SECONDS,
+                    )
+                except Exception as e:
+                    logger.warning(f"GRADE: FAILED ({e!r}), KEEPING DOCUMENT")
+                    return "yes"
+
+            if served.answered:
+                await pre_grader.arecord(question, [document], [score.binary_score])
+            return score.binary_score
+
+        async def grade_batch(batch: List) -> List[str]:
+            nonlocal llm_calls
+            async with semaphore:
+                llm_calls += 1
+                served = ServedModel()
+                try:
+                    result = await asyncio.wait_for(
+                        self.batch_retrieval_grader.ainvoke(
+                            {
+                                "question": question,
+                                "documents": [d.page_content for d in batch],
+                            },
+                            with_handler(config, served),
+                        ),
+                        timeout=settings.GRADER_TIMEOUT_SECONDS,
+                    )
+                    grades = result.grades
+                except OutputParserException as e:
+                    logger.warning(f"BATCH GRADE: UNPARSABLE ({e!r})")
+                    grades = []
+                except Exception as e:
+                    logger.warning(f"BATCH GRADE: FAILED ({e!r}), KEEPING DOCUMENTS")
+                    return ["yes"] * len(batch)
+
+            # Grades are numbered from 1, grades out of range or unparsable are ignored
+            verdicts = {
+                g.index - 1: g.binary_score
+                for g in grades
+                if 1 <= g.index <= len(batch) and g.binary_score in ("yes", "no")
+            }
+            if served.answered:
+                await pre_grader.arecord(
+                    question, [batch[i] for i in verdicts], list(verdicts.values())
+                )
+
+            missing = [i for i in range(len(batch)) if i not in verdicts]
+            if missing:
+                logger.warning(
+                    f"BATCH GRADE: {len(missing)} OF {len(batch)} DOCUMENTS UNGRADED, "
+                    "GRADING THEM ONE BY ONE"
+                )
+                fallback = await asyncio.gather(*(grade(batch[i]) for i in missing))
+                verdicts.update(zip(missing, fallback))
+
+            return [verdicts[i] for i in range(len(batch))]
+
+        grades: List[Optional[str]] = [None] * len(documents)
+        if settings.PRE_GRADER_ENABLED:
+            for i, document in enumerate(documents):
+                grades[i] = pre_grader.grade(question, document)
+                if grades[i] is not None:
+                    logger.info(f"GRADE: PRE-GRADED {grades[i].upper()}")
+            logger.info(f"Pre-grader: {pre_grader.stats()}")
+
+        undecided = [i for i, grade in enumerate(grades) if grade is None]
+        if settings.GRADER_MODE == "batch":
+            size = settings.GRADER_BATCH_SIZE
+            batches = [undecided[i : i + size] for i in range(0, len(undecided), size)]
+            results = await asyncio.gather(
+                *(grade_batch([documents[i] for i in batch]) for batch in batches)
+            )
+            llm_grades = [grade for result in results for grade in result]
+            logger.info(
+                f"Batch grading: {len(undecided)} documents in {llm_calls} grader calls"
             )
-            grade = score.binary_score
+        else:
+            llm_grades = await asyncio.gather(*(grade(documents[i]) for i in undecided))
+        for i, grade in zip(undecided, llm_grades):
+            grades[i] = grade
+
+        filtered_docs = []
+        for d, grade in zip(documents, grades):
             if grade == "yes":
                 logger.info("GRADE: DOCUMENT RELEVANT")
                 filtered_docs.append(d)
@@ -107,7 +221,7 @@ class RAGWorkflow:
 
         return {"documents": filtered_docs}
 
-    def transform_query(self, state: GraphState) -> GraphState:
+    async def transform_query(self, state: GraphState) -> GraphState:
         """
         Transform the query to produce a better question.
 
@@ -124,7 +238,7 @@ class RAGWorkflow:
 
         iterations += 1
 
-        better_question = self.question_rewriter.invoke({"question": question})
+        better_question = await self.question_rewriter.ainvoke({"question": question})
         logger.info(f"RE-WRITTEN QUESTION: {better_question}")
 
         return {
@@ -132,7 +246,51 @@ class RAGWorkflow:
             "iterations": iterations,
         }
 
-    def decide_to_generate(self, state: GraphState) -> str:
+    async def multi_query_retrieve(
+        self, state: GraphState, config: RunnableConfig
+    ) -> GraphState:
+        """
+        Rewrite the question several ways in one call and retrieve for all rewrites.
+
+        Used instead of `transform_query` followed by `retrieve` when
+        `settings.RETRIEVAL_MODE` is "multi_query". The rewrites are retrieved for
+        concurrently, and their results are fused by reciprocal rank and deduplicated
+        by chunk id, so a single grading round sees the documents of every rewrite.
+        The question itself is kept for grading and generation.
+
+        Args:
+            state (GraphState): The current graph state.
+            config (RunnableConfig): The run config.
+
+        Returns:
+            state (GraphState): Updates documents and iterations keys.
+        """
+
+        logger.info("MULTI-QUERY RETRIEVE")
+        question = state["question"]
+        retriever = config["configurable"]["retriever"]
+
+        queries = await self.multi_query_rewriter.ainvoke({"question": question})
+        logger.info(f"RE-WRITTEN QUESTIONS: {queries}")
+        results = await asyncio.gather(
+            *(retriever.ainvoke(query) for query in queries or [question])
+        )
+        documents = reciprocal_rank_fusion(
+            {
+                f"query_{i}": [(doc, None) for doc in docs]
+                for i, docs in enumerate(results)
+            },
+            k=settings.MULTI_QUERY_TOP_K,
+            rrf_k=settings.RRF_K,
+        )
+        logger.info(
+            f"Retrieved {sum(map(len, results))} documents for {len(results)} "
+            f"questions, {len(documents)} after fusion"
+        )
+
+        return {"documents": documents, "iterations": state["iterations"] + 1}
+
+    async def decide_to_generate(self, state: GraphState) -> str:
         """
         Determines whether to generate an answer, or re-generate a question.
 
@@ -159,44 +317,66 @@ class RAGWorkflow:
         logger.info("DECISION: GENERATE")
         return "generate"
 
-    def grade_generation_v_documents_and_question(self, state: GraphState) -> str:
+    async def grade_generation_v_documents_and_question(self, state: GraphState) -> str:
         """
         Determines whether the generation is grounded in the document and answers question.
 
+        The documents are packed into a context within
+        `settings.HALLUCINATION_CONTEXT_MAX_TOKENS`. Both graders run concurrently.
+        As soon as one of them grades "no", the other is cancelled.
+
         Args:
             state (dict): The current graph state
 
         Returns:
             str: Decision for next node to call
         """
-        logger.info("CHECK HALLUCINATIONS")
+        logger.info("CHECK HALLUCINATIONS AND GRADE GENERATION vs QUESTION")
         documents = state["documents"]
         generation = state["generation"]
         question = state["question"]
         iterations = state["iterations"]
-
-        score = self.hallucination_grader.invoke(
-            {"documents": documents, "generation": generation}
+        context = pack_context(
+            documents,
+            settings.HALLUCINATION_CONTEXT_MAX_TOKENS,
+            chain="hallucination_grader",
         )
-        grade = score.binary_score
 
-        if grade == "yes":
-            logger.info("DECISION: GENERATION IS GROUNDED IN DOCUMENTS")
-            # Check question-answering
-            logger.info("GRADE GENERATION vs QUESTION")
-            score = self.answer_grader.invoke(
-                {"question": question, "generation": generation}
-            )
-
-            grade = score.binary_score
-
-            if grade == "yes":
-                logger.info("DECISION: GENERATION ADDRESSES QUESTION")
-                return "useful"
-            else:
-                logger.info("DECISION: GENERATION DOES NOT ADDRESS QUESTION, RE-TRY")
-        else:
+        tasks = {
+            asyncio.create_task(
+                self.hallucination_grader.ainvoke(
+                    {"documents": context, "generation": generation}
+                )
+            ): "hallucination",
+            asyncio.create_task(
+                self.answer_grader.ainvoke(
+                    {"question": question, "generation": generation}
+                )
+            ): "answer",
+        }
+        grades = {}
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    grades[tasks[task]] = task.result().binary_score
+                if any(grade != "yes" for grade in grades.values()):
+                    break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if grades.get("hallucination", "yes") != "yes":
             logger.info("DECISION: GENERATION IS NOT GROUNDED IN DOCUMENTS, RE-TRY")
+        elif grades.get("answer", "yes") != "yes":
+            logger.info("DECISION: GENERATION DOES NOT ADDRESS QUESTION, RE-TRY")
+        else:
+            logger.info("DECISION: GENERATION IS GROUNDED IN DOCUMENTS")
+            logger.info("DECISION: GENERATION ADDRESSES QUESTION")
+            return "useful"
 
         if iterations == self.max_iterations:
             logger.info("DECISION: TRANSFORM QUERY LIMIT REACHED, ENDING")
@@ -204,16 +384,16 @@ class RAGWorkflow:
 
         return "not_useful"
 
-    def end_with_message(self, state: GraphState) -> GraphState:
+    async def end_with_message(self, state: GraphState) -> GraphState:
         """
         End the workflow with a message.
 
         Returns:
-            GraphState: The final graph state with a message.
+            GraphState: The final graph state with a message and no source documents.
         """
         logger.info("END WITH MESSAGE")
         return {
-            "documents": state["documents"],
+            "documents": [],
             "generation": "Sorry, I couldn't find an answer for your question.",
         }
 
@@ -221,6 +401,10 @@ class RAGWorkflow:
         """
         Create the RAG workflow.
 
+        When `settings.RETRIEVAL_MODE` is "multi_query", documents that are not
+        relevant lead to `multi_query_retrieve` instead of the `transform_query` and
+        `retrieve` loop.
+
         Returns:
             StateGraph: The RAG workflow.
         """
@@ -229,7 +413,14 @@ class RAGWorkflow:
         workflow.add_node("retrieve", self.retrieve)
         workflow.add_node("grade_documents", self.grade_documents)
         workflow.add_node("generate", self.generate)
-        workflow.add_node("transform_query", self.transform_query)
+        if settings.RETRIEVAL_MODE == "multi_query":
+            retry = "multi_query_retrieve"
+            workflow.add_node(retry, self.multi_query_retrieve)
+            workflow.add_edge(retry, "grade_documents")
+        else:
+            retry = "transform_query"
+            workflow.add_node(retry, self.transform_query)
+            workflow.add_edge(retry, "retrieve")
         workflow.add_node("end_with_message", self.end_with_message)
 
         workflow.set_entry_point("retrieve")
@@ -238,17 +429,16 @@ class RAGWorkflow:
             "grade_documents",
             self.decide_to_generate,
             {
-                "transform_query": "transform_query",
+                "transform_query": retry,
                 "generate": "generate",
                 "end_with_message": "end_with_message",
             },
         )
-        workflow.add_edge("transform_query", "retrieve")
         workflow.add_conditional_edges(
             "generate",
             self.grade_generation_v_documents_and_question,
             {
-                "not_useful": "transform_query",
+                "not_useful": retry,
                 "useful": END,
                 "end_with_message": "end_with_message",
             },
@@ -0,0 +1,131 @@
+import asyncio
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+from langchain_core.embeddings import Embeddings
+
+from config import settings
+
+
+class AsyncRateLimiter:
+    """Token bucket rate limiter shared by all coroutines calling one provider."""
+
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        self.requests_per_second = requests_per_second
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a request may be sent to the provider."""
+        if self.requests_per_second <= 0:
+            return
+
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.burst,
+                    self._tokens + (now - self._updated_at) * self.requests_per_second,
+                )
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.requests_per_second)
+
+
+_rate_limiters: Dict[str, AsyncRateLimiter] = {}
+
+
+def get_rate_limiter(provider: str) -> AsyncRateLimiter:
+    """
+    Get the process-wide rate limiter of a provider.
+
+    Args:
+        provider (str): Provider name, a key of `settings.LLM_RATE_LIMITS`.
+
+    Returns:
+        AsyncRateLimiter: The rate limiter, unlimited if the provider is not configured.
+    """
+    if provider not in _rate_limiters:
+        requests_per_second = settings.LLM_RATE_LIMITS.get(provider, 0)
+        _rate_limiters[provider] = AsyncRateLimiter(
+            requests_per_second=requests_per_second,
+            burst=max(int(requests_per_second), 1),
+        )
+
+    return _rate_limiters[provider]
+
+
+class EmbeddingSlots:
+    """Slots of the embedding requests in flight, which waiting queries take first.
+
+    A request holds one of `size` slots while it is in flight. When a slot frees up,
+    a waiting query gets it before the waiting batches, so a query waits for at most
+    the requests already in flight, never for the batches queued behind them.
+    """
+
+    def __init__(self, size: int):
+        self.size = max(size, 1)
+        self._in_flight = 0
+        self._waiting_queries = 0
+        self._condition = threading.Condition()
+
+    @contextmanager
+    def acquire(self, query: bool = False) -> Iterator[None]:
+        """
+        Hold a slot while a request is in flight.
+
+        Args:
+            query (bool): Whether the request embeds a query, which goes first.
+        """
+        with self._condition:
+            if query:
+                self._waiting_queries += 1
+            try:
+                self._condition.wait_for(
+                    lambda: self._in_flight < self.size
+                    and (query or self._waiting_queries == 0)
+                )
+            finally:
+                if query:
+                    self._waiting_queries -= 1
+                    # Batches may take the remaining slots once no query waits
+                    self._condition.notify_all()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+
+class ConcurrencyLimitedEmbeddings(Embeddings):
+    """Embeddings that keep at most a given number of provider requests in flight.
+
+    Every document indexed at once embeds its batches from its own thread, so the
+    requests of all of them share `slots`, one per request, to respect the concurrency
+    limit of the embedding API. Queries, which a user is waiting for, take the next
+    free slot before the batches of an ingestion, see `EmbeddingSlots`.
+    """
+
+    def __init__(self, embeddings: Embeddings, slots: EmbeddingSlots):
+        self.embeddings = embeddings
+        self.slots = slots
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.slots.acquire():
+            return self.embeddings.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        with self.slots.acquire(query=True):
+            return self.embeddings.embed_query(text)
+
+
+# Shared by all the embedding models of the process, see `get_embeddings`
+embedding_slots = EmbeddingSlots(settings.EMBEDDING_MAX_CONCURRENCY)
@@ -33,6 +33,24 @@ class GradeDocuments(BaseModel):
     )
 
 
+class DocumentGrade(BaseModel):
+    """Binary score for relevance check on one of a numbered list of documents."""
+
+    index: int = Field(description="Number of the document in the list")
+    binary_score: str = Field(
+        description="Document is relevant to the question, 'yes' or 'no'",
+        enum=["yes", "no"],
+    )
+
+
+class GradeDocumentsBatch(BaseModel):
+    """Binary scores for relevance check on a numbered list of retrieved documents."""
+
+    grades: List[DocumentGrade] = Field(
+        description="One grade per document, in the order of the list"
+    )
+
+
 class GradeHallucinations(BaseModel):
     """Binary score for hallucination present in generation answer."""
 
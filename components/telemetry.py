@@ -0,0 +1,303 @@
+import bisect
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from components.context_packer import estimate_tokens
+from config import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _labels(labels: Dict[str, Any]) -> Labels:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """Prometheus counter with labels."""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[Labels, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        with self._lock:
+            self._values[_labels(labels)] += amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(labels)} {value}")
+
+        return lines
+
+
+class Histogram:
+    """Prometheus histogram with labels."""
+
+    def __init__(
+        self, name: str, help: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self._counts: Dict[Labels, List[int]] = {}
+        self._sums: Dict[Labels, float] = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = _labels(labels)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sums[key] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for labels, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(labels, ('le', le))} "
+                        f"{cumulative}"
+                    )
+                suffix = _format_labels(labels)
+                lines.append(f"{self.name}_sum{suffix} {self._sums[labels]}")
+                lines.append(f"{self.name}_count{suffix} {cumulative}")
+
+        return lines
+
+
+class Metrics:
+    """Process-wide metrics of the RAG workflow, rendered in the Prometheus format."""
+
+    def __init__(self):
+        self.requests = Counter("rag_requests_total", "Questions answered, by outcome.")
+        self.request_seconds = Histogram(
+            "rag_request_seconds", "Wall time to answer a question."
+        )
+        self.span_seconds = Histogram(
+            "rag_span_seconds", "Wall time of graph nodes, LLM calls and retrievals."
+        )
+        self.llm_calls = Counter("rag_llm_calls_total", "LLM calls, by chain.")
+        self.llm_tokens = Counter(
+            "rag_llm_tokens_total", "LLM tokens, by chain and direction."
+        )
+        self.llm_failovers = Counter(
+            "rag_llm_failovers_total", "Failed LLM calls retried on another provider."
+        )
+        self.provider_seconds = Histogram(
+            "rag_llm_provider_seconds",
+            "Wall time of successful LLM calls, by provider.",
+        )
+        self.documents_retrieved = Counter(
+            "rag_documents_retrieved_total", "Documents returned by the retriever."
+        )
+        self.documents_kept = Counter(
+            "rag_documents_kept_total", "Retrieved documents graded relevant."
+        )
+        self.iterations = Histogram(
+            "rag_iterations", "Query rewrites per question.", buckets=(0, 1, 2, 3, 5)
+        )
+
+    def render(self) -> str:
+        lines = []
+        for metric in vars(self).values():
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+def traced_names(app) -> List[str]:
+    """Names of the nodes and routers of a compiled graph, for `astream_events`."""
+    routers = {name for branches in app.builder.branches.values() for name in branches}
+
+    return sorted((set(app.nodes) - {"__start__"}) | routers)
+
+
+# Run types traced besides the graph's nodes and routers
+TRACED_TYPES = ["chat_model", "retriever"]
+
+
+def _token_counts(event: Dict, start: Dict) -> Tuple[int, int]:
+    """Input and output tokens of a chat model run, estimated without usage data."""
+    output = event["data"].get("output")
+    usage = getattr(output, "usage_metadata", None)
+    if usage:
+        return usage["input_tokens"], usage["output_tokens"]
+
+    messages = start["data"].get("input", {}).get("messages", [[]])
+    prompt = "".join(str(m.content) for batch in messages for m in batch)
+
+    completion = str(getattr(output, "content", ""))
+
+    return estimate_tokens(prompt), estimate_tokens(completion)
+
+
+class RequestTracer:
+    """Trace of one question, built from the events of `astream_events`.
+
+    Graph nodes and routers, chat model calls and retrievals become spans, with
+    their wall time, token counts and document counts. When the request finishes, the
+    spans are aggregated into `metrics` and, when `settings.TRACE_LOG` is set,
+    appended to it as one JSON line by a writer thread, off the event loop.
+    """
+
+    def __init__(self, node_names: Set[str], request_id: Optional[str] = None):
+        self.node_names = set(node_names)
+        self.request_id = request_id or uuid.uuid4().hex
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self._open: Dict[str, Tuple[float, Dict]] = {}
+        self.spans: List[Dict] = []
+        self.finished = False
+
+    def on_event(self, event: Dict) -> None:
+        kind, _, phase = event["event"][3:].rpartition("_")
+        if phase == "start":
+            self._open[event["run_id"]] = (time.perf_counter(), event)
+            return
+        if phase != "end" or event["run_id"] not in self._open:
+            return
+
+        started, start_event = self._open.pop(event["run_id"])
+        name = event["name"]
+        attributes: Dict[str, Any] = {}
+        if kind == "chat_model":
+            span_kind = "llm"
+            input_tokens, output_tokens = _token_counts(event, start_event)
+            attributes.update(input_tokens=input_tokens, output_tokens=output_tokens)
+            model = event["metadata"].get("ls_model_name")
+            if model:
+                attributes["model"] = model
+            metrics.llm_calls.inc(chain=name)
+            metrics.llm_tokens.inc(input_tokens, chain=name, direction="input")
+            metrics.llm_tokens.inc(output_tokens, chain=name, direction="output")
+        elif kind == "retriever":
+            span_kind = "retriever"
+            attributes["documents"] = len(event["data"].get("output") or [])
+            metrics.documents_retrieved.inc(attributes["documents"])
+        elif name in self.node_names:
+            span_kind = "node"
+            output = event["data"].get("output")
+            if isinstance(output, dict) and "documents" in output:
+                attributes["documents"] = len(output["documents"])
+                if name == "grade_documents":
+                    metrics.documents_kept.inc(attributes["documents"])
+            elif isinstance(output, str):
+                attributes["decision"] = output
+        else:
+            return
+
+        duration = time.perf_counter() - started
+        metrics.span_seconds.observe(duration, kind=span_kind, name=name)
+        parent_ids = event.get("parent_ids") or []
+        self.spans.append(
+            {
+                "span_id": event["run_id"],
+                "parent_id": parent_ids[-1] if parent_ids else None,
+                "name": name,
+                "kind": span_kind,
+                "start_ms": round(1000 * (started - self._start), 3),
+                "duration_ms": round(1000 * duration, 3),
+                "attributes": attributes,
+            }
+        )
+
+    def finish(self, outcome: str, iterations: Optional[int] = None) -> None:
+        """
+        Record the request in the metrics and the trace log.
+
+        Args:
+            outcome (str): "answered", "no_answer", "cached" or "error".
+            iterations (Optional[int]): Query rewrites of the request.
+        """
+        if self.finished:
+            return
+        self.finished = True
+
+        duration = time.perf_counter() - self._start
+        metrics.requests.inc(outcome=outcome)
+        metrics.request_seconds.observe(duration)
+        if iterations is not None:
+            metrics.iterations.observe(iterations)
+
+        llm_spans = [span for span in self.spans if span["kind"] == "llm"]
+        logger.info(
+            f"Request {self.request_id} {outcome} in {duration:.2f}s: "
+            f"{len(llm_spans)} LLM calls, "
+            f"{sum(span['attributes']['input_tokens'] for span in llm_spans)} input "
+            f"tokens, {iterations or 0} iterations"
+        )
+
+        if not settings.TRACE_LOG:
+            return
+        trace = {
+            "request_id": self.request_id,
+            "started_at": self.started_at,
+            "duration_ms": round(1000 * duration, 3),
+            "outcome": outcome,
+            "iterations": iterations,
+            "spans": self.spans,
+        }
+        _trace_writer.submit(
+            append_trace,
+            settings.TRACE_LOG,
+            json.dumps(trace) + "\n",
+            settings.TRACE_LOG_MAX_BYTES,
+        )
+
+
+# A single thread appends the traces, in order
+_trace_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="trace-log")
+
+
+def append_trace(path: str, line: str, max_bytes: int) -> None:
+    """
+    Append a trace to the trace log, rotating the log first if it would grow past
+    `max_bytes`.
+
+    Args:
+        path (str): Path of the trace log.
+        line (str): JSON line of the trace.
+        max_bytes (int): Size limit of the log, 0 for none.
+    """
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if max_bytes and os.path.exists(path):
+            if os.path.getsize(path) + len(line) > max_bytes:
+                os.replace(path, f"{path}.1")
+        with open(path, "a") as f:
+            f.write(line)
+    except OSError as e:
+        logger.warning(f"Trace not written to {path}: {e!r}")
@@ -0,0 +1,192 @@
+import hashlib
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+from loguru import logger
+
+from config import settings
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(str(text).lower().split())
+
+
+def text_hash(text: Any) -> str:
+    return hashlib.sha256(str(text).encode()).hexdigest()
+
+
+def _model_of(params: Dict) -> Optional[str]:
+    return params.get("model_name") or params.get("model") or params.get("_type")
+
+
+def model_name(llm: Any) -> str:
+    """
+    Name of the model of a chat model, as reported to its callbacks, or of the model a
+    `ProviderRouter` calls first.
+    """
+    if isinstance(llm, BaseChatModel):
+        return _model_of(llm.dict())
+
+    return getattr(llm, "model_name", None) or type(llm).__name__
+
+
+class ServedModel(BaseCallbackHandler):
+    """Records the model that answered a grader call, e.g. after a failover.
+
+    Verdicts served by a verdict cache are answered by no model.
+    """
+
+    run_inline = True
+
+    def __init__(self):
+        self.answered = False
+        self.model: Optional[str] = None
+        self._models: Dict[UUID, str] = {}
+
+    def on_chat_model_start(
+        self, serialized: Dict, messages: Any, *, run_id: UUID, **kwargs: Any
+    ) -> None:
+        self._models[run_id] = _model_of(kwargs.get("invocation_params") or {})
+
+    def on_llm_end(self, response: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self.answered = True
+        self.model = self._models.get(run_id) or self.model
+
+
+def with_handler(
+    config: RunnableConfig, handler: BaseCallbackHandler
+) -> RunnableConfig:
+    """Config with a callback handler added to its own, inherited by child runs."""
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        callbacks = [handler]
+    elif isinstance(callbacks, list):
+        callbacks = [*callbacks, handler]
+    else:
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+
+    return {**config, "callbacks": callbacks}
+
+
+class VerdictCache:
+    """Bounded LRU cache of the verdicts of one grader."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._verdicts: "OrderedDict[str, Any]" = OrderedDict()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key: str) -> Optional[Any]:
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._verdicts.move_to_end(key)
+
+        return verdict
+
+    def put(self, key: str, verdict: Any) -> None:
+        self._verdicts[key] = verdict
+        self._verdicts.move_to_end(key)
+        if len(self._verdicts) > self.max_entries:
+            self._verdicts.popitem(last=False)
+
+    def clear(self) -> None:
+        self._verdicts.clear()
+
+
+verdict_caches: Dict[str, VerdictCache] = {}
+
+
+def get_verdict_cache(grader: str) -> VerdictCache:
+    """Get the process-wide verdict cache of a grader."""
+    return verdict_caches.setdefault(
+        grader, VerdictCache(max_entries=settings.GRADER_CACHE_MAX_ENTRIES)
+    )
+
+
+def verdict_cache_stats() -> Dict[str, Dict[str, float]]:
+    """Hits, misses and hit rate of every grader's verdict cache."""
+    return {
+        grader: {"hits": cache.hits, "misses": cache.misses, "hit_rate": cache.hit_rate}
+        for grader, cache in verdict_caches.items()
+    }
+
+
+def with_verdict_cache(
+    grader: Runnable, name: str, key_fn: Callable[[Dict], str], llm: Any
+) -> Runnable:
+    """
+    Memoize the verdicts of a grader chain.
+
+    Verdicts are keyed by the model that gave them too. They are looked up for the
+    model `llm` calls first, and stored for the model that answered, so verdicts of
+    another model are not reused after a failover or a model change.
+
+    The cache is skipped when `settings.GRADER_CACHE_ENABLED` is off, or for a single
+    run when `config["configurable"]["use_grader_cache"]` is False, e.g. for
+    evaluation runs.
+
+    Args:
+        grader (Runnable): The grader chain.
+        name (str): Name of the grader.
+        key_fn (Callable[[Dict], str]): Cache key of an input of the grader.
+        llm (Any): The chat model of the grader, or its `ProviderRouter`.
+
+    Returns:
+        Runnable: The grader chain with its verdicts cached.
+    """
+    if not settings.GRADER_CACHE_ENABLED:
+        return grader
+
+    cache = get_verdict_cache(name)
+
+    def use_cache(config: RunnableConfig) -> bool:
+        return config.get("configurable", {}).get("use_grader_cache", True)
+
+    def grade(input: Dict, config: RunnableConfig) -> Any:
+        if not use_cache(config):
+            return grader.invoke(input, config)
+
+        key = key_fn(input)
+        model = model_name(llm)
+        verdict = cache.get(f"{model}|{key}")
+        if verdict is None:
+            served = ServedModel()
+            verdict = grader.invoke(input, with_handler(config, served))
+            cache.put(f"{served.model or model}|{key}", verdict)
+        else:
+            logger.info(f"{name.upper()}: CACHED VERDICT")
+
+        return verdict
+
+    async def agrade(input: Dict, config: RunnableConfig) -> Any:
+        if not use_cache(config):
+            return await grader.ainvoke(input, config)
+
+        key = key_fn(input)
+        model = model_name(llm)
+        verdict = cache.get(f"{model}|{key}")
+        if verdict is None:
+            served = ServedModel()
+            verdict = await grader.ainvoke(input, with_handler(config, served))
+            cache.put(f"{served.model or model}|{key}", verdict)
+        else:
+            logger.info(f"{name.upper()}: CACHED VERDICT")
+
+        return verdict
+
+    return RunnableLambda(grade, afunc=agrade, name=f"cached_{name}")
@@ -1,5 +1,5 @@
 import os
-from typing import Union
+from typing import Dict, Literal, Optional, Union
 
 from pydantic_settings import BaseSettings
 
@@ -21,6 +21,125 @@ class Base(BaseSettings):
     YI_API_KEY: str
     YI_BASE_URL: str
 
+    # Retrieval grading
+    GRADER_MAX_CONCURRENCY: int = 8
+    GRADER_TIMEOUT_SECONDS: float = 30.0
+    # "batch" grades the retrieved documents in one listwise call per batch
+    GRADER_MODE: Literal["per_document", "batch"] = "per_document"
+    GRADER_BATCH_SIZE: int = 10
+    # Requests per second allowed per LLM provider, 0 means unlimited
+    LLM_RATE_LIMITS: Dict[str, float] = {"yi": 8.0, "google": 4.0}
+
+    # Shared LLM clients and failover between providers
+    LLM_MAX_CONNECTIONS: int = 100
+    LLM_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    LLM_KEEPALIVE_EXPIRY_SECONDS: float = 30.0
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+    LLM_MAX_RETRIES: int = 1
+    LLM_FAILOVER_ERROR_RATE: float = 0.5
+    LLM_FAILOVER_LATENCY_RATIO: float = 3.0
+    LLM_FAILOVER_PROBE_RATE: float = 0.05
+
+    # Content-addressed index store
+    INDEX_CACHE_DIR: str = "resources/qdrant_db"
+    INDEX_CACHE_MAX_BYTES: int = 2 * 1024**3
+    # Index a file uploaded under the name of a file indexed for the same user from
+    # its index, if at least this share of the chunks of the first batch of the file,
+    # see INDEX_BATCH_SIZE, are in that index.
+    # Only authenticated users have revisions, see AUTH_USER_HEADER
+    INCREMENTAL_REINDEX: bool = True
+    INCREMENTAL_MIN_SHARED_CHUNKS: float = 0.5
+    # Header with the name of the user, set by an authenticating proxy in front of
+    # the app. Setting it turns on Chainlit authentication, which needs
+    # CHAINLIT_AUTH_SECRET
+    AUTH_USER_HEADER: Optional[str] = None
+    # Open indexes that no session uses are closed after this many seconds
+    INDEX_IDLE_SECONDS: float = 600.0
+    # Vectors searched once an index is built: "full" in the Qdrant collection, "int8"
+    # or "binary" quantized in memory, the best candidates being rescored with the
+    # original vectors read from disk
+    VECTOR_STORAGE: Literal["full", "int8", "binary"] = "full"
+    VECTOR_RESCORE: bool = True
+    VECTOR_OVERSAMPLING: float = 3.0
+
+    # Per-chunk embedding cache shared across documents
+    EMBEDDING_CACHE_ENABLED: bool = True
+    EMBEDDING_CACHE_DIR: str = "resources/embedding_cache"
+    EMBEDDING_CACHE_DTYPE: str = "float16"
+    # Embedding API requests in flight at once, across all documents being indexed
+    # and the queries, which take the next free one first
+    EMBEDDING_MAX_CONCURRENCY: int = 4
+
+    # Streaming ingestion, 0 workers means one per CPU
+    INGEST_WORKERS: int = 0
+    INGEST_PAGES_PER_TASK: int = 8
+    # Documents parsed and embedded at once, the others of a corpus wait their turn
+    INGEST_MAX_DOCUMENTS: int = 4
+    # PDF files uploaded at once, searched as one corpus
+    MAX_UPLOAD_FILES: int = 50
+    INDEX_BATCH_SIZE: int = 128
+
+    # Semantic answer cache in front of the RAG workflow
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 1000
+    ANSWER_CACHE_TTL_SECONDS: float = 24 * 3600
+    ANSWER_CACHE_SIMILARITY_THRESHOLD: float = 0.95
+
+    # Grader verdict cache, turn off for evaluation runs
+    GRADER_CACHE_ENABLED: bool = True
+    GRADER_CACHE_MAX_ENTRIES: int = 10000
+
+    # Stream the answer tokens, or show the whole answer while it is graded, and
+    # withdraw it if grading fails
+    STREAM_ANSWER: bool = True
+    SPECULATIVE_ANSWER: bool = False
+
+    # Hybrid retrieval, vector and BM25 candidates fused by reciprocal rank
+    HYBRID_RETRIEVAL: bool = True
+    RETRIEVAL_TOP_K: int = 5
+    RETRIEVAL_CANDIDATES: int = 20
+    RRF_K: int = 60
+
+    # "rewrite_loop" rewrites the question and retrieves again, one rewrite at a time,
+    # "multi_query" retrieves for several rewrites at once in a single wider round
+    RETRIEVAL_MODE: Literal["rewrite_loop", "multi_query"] = "rewrite_loop"
+    MULTI_QUERY_COUNT: int = 3
+    MULTI_QUERY_TOP_K: int = 8
+
+    # Pre-grading of retrieved chunks by vector score and query term overlap, only
+    # the chunks in between the thresholds go to the LLM grader. A chunk may contain
+    # every query term without answering the question, so the overlap alone accepts
+    # no chunk until calibrated. Verdicts of the LLM grader are logged to calibrate
+    # the thresholds when a log path is set
+    PRE_GRADER_ENABLED: bool = True
+    PRE_GRADER_ACCEPT_SCORE: float = 0.85
+    PRE_GRADER_REJECT_SCORE: float = 0.3
+    PRE_GRADER_ACCEPT_OVERLAP: float = float("inf")
+    PRE_GRADER_REJECT_OVERLAP: float = 0.0
+    GRADER_VERDICT_LOG: Optional[str] = None
+
+    # Token budgets of the retrieved context per chain, tokens are estimated from
+    # the number of characters
+    GENERATE_CONTEXT_MAX_TOKENS: int = 3000
+    HALLUCINATION_CONTEXT_MAX_TOKENS: int = 3000
+    CHARS_PER_TOKEN: float = 4.0
+
+    # Per-request trace spans, one JSON line per request when a path is set. A log
+    # past the size limit is rotated to "<path>.1", replacing the previous one
+    TRACE_LOG: Optional[str] = None
+    TRACE_LOG_MAX_BYTES: int = 50_000_000
+
+    # Sampled CPU profiles of chat requests, saved per request id. Sessions sampled
+    # at the session rate have all their requests profiled
+    PROFILE_SAMPLE_RATE: float = 0.0
+    PROFILE_SESSION_SAMPLE_RATE: float = 0.0
+    PROFILE_INTERVAL_SECONDS: float = 0.01
+    PROFILE_MAX_SECONDS: float = 120.0
+    PROFILE_DIR: str = "resources/profiles"
+
+    # Characters of each document shown in the UI steps
+    STEP_DOCUMENT_MAX_CHARS: int = 300
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,38 @@
+import benchmarks  # noqa: F401, fills the provider settings
+
+import os
+from typing import Callable, List
+
+import pytest
+
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.sample_pdfs import write_pdf
+from components.document_loader import shutdown_executor
+from components.index_cache import index_cache
+
+
+@pytest.fixture
+def index_root(tmp_path, monkeypatch) -> str:
+    """Empty index cache in a temporary directory."""
+    root = str(tmp_path / "indexes")
+    monkeypatch.setattr(index_cache, "root_directory", root)
+    monkeypatch.setattr(index_cache, "pinned", set())
+    yield root
+    shutdown_executor()
+
+
+@pytest.fixture
+def embeddings() -> HashingEmbeddings:
+    return HashingEmbeddings(size=128, dense=True)
+
+
+@pytest.fixture
+def make_pdf(tmp_path) -> Callable[[str, List[str]], str]:
+    """Write a PDF with one page per text, returning its path."""
+
+    def make(name: str, pages: List[str]) -> str:
+        path = os.path.join(str(tmp_path), name)
+        write_pdf(path, pages)
+        return path
+
+    return make
@@ -0,0 +1,115 @@
+"""The chat handler answers over a single document and over a corpus of documents."""
+
+import asyncio
+from types import SimpleNamespace
+
+import chainlit
+import pytest
+
+import app
+from benchmarks.fakes import FakeChatModel
+from benchmarks.sample_pdfs import sample_document
+from components.corpus_index import CorpusIndex
+from components.index_cache import index_cache
+from components.progressive_index import ProgressiveIndex, ProgressiveRetriever
+from components.rag_workflow import RAGWorkflow
+from config import settings
+
+ANSWER = "The termination period is 30 days."
+
+
+class FakeStep:
+    def __init__(self, **kwargs):
+        self.output = ""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def update(self):
+        pass
+
+
+class FakeLiveAnswer:
+    sent = []
+
+    async def on_event(self, event):
+        pass
+
+    async def send(self, answer, elements):
+        self.sent.append((answer, elements))
+
+
+@pytest.fixture
+def chat(index_root, embeddings, monkeypatch):
+    """Runs the chat handler on a question, outside of a Chainlit server."""
+    llm = FakeChatModel(latency=0.0, answer=ANSWER)
+    monkeypatch.setattr(
+        app, "rag_app", RAGWorkflow(llm=llm, llm1=llm).create_workflow().compile()
+    )
+    monkeypatch.setattr(app, "LiveAnswer", FakeLiveAnswer)
+    monkeypatch.setattr(chainlit, "Step", FakeStep)
+    monkeypatch.setattr(chainlit, "Pdf", lambda **kwargs: SimpleNamespace(**kwargs))
+    monkeypatch.setattr(settings, "ANSWER_CACHE_ENABLED", False)
+    FakeLiveAnswer.sent = []
+
+    def ask(index, files, question):
+        retriever = ProgressiveRetriever(index=index, k=settings.RETRIEVAL_TOP_K)
+        session = {"retriever": retriever, "files": files, "index": index}
+        monkeypatch.setattr(chainlit, "user_session", session)
+        asyncio.run(app.main(SimpleNamespace(content=question, id="request")))
+
+        return FakeLiveAnswer.sent[-1]
+
+    return ask
+
+
+def open_document(path, embeddings) -> ProgressiveIndex:
+    async def build() -> ProgressiveIndex:
+        key = index_cache.key_for(path)
+        index = await ProgressiveIndex.start(path, key, embeddings=embeddings)
+        await index.wait_done()
+        return index
+
+    return asyncio.run(build())
+
+
+def test_answers_over_a_finished_corpus(chat, make_pdf, embeddings):
+    files, indexes = {}, {}
+    for seed in range(2):
+        pages, questions = sample_document(5, seed=seed)
+        path = make_pdf(f"document-{seed}.pdf", pages)
+        index = open_document(path, embeddings)
+        indexes[index.key] = index
+        files[index.key] = SimpleNamespace(name=f"document-{seed}.pdf", path=path)
+    corpus = CorpusIndex(indexes=indexes, files=files, embeddings=embeddings)
+    assert corpus.done
+
+    try:
+        answer, elements = chat(corpus, files, questions[0])
+    finally:
+        for index in indexes.values():
+            index.close()
+
+    assert answer.startswith(ANSWER)
+    assert "indexed so far" not in answer
+    assert elements
+    assert all(element.name.startswith("document-") for element in elements)
+
+
+def test_answers_over_a_finished_document(chat, make_pdf, embeddings):
+    pages, questions = sample_document(5)
+    path = make_pdf("document.pdf", pages)
+    index = open_document(path, embeddings)
+    files = {index.key: SimpleNamespace(name="document.pdf", path=path)}
+
+    try:
+        answer, elements = chat(index, files, questions[0])
+    finally:
+        index.close()
+
+    assert answer.startswith(ANSWER)
+    assert "indexed so far" not in answer
+    assert elements
@@ -0,0 +1,240 @@
+"""A revision of a document is indexed from the index of its previous revision, which
+answers until the new index is published."""
+
+import asyncio
+import threading
+from typing import List
+
+import pytest
+
+import components.progressive_index as progressive_index
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.sample_pdfs import sample_document
+from components.chainlit import create_retriever
+from components.chainlit.create_retriever import release_when_indexed
+from components.document_loader import load_documents
+from components.index_builder import build_index, point_id, update_index
+from components.index_cache import index_cache
+from components.index_registry import IndexRegistry
+from components.lexical_index import chunk_key
+from components.progressive_index import ProgressiveIndex
+
+NUM_PAGES = 30
+NEW_PAGE = "Appendix about zebras and giraffes grazing on the savanna."
+
+
+class CountingEmbeddings(HashingEmbeddings):
+    """Counts the embedded chunks, and embeds them once `gate` is set."""
+
+    def __init__(self):
+        super().__init__(size=128, dense=True)
+        self.embedded = 0
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.gate.wait()
+        self.embedded += len(texts)
+        return super().embed_documents(texts)
+
+
+def revise(pages: List[str]) -> List[str]:
+    """Edit page 6, remove page 11 and add a page at the end."""
+    pages = list(pages)
+    pages[5] = "Section 6. The renewal period is 999 days, as amended."
+    del pages[10]
+    pages.append(NEW_PAGE)
+    return pages
+
+
+@pytest.fixture
+def revisions(index_root, make_pdf):
+    """Paths of a 30-page sample document and of its revision."""
+    pages, _ = sample_document(NUM_PAGES)
+    return make_pdf("v1.pdf", pages), make_pdf("v2.pdf", revise(pages))
+
+
+def open_index(path, embeddings, previous=None) -> ProgressiveIndex:
+    async def build() -> ProgressiveIndex:
+        key = index_cache.key_for(path)
+        index = await ProgressiveIndex.start(
+            path, key, previous=previous, embeddings=embeddings
+        )
+        await index.wait_done()
+        return index
+
+    return asyncio.run(build())
+
+
+def sources(documents) -> set:
+    return {doc.metadata["source"] for doc in documents}
+
+
+def test_update_embeds_the_added_chunks_only(revisions, tmp_path):
+    v1, v2 = revisions
+    embeddings = CountingEmbeddings()
+    vector_db = build_index(
+        load_documents(v1), str(tmp_path / "v1"), embeddings=embeddings
+    )
+    vector_db.client.close()
+    old_pages = {chunk_key(doc): doc.metadata["page"] for doc in load_documents(v1)}
+    old_keys = set(old_pages)
+    new_documents = load_documents(v2)
+    new_keys = {chunk_key(doc) for doc in new_documents}
+    embeddings.embedded = 0
+
+    vector_db = update_index(
+        iter(new_documents),
+        base_directory=str(tmp_path / "v1"),
+        persist_directory=str(tmp_path / "v2"),
+        embeddings=embeddings,
+    )
+    points, _ = vector_db.client.scroll(
+        vector_db.collection_name, limit=10 * len(new_documents)
+    )
+    vector_db.client.close()
+
+    added = new_keys - old_keys
+    assert 0 < len(added) < len(new_keys) // 10
+    assert embeddings.embedded == len(added)
+    assert old_keys - new_keys
+    # Same points as a full build: one per chunk, with uuid5 ids and new metadata
+    assert {point.id for point in points} == {
+        point_id(doc) for doc in new_documents
+    }
+    metadata = {doc.metadata["chunk_id"]: doc.metadata for doc in new_documents}
+    for point in points:
+        expected = metadata[point.payload["metadata"]["chunk_id"]]
+        assert point.payload["metadata"]["page"] == expected["page"]
+        assert point.payload["metadata"]["source"] == v2
+    moved = [
+        doc
+        for doc in new_documents
+        if old_pages.get(chunk_key(doc), doc.metadata["page"]) != doc.metadata["page"]
+    ]
+    assert len(moved) > len(added)
+
+
+def test_previous_revision_answers_until_the_update_is_published(revisions):
+    v1, v2 = revisions
+    embeddings = CountingEmbeddings()
+    previous = open_index(v1, embeddings)
+    embeddings.gate.clear()
+
+    async def update() -> None:
+        index = await ProgressiveIndex.start(
+            v2, index_cache.key_for(v2), previous=previous, embeddings=embeddings
+        )
+        assert index.previous is previous
+        assert sources(index.search(NEW_PAGE, k=3)) == {v1}
+
+        embeddings.gate.set()
+        await index.wait_done()
+        assert index.previous is None
+        assert index.search(NEW_PAGE, k=1)[0].page_content.startswith("Appendix")
+        assert sources(index.search(NEW_PAGE, k=3)) == {v2}
+        index.close()
+
+    try:
+        asyncio.run(update())
+    finally:
+        embeddings.gate.set()
+        previous.close()
+
+
+def test_unrelated_document_is_built_in_full(index_root, make_pdf):
+    pages, _ = sample_document(NUM_PAGES)
+    other, _ = sample_document(NUM_PAGES, seed=7)
+    other = [
+        f"Unrelated memo {number} about catering. {page[::-1]}"
+        for number, page in enumerate(other)
+    ]
+    embeddings = CountingEmbeddings()
+    previous = open_index(make_pdf("v1.pdf", pages), embeddings)
+    path = make_pdf("v2.pdf", other)
+    embeddings.embedded = 0
+
+    index = open_index(path, embeddings, previous=previous)
+    try:
+        assert index.previous is None
+        assert embeddings.embedded >= len(load_documents(path))
+        assert sources(index.search("catering memo", k=3)) == {path}
+    finally:
+        index.close()
+        previous.close()
+
+
+def test_previous_revision_answers_when_the_update_fails(revisions, monkeypatch):
+    v1, v2 = revisions
+    embeddings = CountingEmbeddings()
+    previous = open_index(v1, embeddings)
+
+    def failing_update(**kwargs):
+        raise RuntimeError("provider down")
+
+    monkeypatch.setattr(progressive_index, "update_index", failing_update)
+
+    async def update() -> None:
+        index = await ProgressiveIndex.start(
+            v2, index_cache.key_for(v2), previous=previous, embeddings=embeddings
+        )
+        with pytest.raises(RuntimeError):
+            await index.wait_done()
+        assert index.previous is previous
+        assert sources(index.search(NEW_PAGE, k=3)) == {v1}
+        assert index_cache.lookup(index.key) is None
+
+    try:
+        asyncio.run(update())
+    finally:
+        previous.close()
+
+
+def test_previous_revision_is_released_after_the_failed_update(
+    revisions, embeddings, monkeypatch
+):
+    v1, v2 = revisions
+    registry = IndexRegistry(idle_seconds=0.05)
+    monkeypatch.setattr(create_retriever, "index_registry", registry)
+    key = index_cache.key_for(v2)
+
+    def failing_update(**kwargs):
+        raise RuntimeError("provider down")
+
+    async def open_revision() -> ProgressiveIndex:
+        previous = await registry.acquire(
+            index_cache.key_for(v1), lambda: open_published(v1)
+        )
+        index = await ProgressiveIndex.start(
+            v2, key, previous=previous, embeddings=embeddings
+        )
+        asyncio.create_task(release_when_indexed(index, previous))
+        return index
+
+    async def open_published(path) -> ProgressiveIndex:
+        return ProgressiveIndex.from_directory(
+            index_cache.key_for(path), embeddings=embeddings
+        )
+
+    # Published, for the registry to open it
+    open_index(v1, embeddings).close()
+
+    async def sessions() -> None:
+        monkeypatch.setattr(progressive_index, "update_index", failing_update)
+        first = await registry.acquire(key, open_revision)
+        second = await registry.acquire(key, open_revision)
+        with pytest.raises(RuntimeError):
+            await first.wait_done()
+        await asyncio.sleep(0.1)
+        assert sources(first.search(NEW_PAGE, k=3)) == {v1}
+
+        registry.release(key, first)
+        await asyncio.sleep(0.1)
+        assert sources(second.search(NEW_PAGE, k=3)) == {v1}
+
+        registry.release(key, second)
+        await asyncio.sleep(0.1)
+        assert len(registry) == 0
+        assert second.search(NEW_PAGE, k=3) == []
+
+    asyncio.run(sessions())
@@ -0,0 +1,157 @@
+"""Sessions share the open index of a document, which is closed once they are gone."""
+
+import asyncio
+
+import pytest
+
+import components.progressive_index as progressive_index
+from benchmarks.sample_pdfs import sample_document
+from components.index_cache import index_cache
+from components.index_registry import IndexRegistry
+from components.progressive_index import ProgressiveIndex
+
+IDLE_SECONDS = 0.05
+
+
+@pytest.fixture
+def document(index_root, make_pdf):
+    """Path, index cache key and a question of a sample document."""
+    pages, questions = sample_document(5)
+    path = make_pdf("document.pdf", pages)
+    return path, index_cache.key_for(path), questions[0]
+
+
+def is_closed(index: ProgressiveIndex) -> bool:
+    return index.vector_db is None and index.quantized is None
+
+
+def opener(path, key, embeddings):
+    """Opens the index of a document, counting the calls."""
+
+    async def open_index() -> ProgressiveIndex:
+        open_index.calls += 1
+        if index_cache.lookup(key) is not None:
+            return ProgressiveIndex.from_directory(key, embeddings=embeddings)
+        return await ProgressiveIndex.start(path, key, embeddings=embeddings)
+
+    open_index.calls = 0
+    return open_index
+
+
+def test_sessions_share_an_index_closed_when_idle(document, embeddings):
+    path, key, question = document
+    open_index = opener(path, key, embeddings)
+
+    async def sessions() -> None:
+        registry = IndexRegistry(idle_seconds=IDLE_SECONDS)
+        first, second = await asyncio.gather(
+            registry.acquire(key, open_index), registry.acquire(key, open_index)
+        )
+        assert first is second
+        assert open_index.calls == 1
+        assert key in index_cache.pinned
+        await first.wait_done()
+
+        registry.release(key, first)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert key in registry
+        assert first.search(question, k=3)
+
+        registry.release(key, second)
+        # Acquired again before it is closed, the index stays open
+        third = await registry.acquire(key, open_index)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert third is first
+        assert not is_closed(first)
+
+        registry.release(key, third)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert key not in registry
+        assert key not in index_cache.pinned
+        assert is_closed(first)
+
+        # Reopened from the index cache on next use
+        reopened = await registry.acquire(key, open_index)
+        assert reopened is not first
+        assert open_index.calls == 2
+        assert reopened.search(question, k=3)
+        registry.release(key, reopened)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert is_closed(reopened)
+
+    asyncio.run(sessions())
+
+
+def test_failing_open_is_retried(document, embeddings):
+    path, key, _ = document
+    open_index = opener(path, key, embeddings)
+
+    async def failing_open() -> ProgressiveIndex:
+        raise RuntimeError("cannot open")
+
+    async def sessions() -> None:
+        registry = IndexRegistry(idle_seconds=IDLE_SECONDS)
+        results = await asyncio.gather(
+            registry.acquire(key, failing_open),
+            registry.acquire(key, failing_open),
+            return_exceptions=True,
+        )
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert key not in registry
+        assert key not in index_cache.pinned
+
+        index = await registry.acquire(key, open_index)
+        await index.wait_done()
+        registry.release(key, index)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+
+    asyncio.run(sessions())
+
+
+def test_failed_build_is_closed_when_its_sessions_release_it(
+    document, embeddings, monkeypatch
+):
+    path, key, question = document
+    open_index = opener(path, key, embeddings)
+    build_index = progressive_index.build_index
+
+    def failing_build(on_batch, **kwargs):
+        def fail_after_first_batch(vector_db, documents):
+            on_batch(vector_db, documents)
+            raise RuntimeError("provider down")
+
+        return build_index(on_batch=fail_after_first_batch, **kwargs)
+
+    async def sessions() -> None:
+        registry = IndexRegistry(idle_seconds=IDLE_SECONDS)
+        monkeypatch.setattr(progressive_index, "build_index", failing_build)
+        failed = await registry.acquire(key, open_index)
+        assert await registry.acquire(key, open_index) is failed
+        with pytest.raises(RuntimeError):
+            await failed.wait_done()
+        await asyncio.sleep(0)
+        assert key not in registry
+        # Its sessions still search the pages indexed before the failure
+        assert failed.search(question, k=3)
+
+        # The next session builds the index again
+        monkeypatch.setattr(progressive_index, "build_index", build_index)
+        rebuilt = await registry.acquire(key, open_index)
+        assert rebuilt is not failed
+        await rebuilt.wait_done()
+
+        # Releasing the failed index leaves the rebuilt one open
+        registry.release(key, failed)
+        registry.release(key, failed)
+        await registry.wait_released(failed)
+        assert is_closed(failed)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert key in registry
+        assert rebuilt.search(question, k=3)
+
+        registry.release(key, rebuilt)
+        await asyncio.sleep(2 * IDLE_SECONDS)
+        assert key not in registry
+        assert is_closed(rebuilt)
+
+    asyncio.run(sessions())
@@ -0,0 +1,59 @@
+"""Embedding requests stay within the concurrency limit, and queries go first."""
+
+import threading
+import time
+from typing import List
+
+import pytest
+
+from benchmarks.fakes import HashingEmbeddings
+from components.rate_limiter import ConcurrencyLimitedEmbeddings, EmbeddingSlots
+
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """Records the requests in flight, and the order they were sent in."""
+
+    def __init__(self):
+        super().__init__(size=8)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.sent: List[str] = []
+        self._lock = threading.Lock()
+
+    def _request(self, name: str) -> None:
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            self.sent.append(name)
+        time.sleep(0.05)
+        with self._lock:
+            self.in_flight -= 1
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self._request("batch")
+        return super().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        self._request("query")
+        return super().embed_query(text)
+
+
+@pytest.mark.parametrize("size", [1, 2])
+def test_queries_go_before_waiting_batches_within_the_limit(size):
+    recording = RecordingEmbeddings()
+    embeddings = ConcurrencyLimitedEmbeddings(recording, slots=EmbeddingSlots(size))
+    batches = [
+        threading.Thread(target=embeddings.embed_documents, args=(["text"],))
+        for _ in range(4 * size)
+    ]
+    for thread in batches:
+        thread.start()
+    time.sleep(0.01)
+    query = threading.Thread(target=embeddings.embed_query, args=("question",))
+    query.start()
+    for thread in batches + [query]:
+        thread.join()
+
+    assert recording.max_in_flight == size
+    # The query only waits for the batches that were in flight
+    assert recording.sent.index("query") == size
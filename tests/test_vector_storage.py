@@ -0,0 +1,63 @@
+"""The vector storage modes must score chunks alike, the pre-grader thresholds depend
+on the scale of `vector_score`."""
+
+import benchmarks  # noqa: F401, fills the provider settings
+
+import pytest
+
+from benchmarks.fakes import HashingEmbeddings
+from benchmarks.sample_pdfs import sample_document, write_pdf
+from components.document_loader import load_documents, shutdown_executor
+from components.index_builder import build_index
+from components.index_cache import index_cache
+from components.progressive_index import ProgressiveIndex
+from config import settings
+
+KEY = "sample"
+NUM_PAGES = 30
+QUERY = "How many days is the termination period?"
+
+
+@pytest.fixture
+def embeddings(tmp_path, monkeypatch):
+    """Embeddings of a sample document published to a temporary index cache."""
+    monkeypatch.setattr(index_cache, "root_directory", str(tmp_path))
+    monkeypatch.setattr(settings, "HYBRID_RETRIEVAL", False)
+    monkeypatch.setattr(settings, "VECTOR_RESCORE", True)
+
+    pages, _ = sample_document(NUM_PAGES)
+    path = str(tmp_path / "sample.pdf")
+    write_pdf(path, pages)
+    documents = load_documents(path)
+    shutdown_executor()
+
+    embeddings = HashingEmbeddings(size=128, dense=True)
+    vector_db = build_index(
+        documents, persist_directory=index_cache.path(KEY), embeddings=embeddings
+    )
+    vector_db.client.close()
+
+    return embeddings
+
+
+def vector_scores(storage, embeddings, monkeypatch):
+    monkeypatch.setattr(settings, "VECTOR_STORAGE", storage)
+    index = ProgressiveIndex.from_directory(KEY, NUM_PAGES, embeddings=embeddings)
+    try:
+        documents = index.search(QUERY, k=5)
+    finally:
+        index.close()
+
+    return {doc.metadata["chunk_id"]: doc.metadata["vector_score"] for doc in documents}
+
+
+@pytest.mark.parametrize("storage", ["int8", "binary"])
+def test_quantized_scores_match_full_storage(storage, embeddings, monkeypatch):
+    full = vector_scores("full", embeddings, monkeypatch)
+    quantized = vector_scores(storage, embeddings, monkeypatch)
+
+    shared = full.keys() & quantized.keys()
+    assert len(shared) >= 3
+    for chunk_id in shared:
+        assert 0.0 <= quantized[chunk_id] <= 1.0
+        assert quantized[chunk_id] == pytest.approx(full[chunk_id], abs=1e-3)